@@ -1,5 +1,7 @@
 #include "constants.h"
 #include <bitset>
+#include <cstdint>
+#include <cstdlib>
 #include <fstream>
 #include <iostream>
 #include <unordered_map>
@@ -93,21 +95,71 @@ const unsigned long long LAST_NIBBLE_BITMASK = 15;   // bitmask to get last nibb
 
 // Import saved lookup tables for sliding rook-like and bishop-like attacks.
 // This needs to be called in main() to initialize the variables.
+//
+// The tables are read from the binary table file written by lookup_tables.py: a 16-byte
+// header (magic "1DAT", uint16 version, uint16 entry size, uint32 entry count, uint32
+// CRC-32) followed by little-endian uint16 entries indexed by
+// (nibble << 20) | (square << 16) | occupancy. Assumes a little-endian machine.
+//
+// Like the Python loader, the header, the length of the file and the checksum of the
+// entries are all checked. The table is indexed without bounds checks, so if any check
+// fails the program exits rather than carrying on with a missing or partial table.
+const uint32_t NUM_LOOKUP_ENTRIES = 10485760; // 10 nibbles * 16 squares * 2^16 occupancies.
 vector<unsigned int>
-    attackLookup(10485729);
-void importLookupTables(vector<unsigned int> &attackLookup)
+    attackLookup(NUM_LOOKUP_ENTRIES);
+
+// CRC-32 of a buffer, as computed by zlib.crc32 (reflected polynomial 0xEDB88320).
+uint32_t crc32(const unsigned char *data, size_t length)
 {
-    std::ifstream file("mapping.txt");
-    string line;
-    unsigned long long occupancy;
-    unsigned int moveset;
-    while (std::getline(file, line))
+    static uint32_t table[256];
+    static bool initialized = false;
+    if (!initialized)
     {
-        std::stringstream ss;
-        ss << line;
-        ss >> occupancy >> moveset;
-        attackLookup[occupancy] = moveset;
+        for (uint32_t i = 0; i < 256; i++)
+        {
+            uint32_t c = i;
+            for (int k = 0; k < 8; k++)
+                c = (c & 1) ? 0xEDB88320 ^ (c >> 1) : c >> 1;
+            table[i] = c;
+        }
+        initialized = true;
     }
+    uint32_t crc = 0xFFFFFFFF;
+    for (size_t i = 0; i < length; i++)
+        crc = table[(crc ^ data[i]) & 0xFF] ^ (crc >> 8);
+    return crc ^ 0xFFFFFFFF;
+}
+
+void failImportLookupTables(const string &reason)
+{
+    std::cerr << "attacks.bin " << reason << "; run lookup_tables.py" << std::endl;
+    std::exit(EXIT_FAILURE);
+}
+
+void importLookupTables(vector<unsigned int> &attackLookup)
+{
+    std::ifstream file("attacks.bin", std::ios::binary);
+    if (!file)
+        failImportLookupTables("is missing");
+    char magic[4];
+    uint16_t version, entrySize;
+    uint32_t numEntries, checksum;
+    file.read(magic, 4);
+    file.read(reinterpret_cast<char *>(&version), sizeof(version));
+    file.read(reinterpret_cast<char *>(&entrySize), sizeof(entrySize));
+    file.read(reinterpret_cast<char *>(&numEntries), sizeof(numEntries));
+    file.read(reinterpret_cast<char *>(&checksum), sizeof(checksum));
+    if (!file || string(magic, 4) != "1DAT" || version != 1 || entrySize != 2 ||
+        numEntries != NUM_LOOKUP_ENTRIES)
+        failImportLookupTables("has an invalid header");
+    vector<uint16_t> entries(numEntries);
+    std::streamsize numBytes = std::streamsize(numEntries) * entrySize;
+    file.read(reinterpret_cast<char *>(entries.data()), numBytes);
+    if (file.gcount() != numBytes || file.peek() != std::ifstream::traits_type::eof())
+        failImportLookupTables("has the wrong length");
+    if (crc32(reinterpret_cast<const unsigned char *>(entries.data()), numBytes) != checksum)
+        failImportLookupTables("failed its checksum");
+    attackLookup.assign(entries.begin(), entries.end());
 }
 
 /*
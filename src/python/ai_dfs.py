@@ -1,8 +1,221 @@
+# Search-based player.
+#
+# Moves are picked with the iterative deepening search in evaluate.py, under a budget of
+# time or nodes per move, so that the player is as strong as it can be while answering
+# in bounded time. A Player keeps its transposition table and move ordering between the
+# moves of a game, so each search starts from what the previous ones learned, and it
+# remembers the boards of the game so far so that it can see threefold repetitions.
+# Forced wins are searched again for the shortest line (see score_position_iterative),
+# so that a winning player makes progress towards mate.
+#
+# A game is followed from the positions the player is asked to move in: if a position
+# can't follow from the last one by the opponent's move (or is the same one, when a
+# single player plays both sides), a new game has started, and the table and history
+# are cleared.
+#
+# If ponder is set, after returning a move the player keeps searching in a background
+# thread, on the position after the reply it expects, until it is asked for its next
+# move or its pondering budget runs out. That fills the transposition table with the
+# positions it's likely to search next. Python threads share one interpreter lock, so
+# pondering takes time from an opponent that is thinking in the same process; it pays
+# off against opponents that don't (such as people, or players in other processes).
+# The player isn't told when a game ends on the opponent's move, so whoever runs the
+# game should stop it pondering then: main.run_game does, or call close (or use the
+# player as a context manager).
+#
+# Pass a Player's move method as a move function, e.g. main.AI_WHITE = Player().move,
+# or use the module-level move, which uses a default player.
+
+import cache as Cache
+import evaluate
 import position as Position
-import random
+import tablebase as Tablebase
+import threading
+import transposition as Transposition
+from collections import Counter
+from timeit import default_timer as timer
+
+DEFAULT_TIME_LIMIT = 1.0  # seconds per move.
+DEFAULT_TRANSPOSITION_MEGABYTES = 16
+DEFAULT_PONDER_TIME_LIMIT = 10.0  # seconds to ponder before giving up.
+
+
+class Player:
+    """Player that picks moves by searching, under a budget of time_limit seconds or
+    node_limit nodes per move (whichever runs out first), and a budget of
+    ponder_time_limit seconds or ponder_node_limit nodes to ponder for. The search
+    options are passed on to score_position_iterative."""
+
+    def __init__(
+        self,
+        time_limit=DEFAULT_TIME_LIMIT,
+        node_limit=None,
+        max_depth=evaluate.MAX_PLY,
+        transposition_megabytes=DEFAULT_TRANSPOSITION_MEGABYTES,
+        tablebases=Tablebase.TABLEBASES,
+        quiescence=True,
+        pvs=True,
+        aspiration_window=evaluate.ASPIRATION_WINDOW,
+        ponder=False,
+        ponder_time_limit=DEFAULT_PONDER_TIME_LIMIT,
+        ponder_node_limit=None,
+    ):
+        self.time_limit = time_limit
+        self.node_limit = node_limit
+        self.max_depth = max_depth
+        self.transposition_table = Transposition.TranspositionTable(
+            megabytes=transposition_megabytes
+        )
+        self.move_ordering = evaluate.MoveOrdering()
+        self.tablebases = tablebases
+        self.quiescence = quiescence
+        self.pvs = pvs
+        self.aspiration_window = aspiration_window
+        self.ponder = ponder
+        self.ponder_time_limit = ponder_time_limit
+        self.ponder_node_limit = ponder_node_limit
+        self._ponder_thread = None
+        self._ponder_stop = threading.Event()
+        self.ponder_hits = 0  # moves asked for in the position that was pondered.
+        self.new_game()
+
+    def new_game(self):
+        """Forget the current game, including what was learned searching it."""
+        self.stop_pondering()
+        self.transposition_table.clear()
+        self.move_ordering.clear()
+        self.seen_boards = Counter()  # boards of the game before the current position.
+        self.last_position = None  # position after the player's last move.
+        self.ponder_position = None
+        self.last_search = None  # dict of information about the last search.
+
+    def _follow_game(self, position):
+        """Update the game history for a position the player is asked to move in,
+        starting a new game if it doesn't follow from the last move."""
+        last = self.last_position
+        if last is not None and position != last:
+            for move in Cache.get_current_moves(last):
+                if Position.apply_move(last, move) == position:
+                    self.seen_boards[last.split(" ")[0]] += 1
+                    return
+            last = None
+        if last is None:
+            self.new_game()
+
+    def move(self, position):
+        """Return the move to play in a position."""
+        self.stop_pondering()
+        if position == self.ponder_position:
+            self.ponder_hits += 1
+        self._follow_game(position)
+
+        start = timer()
+        score, line, iterations = evaluate.score_position_iterative(
+            position,
+            time_limit=self.time_limit,
+            node_limit=self.node_limit,
+            max_depth=self.max_depth,
+            transposition_table=self.transposition_table,
+            tablebases=self.tablebases,
+            move_ordering=self.move_ordering,
+            quiescence=self.quiescence,
+            pvs=self.pvs,
+            aspiration_window=self.aspiration_window,
+            refine_shortest_line=True,
+            seen_boards=self.seen_boards,
+        )
+        if line:
+            move = line[0]
+        else:  # e.g. a draw found in the tablebases, which have no line for draws.
+            move = (
+                None if self.tablebases is None else self.tablebases.best_move(position)
+            )
+            if move is None:
+                move = Cache.get_current_moves(position)[0]
+        self.last_search = {
+            "score": score,
+            "movelist": line,
+            "depth": iterations[-1]["depth"],
+            "nodes": sum(iteration["nodes"] for iteration in iterations),
+            "seconds": timer() - start,
+        }
+
+        self.seen_boards[position.split(" ")[0]] += 1
+        self.last_position = Position.apply_move(position, move)
+        if self.ponder:
+            reply = self.get_expected_reply(line if line[:1] == [move] else [move])
+            if reply is not None:
+                self.start_pondering(Position.apply_move(self.last_position, reply))
+        return move
+
+    def get_expected_reply(self, line):
+        """Return the reply expected to the player's last move: the next move of its
+        line, or the best move stored in the transposition table if the line was cut
+        short at a transposition. Returns None if neither is known."""
+        if len(line) > 1:
+            return line[1]
+        board, active, _, _ = self.last_position.split(" ")
+        entry = self.transposition_table.probe(Position.zobrist_hash(board, active))
+        if entry is not None and entry[3] in Cache.get_moves(board, active):
+            return entry[3]
+        return None
+
+    def start_pondering(self, position):
+        """Search a position in the background until stop_pondering is called (or the
+        search or its budget ends), to fill the transposition table."""
+        self.stop_pondering()
+        self.ponder_position = position
+        seen_boards = self.seen_boards.copy()
+        seen_boards[self.last_position.split(" ")[0]] += 1
+        self._ponder_stop.clear()
+        self._ponder_thread = threading.Thread(
+            target=evaluate.score_position_iterative,
+            args=(position,),
+            kwargs={
+                "time_limit": self.ponder_time_limit,
+                "node_limit": self.ponder_node_limit,
+                "max_depth": self.max_depth,
+                "transposition_table": self.transposition_table,
+                "tablebases": self.tablebases,
+                "move_ordering": self.move_ordering,
+                "quiescence": self.quiescence,
+                "pvs": self.pvs,
+                "aspiration_window": self.aspiration_window,
+                "seen_boards": seen_boards,
+                "stop_event": self._ponder_stop,
+            },
+            daemon=True,  # don't keep the process alive just to ponder.
+        )
+        self._ponder_thread.start()
+
+    def stop_pondering(self):
+        """Stop the background search, if any, and wait for it to finish."""
+        if self._ponder_thread is not None:
+            self._ponder_stop.set()
+            self._ponder_thread.join()
+            self._ponder_thread = None
+
+    def is_pondering(self):
+        """Return true if the background search is running."""
+        return self._ponder_thread is not None and self._ponder_thread.is_alive()
+
+    def close(self):
+        """Stop pondering, e.g. when the game is over. The player can still be used."""
+        self.stop_pondering()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+PLAYER = None  # default player used by move, created when first needed.
 
 
 def move(position):
-    # Given a position, return a random move.
-    random_move = random.choice(tuple(Position.get_current_moves(position)))
-    return random_move
\ No newline at end of file
+    """Return the default player's move in a position."""
+    global PLAYER
+    if PLAYER is None:
+        PLAYER = Player()
+    return PLAYER.move(position)
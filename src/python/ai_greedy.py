@@ -1,5 +1,6 @@
 import position as Position
 import random
+import tablebase as Tablebase
 
 PIECE_VALUES = {
     "K": 100,
@@ -13,6 +14,11 @@ PIECE_VALUES = {
 
 
 def move(position):
+    # Play perfectly if the position is in the tablebases.
+    tablebase_move = Tablebase.TABLEBASES.best_move(position)
+    if tablebase_move is not None:
+        return tablebase_move
+
     board, active, halfmove, fullmove = position.split(" ")
     moves = Position.get_current_moves(position)  # list of possible moves.
     random.shuffle(moves)  # randomize.
@@ -32,4 +38,4 @@ def move(position):
             return target_value
 
     moves = sorted(moves, key=lambda m: move_score(m), reverse=False)
-    return moves[0]
\ No newline at end of file
+    return moves[0]
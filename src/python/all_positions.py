@@ -1,6 +1,27 @@
+from array import array
 import cProfile
 import functools
+import heapq
+import json
+import lookup_tables as LookupTables
+import multiprocessing
+import os
 import position as Position
+import queue
+import sys
+
+try:  # numpy is optional; it's only needed to expand frontiers in vectorized passes.
+    import numpy as np
+except ImportError:
+    np = None
+
+BATCH_SIZE = 1 << 20  # boards expanded per vectorized pass, to bound memory use.
+CHUNK_SIZE = 1 << 22  # boards expanded per chunk file when exploring on disk.
+READ_SIZE = 1 << 16  # boards read from a file at a time when streaming.
+MERGE_FAN_IN = 64  # files merged at once, to stay well under open file limits.
+CHECKPOINT_FILE = "checkpoint.json"
+CHECKPOINT_VERSION = 1
+PARTITION_MULTIPLIER = 0x9E3779B97F4A7C15  # mixes board bits before partitioning.
 
 
 def position_to_state(position):
@@ -49,5 +70,570 @@ def explore(max_level):
     print("No more traversable positions after this depth.")
 
 
-# cProfile.run("explore(5)")
-explore(18)
+def _next_boards(boards, player):
+    """Return the set of integer boards reachable by one legal move by the given player
+    from any of the given integer boards."""
+    return {
+        Position.apply_move_bits(bits, move)
+        for bits in boards
+        for move in Position.get_moves_bits(bits, player)
+    }
+
+
+def _get_attack_lookup_array():
+    """Return the full attack lookup (see lookup_tables.py) as a numpy array, using the
+    memory-mapped table file if there is one."""
+    if LookupTables.ATTACK_LOOKUP is not None:
+        return np.frombuffer(LookupTables.ATTACK_LOOKUP, dtype=np.uint16)
+    return np.array(
+        LookupTables.build_attack_lookup(
+            LookupTables.ROOK_ATTACKS, LookupTables.BISHOP_ATTACKS
+        ),
+        dtype=np.uint16,
+    )
+
+
+def _unique_array(boards):
+    """Return the sorted unique values of an array of integer boards. Sorting and
+    comparing neighbors is much faster than np.unique's hashing for 64-bit integers."""
+    boards = np.sort(boards)
+    if len(boards) < 2:
+        return boards
+    return boards[np.concatenate(([True], boards[1:] != boards[:-1]))]
+
+
+def _get_nibbles_array(boards):
+    """Split an array of integer boards into a list of arrays of nibbles by square."""
+    return [
+        ((boards >> np.uint64(shift)) & np.uint64(Position.NIBBLE_BITMASK)).astype(
+            np.int64
+        )
+        for shift in Position.NIBBLE_SHIFTS
+    ]
+
+
+def _get_attacks_array(nibbles, square, occupancy, attack_lookup):
+    """Look up the attacks of an array of nibbles on a square, like the C++ code: black
+    pieces other than the pawn use the entries of the white piece."""
+    nibbles = np.where(
+        nibbles > Position.NIBBLE_BLACK | Position.NIBBLE_PAWN,
+        nibbles - Position.NIBBLE_BLACK,
+        nibbles,
+    )
+    keys = (
+        nibbles * LookupTables.TABLE_BLOCK + (square << Position.BOARD_SIZE) + occupancy
+    )
+    return attack_lookup[keys].astype(np.int64)
+
+
+def _next_boards_array(boards, player, attack_lookup):
+    """Return a sorted array of the unique integer boards reachable by one legal move by
+    the given player from any of the boards in an array. Every move of every board is
+    generated in a fixed number of passes over the whole array (one per start and end
+    square), rather than one board at a time."""
+    nibbles = _get_nibbles_array(boards)
+    if player == "w":
+        own = [(nibble > 0) & (nibble < Position.NIBBLE_BLACK) for nibble in nibbles]
+    else:
+        own = [nibble > Position.NIBBLE_BLACK for nibble in nibbles]
+    occupancy = np.zeros(len(boards), dtype=np.int64)
+    own_occupancy = np.zeros(len(boards), dtype=np.int64)
+    for square in range(Position.BOARD_SIZE):
+        occupancy |= (nibbles[square] != 0).astype(np.int64) << (
+            Position.BOARD_SIZE - 1 - square
+        )
+        own_occupancy |= own[square].astype(np.int64) << (
+            Position.BOARD_SIZE - 1 - square
+        )
+
+    # Generate pseudo-legal moves from each start square to each end square.
+    candidates = []
+    for start in range(Position.BOARD_SIZE):
+        rows = np.nonzero(own[start])[0]
+        if not len(rows):
+            continue
+        nibble = nibbles[start][rows]
+        targets = (
+            _get_attacks_array(nibble, start, occupancy[rows], attack_lookup)
+            & ~own_occupancy[rows]
+        )
+        if player == "w" and start == Position.PAWN_START_WHITE:
+            blockers = (
+                Position.SQUARE_MASKS[start + 1] | Position.SQUARE_MASKS[start + 2]
+            )
+            double_step = (nibble == Position.NIBBLE_PAWN) & (
+                occupancy[rows] & blockers == 0
+            )
+            targets |= np.where(double_step, Position.SQUARE_MASKS[start + 2], 0)
+        elif player == "b" and start == Position.PAWN_START_BLACK:
+            blockers = (
+                Position.SQUARE_MASKS[start - 1] | Position.SQUARE_MASKS[start - 2]
+            )
+            double_step = (nibble == Position.NIBBLE_PAWN | Position.NIBBLE_BLACK) & (
+                occupancy[rows] & blockers == 0
+            )
+            targets |= np.where(double_step, Position.SQUARE_MASKS[start - 2], 0)
+        for end in range(Position.BOARD_SIZE):
+            moves = (targets & Position.SQUARE_MASKS[end]) != 0
+            if not moves.any():
+                continue
+            cleared = boards[rows[moves]] & np.uint64(
+                Position.NIBBLE_CLEARS[start] & Position.NIBBLE_CLEARS[end]
+            )
+            candidates.append(
+                cleared
+                | (
+                    nibble[moves].astype(np.uint64)
+                    << np.uint64(Position.NIBBLE_SHIFTS[end])
+                )
+            )
+    if not candidates:
+        return np.zeros(0, dtype=np.uint64)
+    candidates = _unique_array(np.concatenate(candidates))
+
+    # Eliminate moves that leave the player's king attacked by the opponent.
+    nibbles = _get_nibbles_array(candidates)
+    king = Position.NIBBLE_KING | (Position.NIBBLE_BLACK if player == "b" else 0)
+    occupancy = np.zeros(len(candidates), dtype=np.int64)
+    king_mask = np.zeros(len(candidates), dtype=np.int64)
+    for square in range(Position.BOARD_SIZE):
+        occupancy |= (nibbles[square] != 0).astype(np.int64) << (
+            Position.BOARD_SIZE - 1 - square
+        )
+        king_mask |= (nibbles[square] == king).astype(np.int64) << (
+            Position.BOARD_SIZE - 1 - square
+        )
+    attacked = np.zeros(len(candidates), dtype=np.int64)
+    for square in range(Position.BOARD_SIZE):
+        nibble = nibbles[square]
+        if player == "w":
+            opponent = nibble > Position.NIBBLE_BLACK
+        else:
+            opponent = (nibble > 0) & (nibble < Position.NIBBLE_BLACK)
+        attacked |= _get_attacks_array(
+            np.where(opponent, nibble, 0), square, occupancy, attack_lookup
+        )
+    return candidates[(attacked & king_mask) == 0]
+
+
+def explore_packed(max_level, vectorized=None, batch_size=BATCH_SIZE, verbose=True):
+    """Explore and enumerate the game tree like explore, but with each level stored as
+    integer boards (see position.py) rather than board strings. If vectorized is true,
+    each level is a sorted numpy array and is expanded in batches of whole-array passes
+    (see _next_boards_array); by default this is used if numpy is installed. Returns the
+    list of the number of positions at each level.
+
+    Like explore and explore.cpp, a position counts at every level it can be reached at.
+    """
+    if vectorized is None:
+        vectorized = np is not None
+    if vectorized:
+        attack_lookup = _get_attack_lookup_array()
+        boards = np.array([Position.START_BOARD], dtype=np.uint64)
+    else:
+        boards = {Position.START_BOARD}
+    counts = []
+    current_level = 0
+
+    while len(boards) > 0 and current_level < max_level:
+        active = "w" if current_level % 2 == 0 else "b"
+        if vectorized:
+            boards = _unique_array(
+                np.concatenate(
+                    [
+                        _next_boards_array(
+                            boards[i : i + batch_size], active, attack_lookup
+                        )
+                        for i in range(0, len(boards), batch_size)
+                    ]
+                )
+            )
+        else:
+            boards = _next_boards(boards, active)
+        current_level += 1
+        counts.append(len(boards))
+        if verbose:
+            print(
+                "# positions reachable after {} halfmoves = {}".format(
+                    str(current_level).rjust(3), len(boards)
+                )
+            )
+    if verbose:
+        print("No more traversable positions after this depth.")
+    return counts
+
+
+def _get_partition(bits, num_partitions):
+    """Return the partition that owns an integer board. The board is multiplied by a
+    large odd constant first, so that similar boards are spread across partitions."""
+    return (((bits * PARTITION_MULTIPLIER) & 0xFFFFFFFFFFFFFFFF) >> 32) % num_partitions
+
+
+def _get_partition_array(boards, num_partitions):
+    """Return the partition of every integer board in an array, as _get_partition."""
+    mixed = (boards * np.uint64(PARTITION_MULTIPLIER)) >> np.uint64(32)
+    return mixed % np.uint64(num_partitions)
+
+
+def _explore_worker(index, num_workers, vectorized, commands, inboxes, results):
+    """Run a worker of explore_parallel. The worker owns the boards of one partition of
+    each level. For each player to move it receives on commands, it expands its boards,
+    sends each next board to the inbox of the worker that owns it, collects the boards
+    that it owns from every worker, and reports how many unique ones there are. Stops
+    when it receives None."""
+    attack_lookup = _get_attack_lookup_array() if vectorized else None
+    owned = _get_partition(Position.START_BOARD, num_workers) == index
+    boards = {Position.START_BOARD} if owned else set()
+    if vectorized:
+        boards = np.array(sorted(boards), dtype=np.uint64)
+    while True:
+        active = commands.get()
+        if active is None:
+            return
+        if vectorized:
+            next_boards = _unique_array(
+                np.concatenate(
+                    [np.zeros(0, dtype=np.uint64)]
+                    + [
+                        _next_boards_array(
+                            boards[i : i + BATCH_SIZE], active, attack_lookup
+                        )
+                        for i in range(0, len(boards), BATCH_SIZE)
+                    ]
+                )
+            )
+            owners = _get_partition_array(next_boards, num_workers)
+            outgoing = [next_boards[owners == i] for i in range(num_workers)]
+        else:
+            outgoing = [array("Q") for _ in range(num_workers)]
+            for bits in _next_boards(boards, active):
+                outgoing[_get_partition(bits, num_workers)].append(bits)
+        for i in range(num_workers):
+            if i != index:
+                inboxes[i].put(outgoing[i].tobytes())
+        received = [outgoing[index]]
+        for _ in range(num_workers - 1):
+            data = inboxes[index].get()
+            received.append(
+                np.frombuffer(data, dtype=np.uint64) if vectorized else array("Q", data)
+            )
+        if vectorized:
+            boards = _unique_array(np.concatenate(received))
+        else:
+            boards = set().union(*received)
+        results.put(len(boards))
+
+
+def explore_parallel(max_level, workers=None, vectorized=None, verbose=True):
+    """Explore and enumerate the game tree like explore_packed, but with every level
+    split between worker processes by a hash of the board. Each worker only holds and
+    expands its own partition, and removes duplicates within it, so both the work and
+    the memory are divided between the workers. The counts are the same as the serial
+    version's; with workers=1 this just calls explore_packed. Returns the list of the
+    number of positions at each level."""
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if vectorized is None:
+        vectorized = np is not None
+    if workers <= 1:
+        return explore_packed(max_level, vectorized=vectorized, verbose=verbose)
+
+    commands = [multiprocessing.Queue() for _ in range(workers)]
+    inboxes = [multiprocessing.Queue() for _ in range(workers)]
+    results = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(
+            target=_explore_worker,
+            args=(i, workers, vectorized, commands[i], inboxes, results),
+            daemon=True,
+        )
+        for i in range(workers)
+    ]
+    for process in processes:
+        process.start()
+
+    counts = []
+    try:
+        while len(counts) < max_level and (not counts or counts[-1] > 0):
+            active = "w" if len(counts) % 2 == 0 else "b"
+            for command in commands:
+                command.put(active)
+            count = 0
+            for _ in range(workers):
+                while True:  # don't wait forever if a worker has died.
+                    try:
+                        count += results.get(timeout=1)
+                        break
+                    except queue.Empty:
+                        if any(process.exitcode for process in processes):
+                            for process in processes:  # others may be stuck.
+                                process.terminate()
+                            raise RuntimeError("an explore worker exited early")
+            counts.append(count)
+            if verbose:
+                print(
+                    "# positions reachable after {} halfmoves = {}".format(
+                        str(len(counts)).rjust(3), counts[-1]
+                    )
+                )
+    finally:
+        for command in commands:
+            command.put(None)
+        for process in processes:
+            process.join()
+    if verbose:
+        print("No more traversable positions after this depth.")
+    return counts
+
+
+def _write_boards(path, boards):
+    """Write an iterable of integer boards to a file as little-endian uint64s, and return
+    the number written. Writes to a temporary file first, so that a crash never leaves a
+    partial file under the path."""
+    count = 0
+    buffer = array("Q")
+    with open(path + ".tmp", "wb") as f:
+        for bits in boards:
+            buffer.append(bits)
+            if len(buffer) == READ_SIZE:
+                count += _flush_boards(f, buffer)
+                buffer = array("Q")
+        count += _flush_boards(f, buffer)
+    os.replace(path + ".tmp", path)
+    return count
+
+
+def _write_board_array(path, boards):
+    """Write a numpy array of integer boards to a file like _write_boards, without
+    turning it into Python integers, and return the number written."""
+    with open(path + ".tmp", "wb") as f:
+        boards.astype("<u8", copy=False).tofile(f)
+    os.replace(path + ".tmp", path)
+    return len(boards)
+
+
+def _flush_boards(f, buffer):
+    """Write a buffer of integer boards to an open file and return how many there were."""
+    if sys.byteorder != "little":
+        buffer.byteswap()
+    buffer.tofile(f)
+    return len(buffer)
+
+
+def _read_board_blocks(path, block_size=READ_SIZE):
+    """Yield the integer boards in a file written by _write_boards, in arrays of up to
+    block_size boards."""
+    with open(path, "rb") as f:
+        while True:
+            block = array("Q")
+            block.frombytes(f.read(block_size * block.itemsize))
+            if not block:
+                return
+            if sys.byteorder != "little":
+                block.byteswap()
+            yield block
+
+
+def _read_boards(path):
+    """Yield the integer boards in a file written by _write_boards, one at a time."""
+    for block in _read_board_blocks(path):
+        yield from block
+
+
+def _merge_unique(streams):
+    """Merge sorted streams of integer boards into one sorted stream without duplicates."""
+    previous = None
+    for bits in heapq.merge(*streams):
+        if bits != previous:
+            yield bits
+            previous = bits
+
+
+def _merge_files(paths, get_path, fan_in=MERGE_FAN_IN):
+    """Merge sorted files of integer boards in passes of at most fan_in files at a time,
+    so that no more than that many are open at once, until at most fan_in are left.
+    Merged files are written to the paths returned by get_path(merge_pass, index), and
+    the files merged into them are removed. Returns the list of remaining files, which
+    can then be merged in one last pass with _merge_unique."""
+    merge_pass = 0
+    while len(paths) > fan_in:
+        merged = []
+        for start in range(0, len(paths), fan_in):
+            group = paths[start : start + fan_in]
+            merged.append(get_path(merge_pass, len(merged)))
+            _write_boards(
+                merged[-1], _merge_unique(_read_boards(path) for path in group)
+            )
+            for path in group:
+                os.remove(path)
+        paths = merged
+        merge_pass += 1
+    return paths
+
+
+def _exclude_sorted(stream, excluded):
+    """Yield the boards in a sorted stream that aren't in another sorted stream."""
+    excluded = iter(excluded)
+    current = next(excluded, None)
+    for bits in stream:
+        while current is not None and current < bits:
+            current = next(excluded, None)
+        if bits != current:
+            yield bits
+
+
+def explore_on_disk(
+    max_level,
+    directory,
+    chunk_size=CHUNK_SIZE,
+    exclude_seen=False,
+    vectorized=None,
+    verbose=True,
+    merge_fan_in=MERGE_FAN_IN,
+):
+    """Explore and enumerate the game tree like explore_packed, but with each level
+    stored on disk, so that levels don't need to fit in memory. Returns the list of the
+    number of positions at each level.
+
+    Each level is a file of sorted integer boards. The next level is built by expanding
+    the current one a chunk at a time, writing each chunk's sorted next boards to its own
+    file, and then merging the chunk files, merge_fan_in at a time (see _merge_files).
+    After every level a checkpoint is written to the directory, and calling this again
+    with the same directory resumes from it (so max_level can also be raised to go
+    deeper). Files left from a level that was interrupted are removed when it is
+    started again.
+
+    If exclude_seen is true, positions already reached at an earlier level are left out
+    of later levels, so that each level holds only new positions and the counts add up
+    to the number of distinct positions. These are found by merging against a sorted
+    file of the boards seen so far for each player to move, rather than a set in memory.
+    Otherwise, like explore, a position counts at every level it can be reached at."""
+    if vectorized is None:
+        vectorized = np is not None
+    attack_lookup = _get_attack_lookup_array() if vectorized else None
+    os.makedirs(directory, exist_ok=True)
+    checkpoint_path = os.path.join(directory, CHECKPOINT_FILE)
+
+    def path(name):
+        return os.path.join(directory, name)
+
+    # Resume from the checkpoint, or start from the starting position.
+    if os.path.exists(checkpoint_path):
+        with open(checkpoint_path) as f:
+            checkpoint = json.load(f)
+        if checkpoint["version"] != CHECKPOINT_VERSION or (
+            checkpoint["exclude_seen"] != exclude_seen
+        ):
+            raise ValueError(
+                "{} is from a different kind of run; use another directory".format(
+                    checkpoint_path
+                )
+            )
+        if verbose:
+            for level, count in enumerate(checkpoint["counts"], 1):
+                print(
+                    "# positions reachable after {} halfmoves = {} (resumed)".format(
+                        str(level).rjust(3), count
+                    )
+                )
+    else:
+        checkpoint = {
+            "version": CHECKPOINT_VERSION,
+            "exclude_seen": exclude_seen,
+            "level": 0,
+            "counts": [],
+            "frontier": "level_000.bin",
+            "seen": {"w": "seen_w_000.bin", "b": "seen_b_000.bin"},
+        }
+        _write_boards(path(checkpoint["frontier"]), [Position.START_BOARD])
+        if exclude_seen:
+            _write_boards(path(checkpoint["seen"]["w"]), [Position.START_BOARD])
+            _write_boards(path(checkpoint["seen"]["b"]), [])
+
+    while checkpoint["level"] < max_level and (
+        checkpoint["level"] == 0 or checkpoint["counts"][-1] > 0
+    ):
+        current_level = checkpoint["level"]
+        active = "w" if current_level % 2 == 0 else "b"
+        next_active = Position.opposite_color(active)
+        next_level = current_level + 1
+
+        # Remove the chunk and merge files of an interrupted run of this level.
+        prefix = "level_{:03d}_".format(next_level)
+        for name in os.listdir(directory):
+            if name.startswith(prefix):
+                os.remove(path(name))
+
+        # Expand the frontier a chunk at a time into sorted chunk files.
+        chunks = []
+        for block in _read_board_blocks(path(checkpoint["frontier"]), chunk_size):
+            chunks.append(path("{}chunk_{:05d}.bin".format(prefix, len(chunks))))
+            if vectorized:  # already sorted, and written without leaving numpy.
+                _write_board_array(
+                    chunks[-1],
+                    _next_boards_array(
+                        np.frombuffer(block, dtype=np.uint64), active, attack_lookup
+                    ),
+                )
+            else:
+                _write_boards(chunks[-1], sorted(_next_boards(block, active)))
+
+        # Merge the chunks into the next level, leaving out seen boards if asked.
+        chunks = _merge_files(
+            chunks,
+            lambda merge_pass, index: path(
+                "{}merge_{:02d}_{:05d}.bin".format(prefix, merge_pass, index)
+            ),
+            merge_fan_in,
+        )
+        next_boards = _merge_unique(_read_boards(chunk) for chunk in chunks)
+        seen_path = checkpoint["seen"][next_active]
+        if exclude_seen:
+            next_boards = _exclude_sorted(next_boards, _read_boards(path(seen_path)))
+        frontier = "level_{:03d}.bin".format(next_level)
+        count = _write_boards(path(frontier), next_boards)
+        if exclude_seen:
+            seen_path = "seen_{}_{:03d}.bin".format(next_active, next_level)
+            _write_boards(
+                path(seen_path),
+                _merge_unique(
+                    [
+                        _read_boards(path(checkpoint["seen"][next_active])),
+                        _read_boards(path(frontier)),
+                    ]
+                ),
+            )
+
+        # Checkpoint, and only then remove the files that are no longer needed.
+        old_files = [checkpoint["frontier"]] + [os.path.basename(c) for c in chunks]
+        if exclude_seen:
+            old_files.append(checkpoint["seen"][next_active])
+        checkpoint = dict(
+            checkpoint,
+            level=next_level,
+            counts=checkpoint["counts"] + [count],
+            frontier=frontier,
+            seen=dict(checkpoint["seen"], **{next_active: seen_path}),
+        )
+        with open(checkpoint_path + ".tmp", "w") as f:
+            json.dump(checkpoint, f)
+        os.replace(checkpoint_path + ".tmp", checkpoint_path)
+        for old_file in old_files:
+            if os.path.exists(path(old_file)):
+                os.remove(path(old_file))
+
+        if verbose:
+            print(
+                "# positions reachable after {} halfmoves = {}".format(
+                    str(next_level).rjust(3), count
+                ),
+                flush=True,
+            )
+    if verbose:
+        print("No more traversable positions after this depth.")
+    return checkpoint["counts"]
+
+
+if __name__ == "__main__":
+    # cProfile.run("explore(5)")
+    explore(18)
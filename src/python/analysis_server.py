@@ -0,0 +1,454 @@
+# Analysis server.
+#
+# Running each analysis in a new process throws away everything the search builds up
+# along the way: cached moves and game states (see cache.py), transposition tables, and
+# loaded tablebases. This server stays up and answers analysis requests, keeping all of
+# those warm from one request to the next.
+#
+# The protocol is one JSON object per line in both directions, over stdin and stdout or
+# a TCP socket on localhost. Requests are:
+#
+#   {"command": "analyze", "id": 1, "position": "KQRBNP....pnbrqk w 0 1",
+#    "time_limit": 5, "node_limit": 100000, "max_depth": 20}
+#       Search a position. Everything but the position is optional, and the id defaults
+#       to a number counting up from 1. As each depth is completed, a response of type
+#       "depth" gives its score and best line, and a response of type "result" ends the
+#       request with the final score and line.
+#   {"command": "cancel", "id": 1}
+#       Stop a request. A request still waiting for a worker ends with a response of
+#       type "cancelled", and a running one ends with its result so far.
+#   {"command": "stats"}
+#       Get a response of type "stats" about the caches and requests.
+#   {"command": "quit"}
+#       Cancel the connection's requests and close it.
+#
+# Every response to a request has its id. Requests that can't be understood get a
+# response of type "error". Scores are for the player to move, as in score_position,
+# and moves are [start, end] lists. When a connection reaches the end of its input, its
+# requests are finished before it is closed, so a script can just send its requests.
+# If the client goes away instead (its connection is reset, or responses can't be sent
+# to it), its requests are cancelled as if it had quit, so they don't keep workers busy.
+#
+# Searches run in a pool of worker threads, each with its own transposition table and
+# move ordering (kept between requests) so that concurrent searches don't interfere, and
+# requests wait in a queue for a free worker. Each request has a deadline of time_limit
+# seconds after it was received, so time spent waiting counts against it. Python threads
+# share one interpreter lock, so more workers let requests run (and be cancelled) side by
+# side, but don't search more nodes per second in total.
+#
+# Run this file to serve over stdin and stdout, or with a port to serve over TCP, with
+# --workers to set the number of workers and --tablebases to probe the tablebases in a
+# directory (by default, the one tablebase.py generates them in; "none" for none). Run it
+# with "client" and a port to send request lines from stdin to a running server and print
+# the responses.
+
+import argparse
+import asyncio
+import cache as Cache
+import evaluate
+import json
+import position as Position
+import sys
+import tablebase as Tablebase
+import threading
+import transposition as Transposition
+from concurrent.futures import ThreadPoolExecutor
+from timeit import default_timer as timer
+
+HOST = "127.0.0.1"  # only serve local connections.
+DEFAULT_TIME_LIMIT = 10.0  # seconds per request, if not given.
+MAX_TIME_LIMIT = 600.0  # longest time_limit a request can ask for.
+DEFAULT_TRANSPOSITION_MEGABYTES = 16  # size of each worker's transposition table.
+
+
+def parse_position(position):
+    """Check that a position record is well formed, returning it, or raise ValueError."""
+    if not isinstance(position, str) or len(position.split(" ")) != 4:
+        raise ValueError("position must be a record of four fields")
+    board, active, halfmove, fullmove = position.split(" ")
+    if len(board) != Position.BOARD_SIZE or any(
+        square.upper() not in Position.NOTATION_PIECES
+        and square != Position.NOTATION_EMPTY
+        for square in board
+    ):
+        raise ValueError("board must have {} squares".format(Position.BOARD_SIZE))
+    if board.count("K") != 1 or board.count("k") != 1:
+        raise ValueError("board must have one king of each color")
+    if active not in ("w", "b"):
+        raise ValueError("active color must be w or b")
+    if not (halfmove.isdigit() and fullmove.isdigit()):
+        raise ValueError("halfmove and fullmove must be numbers")
+    return position
+
+
+class _Worker:
+    """Search state kept by one worker between requests."""
+
+    def __init__(self, transposition_megabytes):
+        self.transposition_table = Transposition.TranspositionTable(
+            megabytes=transposition_megabytes
+        )
+        self.move_ordering = evaluate.MoveOrdering()
+        self.stop_event = threading.Event()  # set to stop the running search.
+        self.searches = 0
+
+
+class _Request:
+    """An analysis request, from when it is received until its last response."""
+
+    def __init__(self, connection, request_id, position, options, deadline):
+        self.connection = connection
+        self.id = request_id
+        self.position = position
+        self.node_limit = options.get("node_limit")
+        self.max_depth = options.get("max_depth", evaluate.MAX_PLY)
+        self.deadline = deadline
+        self.worker = None  # the worker searching it, once it is running.
+        self.cancelled = False
+        self.done = asyncio.get_running_loop().create_future()
+
+
+class _Connection:
+    """A client, with the function to send it responses and its unfinished requests.
+    If sending raises ConnectionError, the connection is closed and lost is called."""
+
+    def __init__(self, send, lost):
+        self._send = send
+        self._lost = lost
+        self.requests = {}  # id -> _Request.
+        self.next_id = 1
+        self.closed = False
+
+    def send(self, message):
+        """Send a response, unless the connection has been closed."""
+        if not self.closed:
+            try:
+                self._send(message)
+            except ConnectionError:  # the client has gone away.
+                self.closed = True
+                self._lost(self)
+
+
+class AnalysisServer:
+    """Answers analysis requests (see above) with a pool of worker threads. Call start
+    before serving, and close when done."""
+
+    def __init__(
+        self,
+        workers=1,
+        transposition_megabytes=DEFAULT_TRANSPOSITION_MEGABYTES,
+        tablebases=None,  # optional Tablebases to look up endgames in.
+        max_time_limit=MAX_TIME_LIMIT,
+    ):
+        self.workers = [_Worker(transposition_megabytes) for _ in range(workers)]
+        self.tablebases = tablebases
+        self.max_time_limit = max_time_limit
+        self.received = 0  # analysis requests received.
+        self.completed = 0  # analysis requests that ended with a result.
+        self.cancelled = 0  # analysis requests cancelled before they ran.
+
+    async def start(self):
+        """Start the workers."""
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=len(self.workers))
+        self._tasks = [
+            asyncio.create_task(self._run_worker(worker)) for worker in self.workers
+        ]
+
+    async def close(self):
+        """Stop the workers, cancelling any running searches."""
+        for worker in self.workers:
+            worker.stop_event.set()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._executor.shutdown(wait=True)
+
+    async def _run_worker(self, worker):
+        """Search queued requests, one at a time, with a worker."""
+        while True:
+            request = await self._queue.get()
+            if request.cancelled:  # cancelled while waiting; already answered.
+                continue
+            request.worker = worker
+            worker.stop_event.clear()
+            try:
+                message = await self._loop.run_in_executor(
+                    self._executor, self._search, worker, request
+                )
+                self.completed += 1
+            except Exception as e:
+                message = {"id": request.id, "type": "error", "error": repr(e)}
+            request.connection.send(message)
+            self._finish(request)
+
+    def _search(self, worker, request):
+        """Search a request's position with a worker, sending a response as each depth
+        is completed, and return the final response. Runs in a worker thread."""
+        send = request.connection.send
+
+        def callback(iteration):
+            self._loop.call_soon_threadsafe(
+                send,
+                {
+                    "id": request.id,
+                    "type": "depth",
+                    "depth": iteration["depth"],
+                    "score": iteration["score"],
+                    "movelist": iteration["movelist"],
+                    "nodes": iteration["nodes"],
+                    "seconds": iteration["total_seconds"],
+                },
+            )
+
+        worker.searches += 1
+        start = timer()
+        score, line, iterations = evaluate.score_position_iterative(
+            request.position,
+            time_limit=max(0.0, request.deadline - start),
+            node_limit=request.node_limit,
+            max_depth=request.max_depth,
+            transposition_table=worker.transposition_table,
+            tablebases=self.tablebases,
+            callback=callback,
+            move_ordering=worker.move_ordering,
+            quiescence=True,
+            pvs=True,
+            aspiration_window=evaluate.ASPIRATION_WINDOW,
+            refine_shortest_line=True,
+            stop_event=worker.stop_event,
+        )
+        return {
+            "id": request.id,
+            "type": "result",
+            "score": score,
+            "movelist": line,
+            "depth": iterations[-1]["depth"],
+            "nodes": sum(iteration["nodes"] for iteration in iterations),
+            "seconds": timer() - start,
+            "cancelled": request.cancelled,
+        }
+
+    def _finish(self, request):
+        """Forget a request that has sent its last response."""
+        request.connection.requests.pop(request.id, None)
+        request.done.set_result(None)
+
+    def _cancel(self, request):
+        """Cancel a request, stopping its search if it is running."""
+        if request.cancelled:
+            return
+        request.cancelled = True
+        if request.worker is not None:
+            request.worker.stop_event.set()  # the worker sends the result so far.
+        else:
+            self.cancelled += 1
+            request.connection.send({"id": request.id, "type": "cancelled"})
+            self._finish(request)
+
+    def _cancel_all(self, connection):
+        """Cancel every unfinished request of a connection."""
+        for request in list(connection.requests.values()):
+            self._cancel(request)
+
+    def _disconnect(self, connection):
+        """Close a connection whose client has gone away, cancelling its requests."""
+        connection.closed = True
+        self._cancel_all(connection)
+
+    def get_stats(self):
+        """Return a dict of statistics about the caches and requests."""
+        return {
+            "received": self.received,
+            "completed": self.completed,
+            "cancelled": self.cancelled,
+            "queued": self._queue.qsize(),
+            "cache": Cache.CACHE.stats(),
+            "workers": [
+                {
+                    "searches": worker.searches,
+                    "transposition_table": worker.transposition_table.stats(),
+                }
+                for worker in self.workers
+            ],
+        }
+
+    def handle_line(self, connection, line):
+        """Handle a request line from a connection. Returns false if the connection
+        asked to quit."""
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("request must be a JSON object")
+        except ValueError as e:
+            connection.send({"type": "error", "error": str(e)})
+            return True
+        command = request.get("command")
+        request_id = request.get("id")
+        if request_id is not None and not isinstance(request_id, (int, str)):
+            connection.send({"type": "error", "error": "id must be a number or string"})
+            return True
+
+        if command == "analyze":
+            if request_id is None:
+                request_id = connection.next_id
+                connection.next_id += 1
+            try:
+                if request_id in connection.requests:
+                    raise ValueError("request {} is already running".format(request_id))
+                position = parse_position(request.get("position"))
+                time_limit = request.get("time_limit", DEFAULT_TIME_LIMIT)
+                if not isinstance(time_limit, (int, float)) or time_limit < 0:
+                    raise ValueError("time_limit must be a number of seconds")
+                for option in ["node_limit", "max_depth"]:
+                    value = request.get(option)
+                    if value is not None and (not isinstance(value, int) or value < 1):
+                        raise ValueError("{} must be a positive integer".format(option))
+            except ValueError as e:
+                connection.send({"id": request_id, "type": "error", "error": str(e)})
+                return True
+            self.received += 1
+            deadline = timer() + min(time_limit, self.max_time_limit)
+            options = {
+                key: value for key, value in request.items() if value is not None
+            }
+            analysis = _Request(connection, request_id, position, options, deadline)
+            connection.requests[request_id] = analysis
+            self._queue.put_nowait(analysis)
+        elif command == "cancel":
+            if request_id in connection.requests:
+                self._cancel(connection.requests[request_id])
+            else:
+                connection.send(
+                    {"id": request_id, "type": "error", "error": "no such request"}
+                )
+        elif command == "stats":
+            message = {"type": "stats", **self.get_stats()}
+            if request_id is not None:
+                message["id"] = request_id
+            connection.send(message)
+        elif command == "quit":
+            return False
+        else:
+            connection.send(
+                {
+                    "id": request_id,
+                    "type": "error",
+                    "error": "unknown command {}".format(command),
+                }
+            )
+        return True
+
+    async def serve_lines(self, read_line, send):
+        """Serve one connection: handle the lines returned by the coroutine function
+        read_line (an empty string at the end of input), and pass each response to
+        send. Returns once the input has ended and every request has finished, or the
+        connection asked to quit. If read_line or send raises ConnectionError, the
+        client is taken to be gone and its requests are cancelled."""
+        connection = _Connection(send, self._disconnect)
+        try:
+            while True:
+                line = await read_line()
+                if not line:
+                    break
+                if line.strip() and not self.handle_line(connection, line):
+                    self._cancel_all(connection)
+                    break
+        except ConnectionError:
+            self._disconnect(connection)
+        await asyncio.gather(
+            *(request.done for request in list(connection.requests.values()))
+        )
+        connection.closed = True
+
+    async def serve_stdio(self):
+        """Serve requests from stdin, with responses on stdout, until stdin ends."""
+
+        async def read_line():
+            return await self._loop.run_in_executor(None, sys.stdin.readline)
+
+        def send(message):
+            sys.stdout.write(json.dumps(message) + "\n")
+            sys.stdout.flush()
+
+        await self.serve_lines(read_line, send)
+
+    async def serve_tcp(self, port=0, host=HOST):
+        """Start serving over TCP, and return the asyncio.Server. A port of 0 picks a
+        free port (see server.sockets[0].getsockname())."""
+
+        async def handle_client(reader, writer):
+            async def read_line():
+                return (await reader.readline()).decode()
+
+            def send(message):
+                if writer.is_closing():  # e.g. writing to the client failed.
+                    raise ConnectionResetError("client disconnected")
+                writer.write((json.dumps(message) + "\n").encode())
+
+            try:
+                await self.serve_lines(read_line, send)
+                await writer.drain()
+            except ConnectionError:
+                pass
+            finally:
+                writer.close()
+
+        return await asyncio.start_server(handle_client, host, port)
+
+
+async def run_client(lines, port, host=HOST):
+    """Send request lines to a server over TCP, and return the list of responses once
+    the server has answered them all."""
+    reader, writer = await asyncio.open_connection(host, port)
+    for line in lines:
+        writer.write((line.rstrip("\n") + "\n").encode())
+    writer.write_eof()  # the server finishes the requests and then closes.
+    await writer.drain()
+    responses = []
+    while True:
+        line = await reader.readline()
+        if not line:
+            break
+        responses.append(json.loads(line))
+    writer.close()
+    return responses
+
+
+async def main(port=None, workers=1, tablebases=Tablebase.TABLEBASES):
+    """Serve over stdin and stdout, or over TCP forever if a port is given."""
+    server = AnalysisServer(workers=workers, tablebases=tablebases)
+    await server.start()
+    try:
+        if port is None:
+            await server.serve_stdio()
+        else:
+            tcp_server = await server.serve_tcp(port)
+            async with tcp_server:
+                await tcp_server.serve_forever()
+    finally:
+        await server.close()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == "client":
+        for response in asyncio.run(run_client(sys.stdin, int(sys.argv[2]))):
+            print(json.dumps(response))
+    else:
+        parser = argparse.ArgumentParser(description="Serve analysis requests.")
+        parser.add_argument("port", type=int, nargs="?", help="TCP port to serve on")
+        parser.add_argument("--workers", type=int, default=1, help="search threads")
+        parser.add_argument(
+            "--tablebases",
+            default=Tablebase.TABLEBASE_DIR,
+            help='directory of tablebases to probe, or "none"',
+        )
+        args = parser.parse_args()
+        if args.tablebases == "none":
+            tablebases = None
+        elif args.tablebases == Tablebase.TABLEBASE_DIR:
+            tablebases = Tablebase.TABLEBASES
+        else:
+            tablebases = Tablebase.Tablebases(args.tablebases)
+        asyncio.run(main(args.port, args.workers, tablebases))
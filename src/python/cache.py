@@ -0,0 +1,200 @@
+# Cache of data derived from a board and the player to move.
+#
+# Legal moves, attacked squares, check status, whether the game is over, and material
+# estimates don't depend on the halfmove and fullmove clocks. Caching them under the
+# full position string (as functools.lru_cache would) misses whenever the same board is
+# reached at a different move number, so this cache is keyed on (kind, board, active)
+# instead, where kind names what is cached.
+#
+# The cache is bounded by an estimate of the memory its entries take rather than by
+# their number, and evicts the least recently used entries when full. Cached values are
+# shared between callers, so they are stored as immutable types (tuples, frozensets).
+#
+# Each process has one shared cache, CACHE, which the functions below look things up in.
+# It can be cleared or resized between runs.
+#
+# A cache can also store boards by their canonical mirror (see position.py), so that a
+# board and its mirror share one entry, for up to half the memory. Only kinds of value
+# that can be mirrored back are stored this way: lookups for a board with black to move
+# look up its mirror, and mirror the value. Mirroring a value costs a little on every
+# such lookup, so this is off by default.
+
+from collections import Counter, OrderedDict
+import position as Position
+import sys
+import threading
+
+DEFAULT_MEGABYTES = 64
+ENTRY_BYTES = 200  # rough overhead of an entry: the key tuple and the dict slot.
+
+
+def get_size(value):
+    """Estimate the bytes taken by a value, including the items of a container (but not
+    their contents in turn; moves are tuples of small integers, which are shared)."""
+    size = sys.getsizeof(value)
+    if isinstance(value, (tuple, list, set, frozenset)):
+        size += sum(map(sys.getsizeof, value))
+    return size
+
+
+class BoardCache:
+    """Least recently used cache of values computed from a board and the player to
+    move, bounded by the estimated bytes of its entries. Hits and misses are counted
+    for each kind of value. The cache can be shared between threads (e.g. a pondering
+    search, or the workers of the analysis server)."""
+
+    def __init__(self, megabytes=DEFAULT_MEGABYTES, mirror=False):
+        self.max_bytes = int(megabytes * 1024 * 1024)
+        self.mirror = mirror  # whether to store boards by their canonical mirror.
+        # Held while reading or changing the entries and statistics, but not while
+        # computing a value, which may look up other values in the cache.
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        """Empty the cache and reset statistics."""
+        with self.lock:
+            self.entries = OrderedDict()  # key to a tuple of (value, size).
+            self.bytes = 0
+            self.hits = Counter()  # hits of each kind.
+            self.misses = Counter()
+            self.evictions = 0
+
+    def resize(self, megabytes):
+        """Change the size of the cache, evicting entries if it is now too full."""
+        with self.lock:
+            self.max_bytes = int(megabytes * 1024 * 1024)
+            self._evict()
+
+    def _evict(self):
+        """Evict the least recently used entries until the cache fits its size. The
+        lock must be held."""
+        while self.bytes > self.max_bytes:
+            _, (_, size) = self.entries.popitem(last=False)
+            self.bytes -= size
+            self.evictions += 1
+
+    def get(self, kind, board, active, compute, mirror_value=None):
+        """Return the value of a kind for a board and player to move, calling
+        compute(board, active) to get it if it isn't cached. If the cache stores boards
+        by their canonical mirror, mirror_value(value) should turn the value for a board
+        into the value for its mirror; kinds without one are stored as they are."""
+        if self.mirror and mirror_value is not None and active == "b":
+            return mirror_value(
+                self.get(kind, Position.mirror_board(board), "w", compute)
+            )
+        key = (kind, board, active)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits[kind] += 1
+                return entry[0]
+            self.misses[kind] += 1
+        value = compute(board, active)
+        size = ENTRY_BYTES + sys.getsizeof(board) + get_size(value)
+        with self.lock:
+            # Another thread may have computed the same value in the meantime.
+            entry = self.entries.pop(key, None)
+            if entry is not None:
+                self.bytes -= entry[1]
+            self.entries[key] = (value, size)
+            self.bytes += size
+            self._evict()
+        return value
+
+    def _hit_rate(self):
+        hits, misses = sum(self.hits.values()), sum(self.misses.values())
+        return hits / (hits + misses) if hits + misses else 0.0
+
+    def hit_rate(self):
+        """Return the fraction of lookups that found their value."""
+        with self.lock:
+            return self._hit_rate()
+
+    def stats(self):
+        """Return a dict of statistics about cache usage, in total and for each kind."""
+        with self.lock:
+            kinds = {}
+            for kind in sorted(set(self.hits) | set(self.misses), key=str):
+                lookups = self.hits[kind] + self.misses[kind]
+                kinds[kind] = {
+                    "hits": self.hits[kind],
+                    "misses": self.misses[kind],
+                    "hit_rate": self.hits[kind] / lookups,
+                }
+            return {
+                "entries": len(self.entries),
+                "megabytes": self.bytes / (1024 * 1024),
+                "max_megabytes": self.max_bytes / (1024 * 1024),
+                "fill": self.bytes / self.max_bytes if self.max_bytes else 1.0,
+                "hits": sum(self.hits.values()),
+                "misses": sum(self.misses.values()),
+                "hit_rate": self._hit_rate(),
+                "evictions": self.evictions,
+                "kinds": kinds,
+            }
+
+
+CACHE = BoardCache()
+
+
+def _compute_moves(board, active):
+    return tuple(Position.get_moves(board, active))
+
+
+def _compute_attacked_squares(board, player):
+    return frozenset(Position.get_attacked_squares(board, player))
+
+
+def _compute_state(board, active):
+    return Position.check_position(" ".join((board, active, "0", "1")))
+
+
+def mirror_unchanged(value):
+    """Mirror a value that is the same for a board and its mirror."""
+    return value
+
+
+def _mirror_moves(moves):
+    return tuple(map(Position.mirror_move, moves))
+
+
+def _mirror_squares(squares):
+    return frozenset(Position.BOARD_SIZE - 1 - square for square in squares)
+
+
+def _mirror_state(state):
+    if state[0] in ("w", "b"):
+        return (Position.opposite_color(state[0]), state[1])
+    return state
+
+
+def get_moves(board, active):
+    """Return a tuple of all legal moves by the given player."""
+    return CACHE.get("moves", board, active, _compute_moves, _mirror_moves)
+
+
+def get_current_moves(position):
+    """Return a list of all legal moves by the current player."""
+    board, active, _, _ = position.split(" ")
+    return list(get_moves(board, active))
+
+
+def get_attacked_squares(board, player):
+    """Return a frozenset of the squares attacked by the given player."""
+    return CACHE.get(
+        "attacked", board, player, _compute_attacked_squares, _mirror_squares
+    )
+
+
+def is_in_check(board, player):
+    """Return true if the given player is in check."""
+    return CACHE.get("check", board, player, Position.is_in_check, mirror_unchanged)
+
+
+def get_state(board, active):
+    """Return the result of check_position for a board and player to move, ignoring the
+    clocks (i.e., with a halfmove clock of 0 at the first move). The clocks can only end
+    a game that this doesn't, as a draw."""
+    return CACHE.get("state", board, active, _compute_state, _mirror_state)
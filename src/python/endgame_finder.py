@@ -43,7 +43,7 @@ def unique_permutations(seq):
                 break
 
         # Swap them in the most efficient way
-        (seq[k], seq[i]) = (seq[i], seq[k])  #       k     i
+        seq[k], seq[i] = (seq[i], seq[k])  #       k     i
         # 0 0 1 1 1 1 0 0
 
         # Reverse the part after but not                           k
@@ -51,11 +51,9 @@ def unique_permutations(seq):
         seq[k + 1 :] = seq[-1:k:-1]
 
 
-def build_permutations_from_additional_pieces(
-    additional_pieces, find_checkmates=True, find_stalemates=True
-):
-    """Given an iterator of additional pieces (i.e., not either king), return all positions
-    with kings and those extra pieces that are either checkmate or stalemate."""
+def _get_boards(additional_pieces):
+    """Yield every board with kings and the additional pieces that could come up in a
+    game, with either player to move."""
     all_pieces = ["K", "k"]
     all_pieces.extend(additional_pieces)
 
@@ -63,8 +61,6 @@ def build_permutations_from_additional_pieces(
     spaces = ["."] * (Position.BOARD_SIZE - len(all_pieces))
     all_pieces.extend(spaces)
 
-    # Build all possible permutations of the board and test if they are checkmate or
-    # stalemate.
     for permutation in unique_permutations(all_pieces):
         # Kings can't be adjacent.
         if abs(permutation.index("K") - permutation.index("k")) == 1:
@@ -90,21 +86,57 @@ def build_permutations_from_additional_pieces(
         ):
             continue
 
-        position_white = "".join(permutation) + " w 0 1"
-        position_black = "".join(permutation) + " b 0 1"
+        yield "".join(permutation)
+
 
-        result_white = Position.check_position(position_white)
-        result_black = Position.check_position(position_black)
-        if result_white != (None, None):
-            if (find_checkmates and result_white[1] == "checkmate") or (
-                find_stalemates and result_white[1] == "stalemate"
-            ):
-                print(position_white, result_white)
-        if result_black != (None, None):
-            if (find_checkmates and result_black[1] == "checkmate") or (
-                find_stalemates and result_black[1] == "stalemate"
-            ):
-                print(position_black, result_black)
+def _mirror_result(result):
+    """Return the result of the mirror of a position, given its result."""
+    if result[0] in ("w", "b"):
+        return (Position.opposite_color(result[0]), result[1])
+    return result
 
 
-build_permutations_from_additional_pieces("bp", find_stalemates=False)
\ No newline at end of file
+def build_permutations_from_additional_pieces(
+    additional_pieces, find_checkmates=True, find_stalemates=True, mirror=False
+):
+    """Given an iterator of additional pieces (i.e., not either king), return all positions
+    with kings and those extra pieces that are either checkmate or stalemate.
+
+    If mirror is true, positions with black to move are found as the mirrors (see
+    position.py) of positions with white to move. When the pieces are their own mirror
+    (e.g. "Bb"), those are the positions already checked, so every position is found
+    while checking half as many. Otherwise they are the positions of the mirrored pieces
+    (e.g. "BP" for "bp") with white to move, which are checked instead."""
+    additional_pieces = list(additional_pieces)
+    mirrored_pieces = list("".join(additional_pieces).swapcase())
+    own_mirror = mirror and sorted(mirrored_pieces) == sorted(additional_pieces)
+
+    def get_result(position):
+        """Return the result of a position if it's one we're looking for, or None."""
+        result = Position.check_position(position)
+        if (find_checkmates and result[1] == "checkmate") or (
+            find_stalemates and result[1] == "stalemate"
+        ):
+            return result
+        return None
+
+    # Check every board with each player to move, or only white if using mirrors.
+    for board in _get_boards(additional_pieces):
+        for active in ["w"] if mirror else ["w", "b"]:
+            position = " ".join((board, active, "0", "1"))
+            result = get_result(position)
+            if result is not None:
+                print(position, result)
+                if own_mirror:
+                    print(Position.mirror_position(position), _mirror_result(result))
+
+    # Find the positions with black to move from the mirrored pieces, if they differ.
+    if mirror and not own_mirror:
+        for board in _get_boards(mirrored_pieces):
+            position = " ".join((board, "w", "0", "1"))
+            result = get_result(position)
+            if result is not None:
+                print(Position.mirror_position(position), _mirror_result(result))
+
+
+build_permutations_from_additional_pieces("bp", find_stalemates=False)
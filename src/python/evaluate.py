@@ -1,10 +1,22 @@
+import cache as Cache
 from collections import Counter
-from copy import deepcopy
+import concurrent.futures
 import functools
+import json
+import multiprocessing
+import os
 import position as Position
+import tablebase as Tablebase
+import transposition as Transposition
+from timeit import default_timer as timer
 
 CACHE_SIZE = 1048576  # size of LRU caching for functions.
 MAX_FULLMOVES = 150  # maximum fullmove depth.
+MAX_PLY = 2 * MAX_FULLMOVES + 1  # maximum depth of a search without a depth limit.
+MAX_HALFMOVES = 100  # halfmove clock at which the 50-move rule draws the game.
+LIMIT_CHECK_INTERVAL = 256  # nodes to search between checks of the time budget.
+MAX_QUIESCENCE_PLY = 12  # maximum depth of a quiescence search past the horizon.
+ASPIRATION_WINDOW = 2  # default distance of aspiration windows from the last score.
 
 # Value of game outcomes.
 SCORE_WIN = 100
@@ -23,26 +35,40 @@ PIECE_VALUES = {
 }  # taken from regular chess, unsure if these hold up.
 
 
-@functools.lru_cache(maxsize=CACHE_SIZE)
-def score_position_estimate(position, player):
-    """Given a position, score it for the given player using an estimate."""
-    pieces_white = Position.get_current_pieces(position, "w")
-    pieces_black = Position.get_current_pieces(position, "b")
-    score_white = sum(PIECE_VALUES[piece.upper()] for piece in pieces_white)
-    score_black = sum(PIECE_VALUES[piece.upper()] for piece in pieces_black)
+def score_board_estimate(board, player):
+    """Given a board, score it for the given player using an estimate."""
+    pieces = set(board)  # there is at most one of each piece.
+    score_white = sum(PIECE_VALUES[piece] for piece in pieces if piece.isupper())
+    score_black = sum(
+        PIECE_VALUES[piece.upper()] for piece in pieces if piece.islower()
+    )
     if player == "w":
         return score_white - score_black
     elif player == "b":
         return score_black - score_white
 
 
-@functools.lru_cache(maxsize=CACHE_SIZE)
+def score_position_estimate(position, player):
+    """Given a position, score it for the given player using an estimate. Scores are
+    cached by board, as they don't depend on the clocks."""
+    return Cache.CACHE.get(
+        "estimate",
+        position.split(" ", 1)[0],
+        player,
+        score_board_estimate,
+        Cache.mirror_unchanged,
+    )
+
+
 def score_position_definite(position, player):
-    """Given a position, score it for the given player if the game is over."""
+    """Given a position, score it for the given player if the game is over. Whether the
+    game is over apart from the clocks is cached by board (see cache.py)."""
     board, active, halfmove, fullmove = position.split(" ")
-    state = Position.check_position(position)
     if int(fullmove) >= MAX_FULLMOVES:
         return SCORE_DRAW
+    state = Cache.get_state(board, active)
+    if state[0] is None and int(halfmove) >= MAX_HALFMOVES:
+        return SCORE_DRAW  # the 50-move rule only gives way to checkmate.
     elif state[0] == "w":
         return SCORE_WIN if player == "w" else SCORE_LOSS
     elif state[0] == "b":
@@ -53,20 +79,351 @@ def score_position_definite(position, player):
         return None
 
 
-@functools.lru_cache(maxsize=CACHE_SIZE)
 def next_move_heuristic_estimate(position, starting_player):
     """Use the position scoring estimator to return the list of moves in order from best
-    to worst."""
-    potential_moves = Position.get_current_moves(position)
-    return sorted(
-        potential_moves,
-        key=lambda move: score_position_estimate(
-            Position.apply_move(position, move), starting_player
-        ),  # sort by score for the starting player after applying the move.
-        reverse=True,  # we want the best moves to be first.
+    to worst. The order is cached by board and starting player."""
+    board, active, _, _ = position.split(" ")
+
+    def order_moves(board, active):
+        return tuple(
+            sorted(
+                Cache.get_moves(board, active),
+                key=lambda move: score_position_estimate(
+                    Position.apply_move_board(board, move), starting_player
+                ),  # sort by score for the starting player after applying the move.
+                reverse=True,  # we want the best moves to be first.
+            )
+        )
+
+    return list(
+        Cache.CACHE.get(("estimate order", starting_player), board, active, order_moves)
     )
 
 
+def next_move_heuristic_default(position, starting_player):
+    """Return the list of moves in the order they are generated. This is a module-level
+    function rather than a lambda so that it can be sent to worker processes."""
+    return Cache.get_current_moves(position)
+
+
+def get_capture_key(board, move):
+    """Return a key to sort captures by: most valuable victim first, and then least
+    valuable attacker first (MVV-LVA)."""
+    return (-PIECE_VALUES[board[move[1]].upper()], PIECE_VALUES[board[move[0]].upper()])
+
+
+class MoveOrdering:
+    """Move ordering that learns from the search, for trying the moves most likely to
+    cause a cutoff first. Moves are tried in the order:
+
+      1. the hash move (the best move stored in the transposition table),
+      2. captures, most valuable victim first and then least valuable attacker first
+         (MVV-LVA),
+      3. killer moves: quiet moves that recently caused a cutoff at the same ply,
+      4. other quiet moves, by their history score: the sum of the squared remaining
+         depth of every cutoff they caused, for the same player.
+
+    Moves that tie keep the order of the next move heuristic. Pass the same instance to
+    several searches (as iterative deepening does) to keep what was learned; new_search
+    ages the history so that recent cutoffs count for more."""
+
+    def __init__(self, killers_per_ply=2):
+        self.killers_per_ply = killers_per_ply
+        self.clear()
+
+    def clear(self):
+        """Forget every killer move and history score."""
+        self.killers = [[] for _ in range(MAX_PLY + 1)]  # killer moves at each ply.
+        self.history = {}  # (active, start, end) to history score.
+
+    def new_search(self):
+        """Mark the start of a new search, halving history scores."""
+        for key in self.history:
+            self.history[key] //= 2
+
+    def order_moves(self, board, active, moves, ply, hash_move=None):
+        """Return the moves of the player to move on a board, at a ply from the root,
+        in the order to search them."""
+        killers = self.killers[ply]
+        history = self.history
+
+        def move_key(move):
+            if move == hash_move:
+                return (0, 0, 0)
+            if board[move[1]] != Position.NOTATION_EMPTY:
+                return (1,) + get_capture_key(board, move)
+            if move in killers:
+                return (2, killers.index(move), 0)
+            return (3, -history.get((active, move[0], move[1]), 0), 0)
+
+        return sorted(moves, key=move_key)
+
+    def record_cutoff(self, board, active, move, ply, depth):
+        """Record that a move caused a cutoff at a ply from the root, with a depth (in
+        ply) left to search below it. Captures are already tried early, so only quiet
+        moves are recorded."""
+        if board[move[1]] != Position.NOTATION_EMPTY:
+            return
+        killers = self.killers[ply]
+        if move not in killers:
+            killers.insert(0, move)
+            del killers[self.killers_per_ply :]
+        key = (active, move[0], move[1])
+        history = self.history
+        history[key] = history.get(key, 0) + depth * depth
+
+
+class SearchAborted(Exception):
+    """Raised inside a search when it runs out of its time or node budget, or is
+    stopped."""
+
+
+# Kinds of values in the board cache whose hits and misses are counted by SearchStats.
+STATS_CACHES = ["state", "estimate", "moves"]
+
+
+class SearchStats:
+    """Counters for finding out where a search spends its time. Pass one to a search to
+    collect them; searches without one don't count anything. The same collector can be
+    passed to several searches, in which case the counts add up.
+
+    Nodes are counted by ply from the root. A cutoff is a node that stopped searching
+    its moves early because of the alpha-beta window, and the first-move cutoff rate is
+    the fraction of those that happened on the first move tried (a measure of how good
+    move ordering is). Decisive cutoffs are the nodes that stopped early because they
+    found a forced win or loss. Hits and misses of the board cache (see cache.py) are
+    counted as the difference between its stats before and after each search, so they
+    include any other use of the cache at the same time."""
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        """Reset every counter."""
+        self.searches = 0
+        self.seconds = 0.0
+        self.nodes = 0
+        self.nodes_by_ply = []
+        self.repetitions = 0  # nodes drawn by threefold repetition.
+        self.terminal = 0  # nodes where the game is over.
+        self.horizon = 0  # nodes scored by the estimator at the depth limit.
+        self.quiescence_nodes = 0  # nodes searched past the depth limit.
+        self.cutoffs = 0
+        self.first_move_cutoffs = 0
+        self.decisive_cutoffs = 0
+        self.tt_probes = 0
+        self.tt_hits = 0
+        self.tt_cutoffs = 0  # nodes whose score was taken from the table.
+        self.tablebase_hits = 0
+        self.caches = {name: {"hits": 0, "misses": 0} for name in STATS_CACHES}
+        self.depths = []  # per-iteration dicts, for iterative deepening.
+        self._start = None
+        self._cache_info = None
+
+    def start(self):
+        """Mark the start of a search."""
+        self._cache_info = {
+            name: (Cache.CACHE.hits[name], Cache.CACHE.misses[name])
+            for name in STATS_CACHES
+        }
+        self._start = timer()
+
+    def stop(self):
+        """Mark the end of a search, adding its time and cache use to the totals."""
+        self.seconds += timer() - self._start
+        self.searches += 1
+        for name in STATS_CACHES:
+            hits, misses = self._cache_info[name]
+            self.caches[name]["hits"] += Cache.CACHE.hits[name] - hits
+            self.caches[name]["misses"] += Cache.CACHE.misses[name] - misses
+        self._start = None
+
+    def count_node(self, ply):
+        """Count a node at a ply from the root."""
+        self.nodes += 1
+        if ply >= len(self.nodes_by_ply):
+            self.nodes_by_ply.extend([0] * (ply + 1 - len(self.nodes_by_ply)))
+        self.nodes_by_ply[ply] += 1
+
+    def count_cutoff(self, move_index):
+        """Count a cutoff on the move at an index in the node's move order."""
+        self.cutoffs += 1
+        if move_index == 0:
+            self.first_move_cutoffs += 1
+
+    def record_depth(self, iteration, counts_before):
+        """Record an iteration of iterative deepening, given the result of counts()
+        before it started."""
+        record = dict(iteration)
+        for name, count in self.counts().items():
+            record[name] = count - counts_before[name]
+        self.depths.append(record)
+
+    def counts(self):
+        """Return a dict of the counters that add up over nodes."""
+        return {
+            "nodes": self.nodes,
+            "repetitions": self.repetitions,
+            "terminal": self.terminal,
+            "horizon": self.horizon,
+            "quiescence_nodes": self.quiescence_nodes,
+            "cutoffs": self.cutoffs,
+            "first_move_cutoffs": self.first_move_cutoffs,
+            "decisive_cutoffs": self.decisive_cutoffs,
+            "tt_probes": self.tt_probes,
+            "tt_hits": self.tt_hits,
+            "tt_cutoffs": self.tt_cutoffs,
+            "tablebase_hits": self.tablebase_hits,
+        }
+
+    def first_move_cutoff_rate(self):
+        """Return the fraction of cutoffs that happened on the first move."""
+        return self.first_move_cutoffs / self.cutoffs if self.cutoffs else 0.0
+
+    def nodes_per_second(self):
+        """Return the number of nodes searched per second."""
+        return self.nodes / self.seconds if self.seconds else 0.0
+
+    def to_dict(self):
+        """Return a dict of every counter and the rates derived from them."""
+        caches = {}
+        for name, cache in self.caches.items():
+            lookups = cache["hits"] + cache["misses"]
+            caches[name] = dict(
+                cache, hit_rate=cache["hits"] / lookups if lookups else 0.0
+            )
+        return dict(
+            self.counts(),
+            searches=self.searches,
+            seconds=self.seconds,
+            nodes_per_second=self.nodes_per_second(),
+            nodes_by_ply=list(self.nodes_by_ply),
+            first_move_cutoff_rate=self.first_move_cutoff_rate(),
+            tt_hit_rate=self.tt_hits / self.tt_probes if self.tt_probes else 0.0,
+            caches=caches,
+            depths=[dict(depth) for depth in self.depths],
+        )
+
+    def to_json(self, path=None):
+        """Return the stats as a JSON string, also writing it to a file if given."""
+        text = json.dumps(self.to_dict(), indent=2)
+        if path is not None:
+            with open(path, "w") as f:
+                f.write(text + "\n")
+        return text
+
+    def summary(self):
+        """Return a one-line summary of the stats."""
+        return (
+            "Time taken: {:.3f}s ({:,} nodes, {:,.0f} nodes/s, {:,} cutoffs, "
+            "{:.1%} on first move)".format(
+                self.seconds,
+                self.nodes,
+                self.nodes_per_second(),
+                self.cutoffs,
+                self.first_move_cutoff_rate(),
+            )
+        )
+
+
+def get_board_hash_counts(seen_boards):
+    """Turn a counter of seen boards into a Counter of their hashes, as kept by
+    SearchState. The hash doesn't include the player to move, to match how boards are
+    counted."""
+    counts = Counter()
+    for board, count in seen_boards.items():
+        counts[Position.zobrist_hash(board, "w")] += count
+    return counts
+
+
+class SearchState:
+    """State shared by every node of a single search. Nodes modify it in place rather
+    than copying anything when recursing.
+
+    The boards on the path from the root (and earlier in the game) are kept as a
+    Counter of their hashes (used for threefold repetition), whose count for a node's
+    board goes up before searching its children and back down after. The best line from
+    each node is collected in a triangular principal variation (PV) table: row i holds
+    the best line from the node at ply i in columns i onwards, ending before column
+    pv_length[i].
+
+    A search can be given a deadline (as a timer() value) and a node limit, after which
+    SearchAborted is raised, and a stop_event (e.g. a threading.Event) that raises it
+    once set, so that another thread can stop the search. It can also be given a line to
+    search first (pv_hint), usually the best line from a shallower search, a SearchStats
+    to count into, and a MoveOrdering to order moves with. If quiescence is true,
+    positions at max_depth are scored with a quiescence search rather than the estimator
+    alone, and if pvs is true, moves after the first are searched with null windows (see
+    score_position)."""
+
+    def __init__(
+        self,
+        starting_player,
+        max_depth,
+        max_depth_heuristic,
+        next_move_heuristic,
+        find_shortest_line,
+        transposition_table,
+        tablebases=None,
+        root_depth=0,
+        history=(),
+        deadline=None,
+        node_limit=None,
+        pv_hint=(),
+        stats=None,
+        move_ordering=None,
+        quiescence=False,
+        pvs=False,
+        stop_event=None,
+    ):
+        self.starting_player = starting_player
+        self.max_depth = max_depth
+        self.max_depth_heuristic = max_depth_heuristic
+        self.next_move_heuristic = next_move_heuristic
+        self.find_shortest_line = find_shortest_line
+        self.transposition_table = transposition_table
+        self.tablebases = tablebases
+        self.root_depth = root_depth
+        # Counts of the hashes of boards on the path, for repetition.
+        self.history = Counter(history)
+        if max_depth is None or max_depth < root_depth:
+            num_ply = MAX_PLY
+        else:
+            num_ply = max_depth - root_depth + 1
+        self.pv_table = [[None] * num_ply for _ in range(num_ply)]
+        self.pv_length = [0] * num_ply
+        self.pv_hint = list(pv_hint)
+        self.deadline = deadline
+        self.node_limit = node_limit
+        self.stop_event = stop_event
+        self.nodes = 0  # number of nodes searched.
+        self.next_check = (
+            0 if deadline or node_limit or stop_event is not None else float("inf")
+        )
+        self.reached_max_depth = False  # whether any line was cut off by max_depth.
+        self.stats = stats
+        self.move_ordering = move_ordering
+        self.quiescence = quiescence
+        self.pvs = pvs and not find_shortest_line  # null windows can't compare lines.
+
+    def check_limits(self):
+        """Raise SearchAborted if the search is out of time or nodes or has been
+        stopped, and otherwise schedule the next check."""
+        if self.node_limit is not None and self.nodes >= self.node_limit:
+            raise SearchAborted()
+        if self.stop_event is not None and self.stop_event.is_set():
+            raise SearchAborted()
+        if self.deadline is not None and timer() >= self.deadline:
+            raise SearchAborted()
+        self.next_check = self.nodes + LIMIT_CHECK_INTERVAL
+        if self.node_limit is not None:
+            self.next_check = min(self.next_check, self.node_limit)
+
+    def get_line(self):
+        """Return the best line found from the root."""
+        return self.pv_table[0][: self.pv_length[0]]
+
+
 def score_position(
     position,  # position to score.
     starting_player=None,  # starting player to optimize score for.
@@ -75,36 +432,154 @@ def score_position(
     depth=0,  # current depth.
     max_depth=None,  # maximum depth to search, in ply (a turn by a single player).
     max_depth_heuristic=score_position_estimate,  # function to use to estimate score.
-    next_move_heuristic=lambda position, _: Position.get_current_moves(
-        position
-    ),  # heuristic to return moves in order of preference.
+    next_move_heuristic=next_move_heuristic_default,  # orders moves by preference.
     movelist=[],  # list of moves made so far.
     seen_boards=Counter(),  # counter of seen boards; used for threefold repetition.
     find_shortest_line=True,  # prioritize finding shortest line (longer).
+    transposition_table=None,  # optional TranspositionTable to reuse results in.
+    tablebases=None,  # optional Tablebases to look up endgames in.
+    stats=None,  # optional SearchStats to count into.
+    move_ordering=None,  # optional MoveOrdering to order moves with.
+    quiescence=False,  # search captures past max_depth until the position is quiet.
+    pvs=False,  # use principal variation search (ignored if find_shortest_line).
 ):
     """Given a position, score it (assuming that the opponent plays optimally) and
     return the path to that end state. Uses breadth-first-search recursively with a
-    depth limit, after which it estimates the position using an estimator function."""
-    board, active, halfmove, fullmove = position.split(" ")
+    depth limit, after which it estimates the position using an estimator function.
+
+    If a transposition table is given, positions already searched deeply enough are not
+    searched again, and the best move found previously is tried first. The table only
+    orders moves when finding the shortest line, as stored scores don't record how long
+    the line was. Lines that end in a transposition are cut short at that position.
 
-    # Set starting player in the initial call so we know who to optimize for. This
-    # isn't overwritten (it persists) in subsequent recursive calls.
+    If tablebases are given, positions with few enough pieces are looked up instead of
+    searched, and the line from them is the tablebase's line to mate.
+
+    If a SearchStats is given, the search counts nodes, cutoffs and cache use into it.
+    If a MoveOrdering is given, moves are reordered by it (after next_move_heuristic),
+    which usually makes for many more cutoffs.
+
+    If quiescence is true, positions at max_depth aren't estimated straight away, but
+    searched further with only captures (see _score_quiescence), so that the estimate
+    doesn't miss a piece about to be taken. Lines still end at max_depth.
+
+    If pvs is true, the search is a principal variation search: the first move at each
+    node is searched with the full window, and the rest with a null window that only
+    tells whether they are better than the best move so far. Those that are get searched
+    again with the full window. With good move ordering the first move is usually best,
+    so most moves are only searched with a null window, which prunes much more. Null
+    windows don't give exact scores to compare line lengths with, so this only applies
+    when not finding the shortest line."""
+    # Set starting player in the initial call so we know who to optimize for.
     if starting_player is None:
-        starting_player = active
+        starting_player = position.split(" ")[1]
+
+    # Set up the state shared by the whole search.
+    history = get_board_hash_counts(seen_boards)
+    state = SearchState(
+        starting_player,
+        max_depth,
+        max_depth_heuristic,
+        next_move_heuristic,
+        find_shortest_line,
+        transposition_table,
+        tablebases,
+        root_depth=depth,
+        history=history,
+        stats=stats,
+        move_ordering=move_ordering,
+        quiescence=quiescence,
+        pvs=pvs,
+    )
+    if transposition_table is not None:
+        transposition_table.new_search()
+    if move_ordering is not None:
+        move_ordering.new_search()
+
+    if stats is not None:
+        stats.start()
+    score = _score_node(state, position, alpha, beta, depth)
+    if stats is not None:
+        stats.stop()
+    return score, list(movelist) + state.get_line()
 
-    # Check for draw via threefold repetition using the boards we've seen.
-    if board in seen_boards and seen_boards.get(board) >= 3:
-        return SCORE_DRAW, movelist
+
+def _score_node(state, position, alpha, beta, depth, follow_pv=False):
+    """Score a single node of a search, returning the score and leaving the best line
+    from it in the PV table. follow_pv is true if the path to this node is the start of
+    the search's pv_hint."""
+    ply = depth - state.root_depth
+    state.pv_length[ply] = ply  # the line from this node starts out empty.
+    state.nodes += 1
+    stats = state.stats
+    if stats is not None:
+        stats.count_node(ply)
+    if state.nodes >= state.next_check:
+        state.check_limits()
+    board, active, halfmove, fullmove = position.split(" ")
+    starting_player = state.starting_player
+    find_shortest_line = state.find_shortest_line
+
+    # Check for draw via threefold repetition using the boards we've seen. The board
+    # hash doesn't include the player to move, to match how boards are counted.
+    board_key = Position.zobrist_hash(board, "w")
+    if state.history[board_key] >= 3:
+        if stats is not None:
+            stats.repetitions += 1
+        return SCORE_DRAW
 
     # Check if game is over by other means.
     definite_score = score_position_definite(position, starting_player)
     if definite_score is not None:
-        return definite_score, movelist
+        if stats is not None:
+            stats.terminal += 1
+        return definite_score
+
+    # Look up positions with few enough pieces in the tablebases, which give the exact
+    # result and the line to it. Tables ignore the 50-move and fullmove limits, so a
+    # mate that would arrive after either is searched instead.
+    tablebases = state.tablebases
+    if (
+        tablebases is not None
+        and len(board) - board.count(".") <= 2 + Tablebase.MAX_ADDITIONAL_PIECES
+    ):
+        bits = Position.board_to_bits(board)
+        result = tablebases.probe_bits(bits, active)
+        if result is not None and (
+            result[0] == 0
+            or (
+                int(halfmove) + result[1] <= MAX_HALFMOVES
+                and int(fullmove) + (result[1] + (active == "b")) // 2 < MAX_FULLMOVES
+            )
+        ):
+            if stats is not None:
+                stats.tablebase_hits += 1
+            # Write the line into the row without shortening it, as siblings of this
+            # node at the same ply use the row too. Lines past the end of the row
+            # lengthen it.
+            line = tablebases.probe_line(bits, active)
+            pv_row = state.pv_table[ply]
+            end = ply + len(line)
+            if end > len(pv_row):
+                pv_row.extend([None] * (end - len(pv_row)))
+            pv_row[ply:end] = line
+            state.pv_length[ply] = end
+            if result[0] == 0:
+                return SCORE_DRAW
+            elif (result[0] == 1) == (active == starting_player):
+                return SCORE_WIN
+            return SCORE_LOSS
 
     # If not, the game isn't over so we need to score the position.
-    # If we are max depth, use the estimator to score.
-    if depth == max_depth:
-        return max_depth_heuristic(position, starting_player), movelist
+    # If we are max depth, use the estimator to score (after a quiescence search, if
+    # asked for).
+    if depth == state.max_depth:
+        state.reached_max_depth = True
+        if stats is not None:
+            stats.horizon += 1
+        if state.quiescence:
+            return _score_quiescence(state, position, alpha, beta, 0)
+        return state.max_depth_heuristic(position, starting_player)
 
     # Otherwise, we are not at max depth, so we need to score the position.
     # We want the best possible score for the starting player, but we also assume that
@@ -115,87 +590,640 @@ def score_position(
     # We can save time by returning SCORE_WHITE_WIN or SCORE_BLACK_WIN immediately, if
     # it's the best/worst score as above (because we know that other branches can't
     # beat it).
-    potential_moves = next_move_heuristic(position, starting_player)
+    #
+    # Look up the position in the transposition table before generating moves, so that
+    # a cutoff doesn't pay for them. Scores are stored for white, so that they can be
+    # reused by searches for either player. If the table stores positions by their
+    # canonical mirror, a position with black to move is stored as its mirror: with
+    # white's score there being black's score here, and moves mirrored.
+    transposition_table = state.transposition_table
+    hash_move = None
+    if transposition_table is not None:
+        mirrored = transposition_table.mirror and active == "b"
+        if mirrored:
+            key = Position.zobrist_hash(Position.mirror_board(board), "w")
+        else:
+            key = board_key ^ Position.ZOBRIST_BLACK if active == "b" else board_key
+        flip = (starting_player == "b") != mirrored  # whether to negate scores.
+        remaining = (
+            Transposition.DEPTH_UNLIMITED
+            if state.max_depth is None
+            else state.max_depth - depth
+        )
+        entry = transposition_table.probe(key)
+        if stats is not None:
+            stats.tt_probes += 1
+            stats.tt_hits += entry is not None
+        if entry is not None:
+            entry_depth, entry_score, entry_bound, hash_move = entry
+            if mirrored and hash_move is not None:
+                hash_move = Position.mirror_move(hash_move)
+            if flip:  # flip from white's perspective.
+                entry_score = -entry_score
+                entry_bound = Transposition.flip_bound(entry_bound)
+            # The root always searches its moves, so that there's a line to return.
+            if entry_depth >= remaining and not find_shortest_line and ply > 0:
+                if (
+                    entry_bound == Transposition.BOUND_EXACT
+                    or (
+                        entry_bound == Transposition.BOUND_LOWER and entry_score >= beta
+                    )
+                    or (
+                        entry_bound == Transposition.BOUND_UPPER
+                        and entry_score <= alpha
+                    )
+                ):
+                    if entry_depth != Transposition.DEPTH_UNLIMITED:
+                        state.reached_max_depth = True  # entry may have been cut off.
+                    if stats is not None:
+                        stats.tt_cutoffs += 1
+                    return entry_score
+        original_alpha, original_beta = alpha, beta
 
-    # Store best score to compare against and the move that leads to it.
+    potential_moves = state.next_move_heuristic(position, starting_player)
+    if hash_move is not None and hash_move in potential_moves:  # try it first.
+        potential_moves = [hash_move] + [
+            move for move in potential_moves if move != hash_move
+        ]
+
+    # Reorder the moves with what the search has learned so far, if asked to.
+    move_ordering = state.move_ordering
+    if move_ordering is not None:
+        potential_moves = move_ordering.order_moves(
+            board, active, potential_moves, ply, hash_move
+        )
+
+    # If we are following the hinted line, try its next move first (before the hash
+    # move, if any).
+    pv_move = None
+    if follow_pv and ply < len(state.pv_hint):
+        pv_move = state.pv_hint[ply]
+        if pv_move in potential_moves:
+            potential_moves = [pv_move] + [
+                move for move in potential_moves if move != pv_move
+            ]
+
+    # Store best score to compare against. The line that leads to it is kept in this
+    # node's row of the PV table, and its length in pv_length.
     if active == starting_player:
         best_score = SCORE_LOSS - 1
     else:
         best_score = SCORE_WIN + 1
-    best_movelist = None
-
-    for potential_move in potential_moves:
-        # Make the new position.
-        potential_position = Position.apply_move(position, potential_move)
-
-        # Make a deepcopy of the movelist and add the current move.
-        potential_movelist = deepcopy(movelist)
-        potential_movelist.append(potential_move)
-
-        # Make a deep copy of seen boards and increment the current board in it.
-        potential_seen_boards = deepcopy(seen_boards)
-        potential_seen_boards[board] += 1
-
-        # Get the score of this potential position via recursion.
-        predicted_score, predicted_movelist = score_position(
-            position=potential_position,  # use the new position.
-            starting_player=starting_player,  # use the same starting player.
-            alpha=alpha,  # use the same alpha and beta values.
-            beta=beta,
-            depth=depth + 1,  # increment the depth by 1.
-            max_depth=max_depth,  # use the same max depth.
-            max_depth_heuristic=max_depth_heuristic,  # use the same estimator function for max depth cases.
-            movelist=potential_movelist,  # use the same movelist.
-            seen_boards=potential_seen_boards,  # use the new deep copy of seen boards.
-            find_shortest_line=find_shortest_line,  # use same setting.
-        )
+    pv_length = state.pv_length
+    pv_row = state.pv_table[ply]
+    child_pv_row = state.pv_table[ply + 1] if ply + 1 < len(state.pv_table) else None
+
+    state.history[board_key] += 1  # children see this board as seen.
+    pvs = state.pvs
+    for move_index, potential_move in enumerate(potential_moves):
+        # Get the score of this potential position via recursion. With PVS, moves after
+        # the first are searched with a null window first, and again with the full
+        # window only if they turn out to be better.
+        next_position = Position.apply_move(position, potential_move)
+        follow_pv = pv_move is not None and potential_move == pv_move
+        if pvs and move_index > 0 and alpha + 1 < beta:
+            if active == starting_player:
+                predicted_score = _score_node(
+                    state, next_position, alpha, alpha + 1, depth + 1, follow_pv
+                )
+            else:
+                predicted_score = _score_node(
+                    state, next_position, beta - 1, beta, depth + 1, follow_pv
+                )
+            if alpha < predicted_score < beta:
+                predicted_score = _score_node(
+                    state, next_position, alpha, beta, depth + 1, follow_pv
+                )
+        else:
+            predicted_score = _score_node(
+                state, next_position, alpha, beta, depth + 1, follow_pv
+            )
+        predicted_length = pv_length[ply + 1]  # length of the child's line.
 
         # Alpha-beta pruning.
         if active == starting_player:  # maximizing player.
             if predicted_score > best_score or (
                 find_shortest_line
                 and predicted_score == best_score
-                and len(predicted_movelist) < len(best_movelist)
+                and predicted_length < pv_length[ply]
             ):  # if we've found a better score, or a shorter one...
                 best_score = predicted_score  # set the best score to the new score.
-                best_movelist = predicted_movelist  # set the movelist for that score.
+                pv_row[ply] = potential_move  # set the line for that score.
+                pv_row[ply + 1 : predicted_length] = child_pv_row[
+                    ply + 1 : predicted_length
+                ]
+                pv_length[ply] = predicted_length
             if best_score >= beta and (
-                not find_shortest_line or len(predicted_movelist) >= len(best_movelist)
+                not find_shortest_line or predicted_length >= pv_length[ply]
             ):  # if we can't get any better and the line isn't shorter...
+                if stats is not None:
+                    stats.count_cutoff(move_index)
+                if move_ordering is not None:
+                    move_ordering.record_cutoff(
+                        board,
+                        active,
+                        potential_move,
+                        ply,
+                        1 if state.max_depth is None else state.max_depth - depth,
+                    )
                 break  # prune.
             alpha = max(alpha, best_score)
             if (
                 not find_shortest_line and best_score == SCORE_WIN
             ):  # abort early if we've found a win.
-                return best_score, best_movelist
+                if stats is not None:
+                    stats.decisive_cutoffs += 1
+                break
         else:  # similar (but opposite) case for the minimizing player.
             if predicted_score < best_score or (
                 find_shortest_line
                 and predicted_score == best_score
-                and len(predicted_movelist) < len(best_movelist)
+                and predicted_length < pv_length[ply]
             ):
                 best_score = predicted_score
-                best_movelist = predicted_movelist
+                pv_row[ply] = potential_move
+                pv_row[ply + 1 : predicted_length] = child_pv_row[
+                    ply + 1 : predicted_length
+                ]
+                pv_length[ply] = predicted_length
             if best_score <= alpha and (
-                not find_shortest_line or len(predicted_movelist) >= len(best_movelist)
+                not find_shortest_line or predicted_length >= pv_length[ply]
             ):
+                if stats is not None:
+                    stats.count_cutoff(move_index)
+                if move_ordering is not None:
+                    move_ordering.record_cutoff(
+                        board,
+                        active,
+                        potential_move,
+                        ply,
+                        1 if state.max_depth is None else state.max_depth - depth,
+                    )
                 break  # prune.
             beta = min(beta, best_score)
             if (
                 not find_shortest_line and best_score == SCORE_LOSS
             ):  # abort early if we've found a loss.
-                return best_score, best_movelist
+                if stats is not None:
+                    stats.decisive_cutoffs += 1
+                break
+    state.history[board_key] -= 1
+
+    # Store the result in the transposition table, with the type of bound it is.
+    if transposition_table is not None:
+        if best_score <= original_alpha:
+            bound = Transposition.BOUND_UPPER
+        elif best_score >= original_beta:
+            bound = Transposition.BOUND_LOWER
+        else:
+            bound = Transposition.BOUND_EXACT
+        score, best_move = best_score, pv_row[ply]
+        if flip:  # store from white's perspective.
+            score, bound = -score, Transposition.flip_bound(bound)
+        if mirrored and best_move is not None:
+            best_move = Position.mirror_move(best_move)
+        transposition_table.store(key, remaining, score, bound, best_move)
+
+    return best_score
+
+
+def _score_quiescence(state, position, alpha, beta, quiescence_ply):
+    """Score a position past the depth limit by searching only captures until there are
+    none left (a quiet position), so that the estimate isn't taken in the middle of an
+    exchange. The player to move can always "stand pat" and take the estimate instead
+    of capturing, which bounds the score and prunes like alpha-beta. A player in check
+    can't stand pat, and searches every move instead of just captures.
+
+    Captures can't repeat a position, so repetition isn't checked, and checks are
+    limited by MAX_QUIESCENCE_PLY, after which the estimate is taken as is."""
+    state.nodes += 1
+    if state.nodes >= state.next_check:
+        state.check_limits()
+    stats = state.stats
+    if stats is not None:
+        stats.quiescence_nodes += 1
+    starting_player = state.starting_player
+    definite_score = score_position_definite(position, starting_player)
+    if definite_score is not None:
+        return definite_score
+
+    board, active, _, _ = position.split(" ")
+    maximizing = active == starting_player
+    in_check = Cache.is_in_check(board, active)
+    if in_check and quiescence_ply < MAX_QUIESCENCE_PLY:
+        best_score = SCORE_LOSS - 1 if maximizing else SCORE_WIN + 1
+        moves = Cache.get_moves(board, active)
+    else:
+        best_score = state.max_depth_heuristic(position, starting_player)  # stand pat.
+        if quiescence_ply >= MAX_QUIESCENCE_PLY:
+            return best_score
+        if maximizing:
+            if best_score >= beta:
+                return best_score
+            alpha = max(alpha, best_score)
+        else:
+            if best_score <= alpha:
+                return best_score
+            beta = min(beta, best_score)
+        moves = sorted(
+            (
+                move
+                for move in Cache.get_moves(board, active)
+                if board[move[1]] != Position.NOTATION_EMPTY
+            ),
+            key=lambda move: get_capture_key(board, move),
+        )
+
+    for move in moves:
+        predicted_score = _score_quiescence(
+            state, Position.apply_move(position, move), alpha, beta, quiescence_ply + 1
+        )
+        if maximizing:
+            best_score = max(best_score, predicted_score)
+            if best_score >= beta:
+                break  # prune.
+            alpha = max(alpha, best_score)
+        else:
+            best_score = min(best_score, predicted_score)
+            if best_score <= alpha:
+                break  # prune.
+            beta = min(beta, best_score)
+    return best_score
+
+
+def score_position_iterative(
+    position,  # position to score.
+    time_limit=None,  # time budget in seconds, or None for no limit.
+    node_limit=None,  # budget of nodes to search in total, or None for no limit.
+    max_depth=MAX_PLY,  # maximum depth to search, in ply.
+    max_depth_heuristic=score_position_estimate,  # function to use to estimate score.
+    next_move_heuristic=next_move_heuristic_default,  # orders moves by preference.
+    find_shortest_line=False,  # prioritize finding shortest line (longer).
+    transposition_table=None,  # optional TranspositionTable to reuse results in.
+    tablebases=None,  # optional Tablebases to look up endgames in.
+    callback=None,  # optional function called with the stats of each iteration.
+    stats=None,  # optional SearchStats to count into, with a record per depth.
+    move_ordering=None,  # optional MoveOrdering, kept across depths.
+    quiescence=False,  # search captures past each depth until the position is quiet.
+    pvs=False,  # use principal variation search (ignored if find_shortest_line).
+    aspiration_window=None,  # distance of the window from the last score, if any.
+    refine_shortest_line=False,  # search a forced result again for the shortest line.
+    seen_boards=None,  # optional counter of boards seen in the game, for repetition.
+    stop_event=None,  # optional event that stops the search once set.
+):
+    """Score a position using iterative deepening: search to depth 1, then 2, then 3,
+    and so on, trying the best line of the previous depth first each time. Stops when
+    the budget runs out, in which case the unfinished depth is thrown away, or when
+    deeper searches can't change the result (a forced win or loss was found, or no line
+    reached the depth limit).
+
+    If aspiration_window is given, each depth after the first is searched with a window
+    of that distance around the previous depth's score, rather than the full window. A
+    narrower window prunes more, but if the score falls outside it the depth has to be
+    searched again with the window opened on that side (a "re-search").
+
+    Finding the shortest line slows down every depth, so instead of find_shortest_line
+    the search can be run without it and refine_shortest_line set: if a forced win or
+    loss is found, the depth it was found at is searched once more for the shortest
+    line, with a window that prunes every other result. This finds the shortest line
+    among those where every defense loses within that depth, which is almost always the
+    line that find_shortest_line finds. If the budget runs out during the refinement,
+    the unrefined line is kept.
+
+    If stop_event is given, setting it stops the search like running out of budget does
+    (but the first depth is still always completed).
+
+    The first depth is always searched to completion, so there is always a result. Returns
+    a tuple of (score, movelist, iterations), where score and movelist are from the
+    deepest completed search and iterations is a list of dicts of stats per depth."""
+    start = timer()
+    deadline = None if time_limit is None else start + time_limit
+    starting_player = position.split(" ")[1]
+    score, line, iterations = None, [], []
+    nodes = 0  # nodes searched in previous iterations and searches.
+    history = get_board_hash_counts(seen_boards or {})
+
+    def search(depth, alpha, beta, find_shortest_line, limited):
+        """Search to a depth with a window, and return the score and the search state.
+        Only limited searches are subject to the budget."""
+        nonlocal nodes
+        state = SearchState(
+            starting_player,
+            depth,
+            max_depth_heuristic,
+            next_move_heuristic,
+            find_shortest_line,
+            transposition_table,
+            tablebases,
+            history=history,
+            deadline=deadline if limited else None,
+            node_limit=(
+                None if node_limit is None or not limited else node_limit - nodes
+            ),
+            pv_hint=line,
+            stats=stats,
+            move_ordering=move_ordering,
+            quiescence=quiescence,
+            pvs=pvs,
+            stop_event=stop_event if limited else None,
+        )
+        if transposition_table is not None:
+            transposition_table.new_search()
+        if move_ordering is not None:
+            move_ordering.new_search()
+        try:
+            return _score_node(state, position, alpha, beta, 0, follow_pv=True), state
+        finally:
+            nodes += state.nodes  # count nodes of aborted searches too.
+
+    for depth in range(1, max_depth + 1):
+        alpha, beta = SCORE_LOSS - 1, SCORE_WIN + 1
+        if aspiration_window is not None and iterations:
+            alpha = max(alpha, score - aspiration_window)
+            beta = min(beta, score + aspiration_window)
+        if stats is not None:
+            counts_before = stats.counts()
+            stats.start()
+        iteration_start = timer()
+        nodes_before = nodes
+        researches = 0
+        try:
+            while True:
+                depth_score, state = search(
+                    depth, alpha, beta, find_shortest_line, bool(iterations)
+                )
+                if depth_score <= alpha and alpha > SCORE_LOSS - 1:  # failed low.
+                    alpha = SCORE_LOSS - 1
+                elif depth_score >= beta and beta < SCORE_WIN + 1:  # failed high.
+                    beta = SCORE_WIN + 1
+                else:
+                    break
+                researches += 1
+        except SearchAborted:
+            if stats is not None:
+                stats.stop()  # the unfinished depth's nodes still took time.
+            break
+        score = depth_score
+        line = state.get_line()
+        iteration = {
+            "depth": depth,
+            "score": score,
+            "movelist": line,
+            "nodes": nodes - nodes_before,
+            "researches": researches,
+            "seconds": timer() - iteration_start,
+            "total_seconds": timer() - start,
+        }
+        if transposition_table is not None:
+            iteration["tt_hit_rate"] = transposition_table.hit_rate()
+        iterations.append(iteration)
+        if stats is not None:
+            stats.stop()
+            stats.record_depth(iteration, counts_before)
+        if callback is not None:
+            callback(iteration)
+
+        # Deeper searches can't change a forced result or a fully explored tree.
+        if abs(score) == SCORE_WIN or not state.reached_max_depth:
+            break
+
+    # Search a forced result again for the shortest line, with a window that only
+    # admits the same result.
+    if refine_shortest_line and not find_shortest_line and abs(score) == SCORE_WIN:
+        alpha, beta = (
+            (SCORE_WIN - 1, SCORE_WIN + 1)
+            if score == SCORE_WIN
+            else (SCORE_LOSS - 1, SCORE_LOSS + 1)
+        )
+        try:
+            refined_score, state = search(
+                iterations[-1]["depth"], alpha, beta, True, True
+            )
+            if refined_score == score:
+                line = state.get_line()
+                iterations[-1]["movelist"] = line
+        except SearchAborted:
+            pass
+
+    return score, line, iterations
+
+
+# Alpha shared between the processes of a parallel search, and the tablebases of each
+# process. Set in each worker process by _init_worker.
+_worker_alpha = None
+_worker_tablebases = None
+
+
+def _init_worker(shared_alpha, tablebase_directory, max_tables):
+    """Set up a worker process of a parallel search."""
+    global _worker_alpha, _worker_tablebases
+    _worker_alpha = shared_alpha
+    if tablebase_directory is not None:
+        _worker_tablebases = Tablebase.Tablebases(tablebase_directory, max_tables)
+
+
+def _score_task(task, alpha, tablebases):
+    """Search a single task of a parallel search: a position a few moves into the split
+    part of the tree. The window starts one below alpha, so that moves that tie the best
+    score so far still get an exact score, which keeps tie-breaking deterministic."""
+    (
+        position,
+        movelist,
+        seen_boards,
+        starting_player,
+        max_depth,
+        max_depth_heuristic,
+        next_move_heuristic,
+        find_shortest_line,
+    ) = task
+    return score_position(
+        position,
+        starting_player,
+        alpha=max(alpha - 1, SCORE_LOSS - 1),
+        depth=len(movelist),
+        max_depth=max_depth,
+        max_depth_heuristic=max_depth_heuristic,
+        next_move_heuristic=next_move_heuristic,
+        movelist=movelist,
+        seen_boards=seen_boards,
+        find_shortest_line=find_shortest_line,
+        tablebases=tablebases,
+    )
 
-    return best_score, best_movelist
+
+def _score_task_in_worker(task):
+    """Search a task in a worker process, using the alpha shared between workers."""
+    return _score_task(task, _worker_alpha.value, _worker_tablebases)
+
+
+def _merge_split_node(node, starting_player, find_shortest_line, results):
+    """Merge the results of the tasks under a node of the split part of the tree, in
+    the same way as _score_node picks between moves. Returns (score, movelist), or None
+    if some task under the node hasn't finished."""
+    if "task" in node:
+        return results.get(node["task"])
+    maximizing = node["active"] == starting_player
+    best = None
+    for child in node["children"]:
+        result = _merge_split_node(child, starting_player, find_shortest_line, results)
+        if result is None:
+            return None
+        if (
+            best is None
+            or (result[0] > best[0] if maximizing else result[0] < best[0])
+            or (
+                find_shortest_line
+                and result[0] == best[0]
+                and len(result[1]) < len(best[1])
+            )
+        ):
+            best = result
+    return best
+
+
+def score_position_parallel(
+    position,  # position to score.
+    workers=None,  # number of worker processes; defaults to the number of CPUs.
+    split_depth=1,  # number of ply to split between workers (1 or 2).
+    max_depth=None,  # maximum depth to search, in ply (a turn by a single player).
+    max_depth_heuristic=score_position_estimate,  # function to use to estimate score.
+    next_move_heuristic=next_move_heuristic_default,  # orders moves by preference.
+    movelist=[],  # list of moves made so far.
+    seen_boards=Counter(),  # counter of seen boards; used for threefold repetition.
+    find_shortest_line=True,  # prioritize finding shortest line (longer).
+    tablebases=None,  # optional Tablebases to look up endgames in.
+):
+    """Score a position like score_position, but split the search between processes.
+    The positions after each root move (or, with split_depth=2, after each root move and
+    reply) are searched as separate tasks in a process pool. Whenever every task under a
+    root move has finished, the best score so far is shared with the workers as alpha,
+    so that tasks started later can prune against it.
+
+    Results are merged by picking moves as score_position does (earliest move wins ties),
+    so the result is the same for any number of workers. With workers=1 the tasks are
+    searched in order in this process. Heuristics must be module-level functions so that
+    they can be sent to the workers, and each worker loads its own tablebases from the
+    same directory as the ones given."""
+    if workers is None:
+        workers = os.cpu_count() or 1
+    starting_player = position.split(" ")[1]
+    definite_score = score_position_definite(position, starting_player)
+    if definite_score is not None:
+        return definite_score, list(movelist)
+
+    # Build the split part of the tree, with a task for each position at its bottom (or
+    # where the game ends sooner). Every node records the boards seen on the way to it.
+    tasks = []
+
+    def build_split_node(node_position, node_movelist, node_seen_boards, depth):
+        active = node_position.split(" ")[1]
+        if depth == split_depth or (
+            score_position_definite(node_position, starting_player) is not None
+        ):
+            tasks.append(
+                (
+                    node_position,
+                    node_movelist,
+                    node_seen_boards,
+                    starting_player,
+                    max_depth,
+                    max_depth_heuristic,
+                    next_move_heuristic,
+                    find_shortest_line,
+                )
+            )
+            return {"task": len(tasks) - 1}
+        child_seen_boards = node_seen_boards + Counter([node_position.split(" ")[0]])
+        return {
+            "active": active,
+            "children": [
+                build_split_node(
+                    Position.apply_move(node_position, move),
+                    node_movelist + [move],
+                    child_seen_boards,
+                    depth + 1,
+                )
+                for move in next_move_heuristic(node_position, starting_player)
+            ],
+        }
+
+    root = build_split_node(position, list(movelist), Counter(seen_boards), 0)
+    results = {}
+
+    def update_alpha(alpha):
+        """Return the best score of the root moves whose tasks have all finished."""
+        for child in root["children"]:
+            result = _merge_split_node(child, starting_player, False, results)
+            if result is not None:
+                alpha = max(alpha, result[0])
+        return alpha
+
+    if workers <= 1:
+        alpha = SCORE_LOSS - 1
+        for i, task in enumerate(tasks):
+            results[i] = _score_task(task, alpha, tablebases)
+            alpha = update_alpha(alpha)
+    else:
+        shared_alpha = multiprocessing.Value("i", SCORE_LOSS - 1)
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_worker,
+            initargs=(
+                shared_alpha,
+                None if tablebases is None else tablebases.directory,
+                (
+                    Tablebase.DEFAULT_MAX_TABLES
+                    if tablebases is None
+                    else tablebases.max_tables
+                ),
+            ),
+        ) as executor:
+            futures = {
+                executor.submit(_score_task_in_worker, task): i
+                for i, task in enumerate(tasks)
+            }
+            for future in concurrent.futures.as_completed(futures):
+                results[futures[future]] = future.result()
+                shared_alpha.value = update_alpha(shared_alpha.value)
+
+    return _merge_split_node(root, starting_player, find_shortest_line, results)
 
 
 @functools.lru_cache(maxsize=CACHE_SIZE)
-def test_score_position(position, max_depth=20):
+def test_score_position(
+    position, max_depth=20, transposition_megabytes=None, use_tablebases=False
+):
     print("")
+    transposition_table = None
+    if transposition_megabytes is not None:
+        transposition_table = Transposition.TranspositionTable(
+            megabytes=transposition_megabytes
+        )
+    search_stats = SearchStats()
     score, moves = score_position(
-        position, max_depth=max_depth, find_shortest_line=False
+        position,
+        max_depth=max_depth,
+        find_shortest_line=False,
+        transposition_table=transposition_table,
+        tablebases=Tablebase.TABLEBASES if use_tablebases else None,
+        stats=search_stats,
     )
     print("score={} (depth={})".format(score, max_depth))
+    print(search_stats.summary())
+    if transposition_table is not None:
+        stats = transposition_table.stats()
+        print(
+            "TT hit rate: {:.1%} ({} probes, {:.1%} full, {} overwrites)".format(
+                stats["hit_rate"], stats["probes"], stats["fill"], stats["overwrites"]
+            )
+        )
+    if use_tablebases:
+        stats = Tablebase.TABLEBASES.stats()
+        print(
+            "Tablebase hit rate: {:.1%} ({} probes, {} tables loaded)".format(
+                stats["hit_rate"], stats["probes"], stats["loads"]
+            )
+        )
     Position.playback_moves(position, moves)
     print("")
 
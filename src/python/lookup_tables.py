@@ -0,0 +1,212 @@
+# Precomputed attack tables, so that attacks can be looked up instead of calculated.
+#
+# Square sets are 16-bit integers where square i is bit BOARD_SIZE - 1 - i, the same as
+# the integer board functions in position.py and the C++ code.
+#
+# Non-sliding pieces (king, knight, pawn) always attack the same squares from a given
+# square, so they get a list indexed by square. Sliding pieces (rook-like and
+# bishop-like moves) depend on occupancy, so they get a flat array indexed by
+#
+#   (square << BOARD_SIZE) | occupancy
+#
+# which is the same key layout as attackLookup in the C++ code, minus the piece nibble
+# (a queen is just the OR of the rook and bishop tables). Like the C++ table (and the
+# notebook that generated it), occupancy does not take color into account; AND the
+# result with the complement of the player's own occupancy to get moves.
+#
+# The tables can also be written to a binary file, which is then memory-mapped on
+# import instead of rebuilding the tables. This makes startup near-instant, and since the
+# file is mapped read-only, every process using the tables shares the same pages. The
+# file holds the full attackLookup table from the C++ code, so that it can load the same
+# file. Its format is a 16-byte header followed by the entries:
+#
+#   bytes 0-3   magic, b"1DAT"
+#   bytes 4-5   format version, uint16
+#   bytes 6-7   size of each entry in bytes, uint16 (always 2)
+#   bytes 8-11  number of entries, uint32
+#   bytes 12-15 CRC-32 checksum of the entries, uint32
+#   bytes 16-   entries, uint16, indexed by (nibble << 20) | (square << 16) | occupancy
+#
+# with everything little-endian. Black pieces other than the pawn share the entries of
+# the white piece (the C++ code takes the nibble mod 8), so only nibbles 0 through 9 are
+# stored. Pawn entries are attacks only; the double step is added by move generation.
+#
+# This module cannot import position (which imports it), so it keeps its own copies of
+# the board size and piece nibbles.
+#
+# Run this file directly to (re)generate the table file.
+
+import mmap
+import os
+import struct
+import sys
+import zlib
+from array import array
+
+BOARD_SIZE = 16  # number of squares on the board; same as position.BOARD_SIZE.
+NUM_OCCUPANCIES = 1 << BOARD_SIZE  # number of possible occupancies.
+ARRAY_TYPECODE = "H"  # unsigned 16-bit integer; one square set per entry.
+
+TABLE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "attacks.bin")
+TABLE_MAGIC = b"1DAT"
+TABLE_VERSION = 1
+TABLE_HEADER = struct.Struct("<4sHHII")  # magic, version, entry size, count, CRC-32.
+TABLE_NIBBLES = 10  # nibbles 0 through 9 are stored.
+TABLE_BLOCK = BOARD_SIZE * NUM_OCCUPANCIES  # entries per nibble.
+
+# Piece nibbles; same as position.NIBBLE_*.
+NIBBLE_PAWN = 1
+NIBBLE_KNIGHT = 2
+NIBBLE_KING = 3
+NIBBLE_BISHOP = 5
+NIBBLE_ROOK = 6
+NIBBLE_QUEEN = 7
+NIBBLE_BLACK = 8
+
+ROOK_INCREMENTS = (-1, 1)
+BISHOP_INCREMENTS = (-2, 2)
+
+SQUARE_MASKS = [1 << (BOARD_SIZE - 1 - i) for i in range(BOARD_SIZE)]
+
+
+def index_valid(i):  # helper function to check valid index.
+    return 0 <= i < BOARD_SIZE
+
+
+def build_step_masks(increments):
+    """Build a square set for every square containing the squares reachable by a single
+    step of each of the given increments."""
+    return [
+        sum(SQUARE_MASKS[i + step] for step in increments if index_valid(i + step))
+        for i in range(BOARD_SIZE)
+    ]
+
+
+def get_ray_attacks(square, increment, occupancy):
+    """Return the square set attacked by traversing the board from a square via some
+    increment, stopping at the first occupied square. This is the slow calculation that
+    the slider tables store."""
+    attacked = 0
+    i = square + increment
+    while index_valid(i):
+        attacked |= SQUARE_MASKS[i]
+        if occupancy & SQUARE_MASKS[i]:  # if we've run into any piece, stop.
+            break
+        i += increment
+    return attacked
+
+
+def _build_ray_lookup(square, increment):
+    """Return (mask, lookup) for a single ray, where mask contains the squares along the
+    ray and lookup[occupancy & mask] is the square set attacked along the ray. Only
+    subsets of the mask are filled in."""
+    mask = get_ray_attacks(square, increment, 0)
+    lookup = [0] * NUM_OCCUPANCIES
+    subset = 0
+    while True:  # enumerate every subset of the mask (Carry-Rippler).
+        lookup[subset] = get_ray_attacks(square, increment, subset)
+        subset = (subset - mask) & mask
+        if subset == 0:
+            break
+    return mask, lookup
+
+
+def build_slider_table(increments):
+    """Build the flat slider table for a piece that slides along the given increments.
+    Rather than walking the rays for all 2^20 keys, each ray is only calculated for the
+    occupancies of the squares along it, and then the rays are combined."""
+    table = array(ARRAY_TYPECODE)
+    for square in range(BOARD_SIZE):
+        (mask_a, lookup_a), (mask_b, lookup_b) = (
+            _build_ray_lookup(square, increment) for increment in increments
+        )
+        table.extend(
+            lookup_a[occupancy & mask_a] | lookup_b[occupancy & mask_b]
+            for occupancy in range(NUM_OCCUPANCIES)
+        )
+    return table
+
+
+def build_attack_lookup(rook_attacks, bishop_attacks):
+    """Build the full attack lookup, in the same layout as attackLookup in the C++ code,
+    from the slider tables."""
+    step_masks = {
+        NIBBLE_PAWN: PAWN_WHITE_MASKS,
+        NIBBLE_KNIGHT: KNIGHT_MASKS,
+        NIBBLE_KING: KING_MASKS,
+        NIBBLE_PAWN | NIBBLE_BLACK: PAWN_BLACK_MASKS,
+    }
+    lookup = array(ARRAY_TYPECODE)
+    for nibble in range(TABLE_NIBBLES):
+        if nibble in step_masks:  # same attacks for every occupancy.
+            for mask in step_masks[nibble]:
+                lookup.extend(array(ARRAY_TYPECODE, [mask]) * NUM_OCCUPANCIES)
+        elif nibble == NIBBLE_BISHOP:
+            lookup.extend(bishop_attacks)
+        elif nibble == NIBBLE_ROOK:
+            lookup.extend(rook_attacks)
+        elif nibble == NIBBLE_QUEEN:
+            lookup.extend(r | b for r, b in zip(rook_attacks, bishop_attacks))
+        else:  # empty or unused nibble.
+            lookup.extend(array(ARRAY_TYPECODE, [0]) * TABLE_BLOCK)
+    return lookup
+
+
+def write_table_file(path=TABLE_FILE):
+    """Build the full attack lookup and write it to a binary table file."""
+    lookup = build_attack_lookup(
+        build_slider_table(ROOK_INCREMENTS), build_slider_table(BISHOP_INCREMENTS)
+    )
+    if sys.byteorder != "little":
+        lookup.byteswap()
+    header = TABLE_HEADER.pack(
+        TABLE_MAGIC, TABLE_VERSION, lookup.itemsize, len(lookup), zlib.crc32(lookup)
+    )
+    with open(path, "wb") as f:
+        f.write(header)
+        lookup.tofile(f)
+
+
+def load_table_file(path=TABLE_FILE, verify=True):
+    """Memory-map a binary table file and return the full attack lookup as a read-only
+    sequence of entries. Raises ValueError if the file is not a valid table file."""
+    with open(path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    magic, version, entry_size, num_entries, checksum = TABLE_HEADER.unpack_from(mapped)
+    if (magic, version, entry_size) != (TABLE_MAGIC, TABLE_VERSION, 2) or (
+        num_entries != TABLE_NIBBLES * TABLE_BLOCK
+        or len(mapped) != TABLE_HEADER.size + 2 * num_entries
+    ):
+        raise ValueError("{} is not a valid table file; regenerate it".format(path))
+    entries = memoryview(mapped)[TABLE_HEADER.size :]
+    if verify and zlib.crc32(entries) != checksum:
+        raise ValueError("{} failed its checksum; regenerate it".format(path))
+    if sys.byteorder != "little":  # can't use the mapped pages directly.
+        lookup = array(ARRAY_TYPECODE, entries.tobytes())
+        lookup.byteswap()
+        return lookup
+    return entries.cast(ARRAY_TYPECODE)
+
+
+KING_MASKS = build_step_masks([-1, 1])
+KNIGHT_MASKS = build_step_masks([-3, -2, 2, 3])
+PAWN_WHITE_MASKS = build_step_masks([1])  # white pawns attack to the right.
+PAWN_BLACK_MASKS = build_step_masks([-1])  # black pawns attack to the left.
+
+# Slider tables are slices of the table file if it exists, otherwise they are built. The
+# file isn't loaded when running this file directly, as it may be stale or corrupt.
+if os.path.exists(TABLE_FILE) and __name__ != "__main__":
+    ATTACK_LOOKUP = load_table_file(TABLE_FILE)
+    ROOK_ATTACKS = ATTACK_LOOKUP[NIBBLE_ROOK * TABLE_BLOCK : NIBBLE_QUEEN * TABLE_BLOCK]
+    BISHOP_ATTACKS = ATTACK_LOOKUP[
+        NIBBLE_BISHOP * TABLE_BLOCK : NIBBLE_ROOK * TABLE_BLOCK
+    ]
+else:
+    ATTACK_LOOKUP = None  # only available from the table file.
+    ROOK_ATTACKS = build_slider_table(ROOK_INCREMENTS)
+    BISHOP_ATTACKS = build_slider_table(BISHOP_INCREMENTS)
+
+
+if __name__ == "__main__":
+    write_table_file(TABLE_FILE)
+    print("Wrote", TABLE_FILE)
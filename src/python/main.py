@@ -1,108 +1,196 @@
+import concurrent.futures
 import evaluate
+import os
 import position as Position
+import random
 import statistics as stats
+import traceback
 from collections import Counter
 from timeit import default_timer as timer
 
 from ai_random import move as ai_random
 from ai_greedy import move as ai_greedy
+from ai_dfs import move as ai_dfs
 
-# Set up AI for each side.
+# Set up AI for each side. ai_dfs searches with a default player; to search with other
+# settings, use the move method of a Player from ai_dfs.py instead.
 AI_WHITE = ai_greedy
 AI_BLACK = ai_greedy
 
 
-def run_game(verbose=True, check_valid=False):
+def stop_pondering(ai):
+    """Stop an AI's background search, if it is the move method of a player that
+    ponders (see ai_dfs.py)."""
+    player = getattr(ai, "__self__", None)
+    if hasattr(player, "stop_pondering"):
+        player.stop_pondering()
+
+
+def run_game(
+    verbose=True,
+    check_valid=False,
+    seed=None,
+    ai_white=None,
+    ai_black=None,
+    position=Position.START_POSITION,
+):
     """Run a single game of chess. Optionally write each position out and enforce
-    checking if the move is valid."""
+    checking if the move is valid. If a seed is given, the random number generator used
+    by the AIs is seeded with it first, so that the game can be replayed exactly. The
+    AIs default to AI_WHITE and AI_BLACK, and the game to the starting position."""
+    if seed is not None:
+        random.seed(seed)
+    ai_white = AI_WHITE if ai_white is None else ai_white
+    ai_black = AI_BLACK if ai_black is None else ai_black
 
     def print_verbose(string):
         """Prints a string... if we want it to."""
         if verbose:
             print(string)
 
-    position = Position.START_POSITION  # initialize start position.
-    while True:
-        print_verbose(position)
-
-        # Get the computer to play a move.
-        active = position.split(" ")[1]
-        if active == "w":
-            move = AI_WHITE(position)
-        else:
-            move = AI_BLACK(position)
+    try:
+        while True:
+            print_verbose(position)
 
-        # Check if it is a valid move.
-        if check_valid:
-            moves = Position.get_current_moves(position)
-            if move in moves:  # valid move.
+            # Get the computer to play a move.
+            active = position.split(" ")[1]
+            if active == "w":
+                move = ai_white(position)
+            else:
+                move = ai_black(position)
+
+            # Check if it is a valid move.
+            if check_valid:
+                moves = Position.get_current_moves(position)
+                if move in moves:  # valid move.
+                    position = Position.apply_move(position, move)
+                else:  # not valid move and active player forfeits.
+                    state = (Position.opposite_color(active), "illegal move")
+                    break
+            else:
                 position = Position.apply_move(position, move)
-            else:  # not valid move and active player forfeits.
-                state = (Position.opposite_color(active), "illegal move")
-                break
-        else:
-            position = Position.apply_move(position, move)
 
-        # Check whether game is concluded or if it should keep going.
-        state = Position.check_position(position)
-        if state[0] is not None:  # only None when game is not complete.
-            print_verbose(position)
-            print_verbose(state)
-            break
+            # Check whether game is concluded or if it should keep going.
+            state = Position.check_position(position)
+            if state[0] is not None:  # only None when game is not complete.
+                print_verbose(position)
+                print_verbose(state)
+                break
+    finally:  # the game is over, so players shouldn't keep thinking about it.
+        for ai in (ai_white, ai_black):
+            stop_pondering(ai)
 
     game_length = int(position.split(" ")[3])  # length of a game in fullmoves.
     return state, game_length
 
 
-def run_games(num_games):
-    """Run multiple games of chess."""
+def _run_seeded_game(seed, check_valid=False, ai_white=None, ai_black=None):
+    """Run a single game with a seed, for run_games. Returns a tuple of (seed, state,
+    game_length), or (seed, None, traceback) if the game raised an exception."""
+    try:
+        state, game_length = run_game(
+            verbose=False,
+            check_valid=check_valid,
+            seed=seed,
+            ai_white=ai_white,
+            ai_black=ai_black,
+        )
+        return seed, state, game_length
+    except Exception:
+        return seed, None, traceback.format_exc()
+
+
+def run_games(
+    num_games,
+    workers=None,
+    base_seed=0,
+    check_valid=False,
+    ai_white=None,
+    ai_black=None,
+):
+    """Run multiple games of chess, spread over a pool of worker processes. Game n is
+    seeded with base_seed + n, so any game can be replayed with run_game(seed=...).
+    Results are printed as games finish, which may be out of order. A game that raises
+    an exception is reported with its seed, and the rest of the games still run. With
+    workers=1 the games are run in this process. Returns a tuple of (match record
+    counter, list of game lengths, dict of seed to traceback for games that failed).
+
+    The AIs default to AI_WHITE and AI_BLACK as they are when this is called, and are
+    passed to the worker processes rather than looked up there (where changes to the
+    globals may not be seen, e.g. when processes are spawned), so they must be
+    picklable: module-level functions are."""
+    if workers is None:
+        workers = os.cpu_count() or 1
+    ai_white = AI_WHITE if ai_white is None else ai_white
+    ai_black = AI_BLACK if ai_black is None else ai_black
 
     def print_games_info(
-        c, elapsed, game_lengths
+        c, elapsed, game_lengths, errors
     ):  # helper function to print game information.
         print("Match record:", "-".join(str(i) for i in [c["w"], c["b"], c["d"]]))
+        num_run = len(game_lengths) + len(errors)
         print(
-            "Elapsed: {}s ({}s/game)".format(
-                round(elapsed, 2), round(elapsed / num_games, 3)
+            "Elapsed: {}s ({}s/game, {:.1f} games/s)".format(
+                round(elapsed, 2),
+                round(elapsed / max(num_run, 1), 3),
+                num_run / elapsed if elapsed else 0.0,
             )
         )
-        print("Game length information (in fullmoves):")
-        print(
-            "min: {}, max: {}, mean: {:.2f}, stdev: {:.2f}, median: {}".format(
-                min(game_lengths),
-                max(game_lengths),
-                stats.mean(game_lengths),
-                stats.stdev(game_lengths),
-                stats.median(game_lengths),
+        if game_lengths:
+            print("Game length information (in fullmoves):")
+            print(
+                "min: {}, max: {}, mean: {:.2f}, stdev: {:.2f}, median: {}".format(
+                    min(game_lengths),
+                    max(game_lengths),
+                    stats.mean(game_lengths),
+                    stats.stdev(game_lengths) if len(game_lengths) > 1 else 0.0,
+                    stats.median(game_lengths),
+                )
             )
-        )
-
-    try:
-        start = timer()
-        c = Counter()
-        game_lengths = []
-        for n in range(num_games):
-            state, game_length = run_game(verbose=False)
+        if errors:
+            print("Failed games (replay with run_game(seed=...)):")
+            for seed in sorted(errors):
+                print("seed {}: {}".format(seed, errors[seed].strip().splitlines()[-1]))
+
+    start = timer()
+    c = Counter()
+    game_lengths = []
+    errors = {}
+    seeds = [base_seed + n for n in range(num_games)]
+
+    def record(seed, state, game_length):
+        """Add the result of a single game to the totals."""
+        if state is None:
+            errors[seed] = game_length  # the traceback.
+            print(seed - base_seed, "error (seed {})".format(seed))
+        else:
             c[state[0]] += 1
             game_lengths.append(game_length)
-            print(n, state, game_length)
-        end = timer()
-        elapsed = end - start  # elapsed time to run all games.
-        print_games_info(c, elapsed, game_lengths)
-
-    except Exception as e:
-        # In case there's an exception, try to salvage the run data.
-        print(e)
-        print(c)
-        print_games_info(c, elapsed, game_lengths)
-
-
-# run_games(10000)
-evaluate.test_score_position("K....n.........k b 0 1")
-# evaluate.test_score_position("K.....nbP......k w 0 1")
-# evaluate.test_score_position("KQRB..NP.p.nbrqk b 0 1")
-# evaluate.test_score_position(Position.START_POSITION)
-# evaluate.test_next_moves("K....n.........k b 0 1")
-# evaluate.test_next_moves("K.....nbP......k w 0 1")
-# evaluate.test_next_moves("KQRB..NP.p.nbrqk b 0 1")
-# evaluate.test_next_moves(Position.START_POSITION)
+            print(seed - base_seed, state, game_length)
+
+    if workers <= 1:
+        for seed in seeds:
+            record(*_run_seeded_game(seed, check_valid, ai_white, ai_black))
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(_run_seeded_game, seed, check_valid, ai_white, ai_black)
+                for seed in seeds
+            ]
+            for future in concurrent.futures.as_completed(futures):
+                record(*future.result())
+    elapsed = timer() - start  # elapsed time to run all games.
+    print_games_info(c, elapsed, game_lengths, errors)
+    return c, game_lengths, errors
+
+
+if __name__ == "__main__":
+    # run_games(10000)
+    evaluate.test_score_position("K....n.........k b 0 1")
+    # evaluate.test_score_position("K.....nbP......k w 0 1")
+    # evaluate.test_score_position("KQRB..NP.p.nbrqk b 0 1")
+    # evaluate.test_score_position(Position.START_POSITION)
+    # evaluate.test_next_moves("K....n.........k b 0 1")
+    # evaluate.test_next_moves("K.....nbP......k w 0 1")
+    # evaluate.test_next_moves("KQRB..NP.p.nbrqk b 0 1")
+    # evaluate.test_next_moves(Position.START_POSITION)
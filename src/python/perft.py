@@ -0,0 +1,187 @@
+# Perft: count the leaf nodes of the game tree to a fixed depth.
+#
+# Perft ("performance test") walks every sequence of legal moves from a position down to
+# a given depth and counts them. The counts only depend on the rules, so comparing them
+# against stored reference counts catches move generation bugs, and timing them measures
+# move generation speed. Both move generators are tested: the string functions in
+# position.py ("string") and the integer board functions ("bits").
+#
+# Like perft in regular chess, the game is not ended by the 50-move rule, the fullmove
+# limit, insufficient material or repetition; only positions without legal moves are
+# leaves before the full depth. Perft counts paths rather than positions, so for the
+# starting position the number of unique positions at each depth is also checked
+# against explore (see all_positions.py).
+#
+# Run this file to run the benchmark suite, optionally with a maximum depth, or with a
+# position and depth to print a divide (the count below each root move).
+
+import all_positions as AllPositions
+import position as Position
+import sys
+from timeit import default_timer as timer
+
+# Positions with their reference counts at depths 1, 2, 3, and so on.
+PERFT_TESTS = [
+    ("start", Position.START_POSITION, [4, 16, 63, 228, 1158, 5925]),
+    ("pawn double step", "K...NP....pn...k w 0 1", [7, 49, 245, 1195, 6146, 30710]),
+    ("pins", "K.R..r....q....k w 0 1", [2, 33, 121, 1653, 7843, 96793]),
+    ("bishops", "K.B.R...n.r.b..k b 0 1", [7, 39, 329, 2598, 22195, 170868]),
+    ("in check", "..K.n..B..k..... w 0 1", [1, 4, 9, 28, 85, 301]),
+    ("queens", "KQR..P.b.pn.r.qk b 0 1", [7, 29, 237, 1309, 10746, 67871]),
+    ("blocked pawns", "K.....P.p......k w 0 1", [2, 4, 9, 21, 50, 117]),
+]
+
+# Number of unique positions after each halfmove from the starting position.
+EXPLORE_COUNTS = [4, 16, 51, 158, 667, 2613]
+
+GENERATORS = ["bits", "string"]
+
+
+def perft_bits(bits, active, depth):
+    """Count the leaf nodes to a depth from an integer board."""
+    moves = Position.get_moves_bits(bits, active)
+    if depth == 1:
+        return len(moves)
+    opponent = Position.opposite_color(active)
+    return sum(
+        perft_bits(Position.apply_move_bits(bits, move), opponent, depth - 1)
+        for move in moves
+    )
+
+
+def perft_string(board, active, depth):
+    """Count the leaf nodes to a depth from a board string."""
+    moves = Position.get_moves(board, active)
+    if depth == 1:
+        return len(moves)
+    opponent = Position.opposite_color(active)
+    return sum(
+        perft_string(Position.apply_move_board(board, move), opponent, depth - 1)
+        for move in moves
+    )
+
+
+def perft(position, depth, generator="bits"):
+    """Count the leaf nodes to a depth from a position, using the given generator."""
+    board, active, _, _ = position.split(" ")
+    if depth == 0:
+        return 1
+    if generator == "bits":
+        return perft_bits(Position.board_to_bits(board), active, depth)
+    return perft_string(board, active, depth)
+
+
+def divide(position, depth, generator="bits"):
+    """Return a dict of each root move to the number of leaf nodes below it."""
+    return {
+        move: perft(Position.apply_move(position, move), depth - 1, generator)
+        for move in Position.get_current_moves(position)
+    }
+
+
+def count_unique(position, depth):
+    """Return the number of unique positions (board and player to move) after each
+    halfmove up to a depth, for comparing against explore."""
+    bits, active, _, _ = Position.position_to_vars(position)
+    boards = {bits}
+    counts = []
+    for _ in range(depth):
+        boards = {
+            Position.apply_move_bits(bits, move)
+            for bits in boards
+            for move in Position.get_moves_bits(bits, active)
+        }
+        active = Position.opposite_color(active)
+        counts.append(len(boards))
+    return counts
+
+
+def run_suite(max_depth=None, generators=GENERATORS, verbose=True):
+    """Run perft on every test position to its deepest reference count (or max_depth),
+    with each generator, and check the counts. Returns a list of dicts of results, one
+    per position, generator and depth, with the nodes per second."""
+    results = []
+    for name, position, expected in PERFT_TESTS:
+        for generator in generators:
+            for depth, expected_nodes in enumerate(expected, 1):
+                if max_depth is not None and depth > max_depth:
+                    break
+                start = timer()
+                nodes = perft(position, depth, generator)
+                seconds = timer() - start
+                result = {
+                    "name": name,
+                    "generator": generator,
+                    "depth": depth,
+                    "nodes": nodes,
+                    "expected": expected_nodes,
+                    "passed": nodes == expected_nodes,
+                    "seconds": seconds,
+                    "nodes_per_second": nodes / seconds if seconds else float("inf"),
+                }
+                results.append(result)
+                if verbose:
+                    print(
+                        "{:<16} {:<6} depth {}: {:>8} nodes {} "
+                        "{:.3f}s ({:,.0f} nodes/s)".format(
+                            name,
+                            generator,
+                            depth,
+                            nodes,
+                            (
+                                "ok"
+                                if result["passed"]
+                                else "FAIL ({})".format(expected_nodes)
+                            ),
+                            seconds,
+                            result["nodes_per_second"],
+                        )
+                    )
+
+    # Cross-check the unique positions against explore.
+    depth = len(EXPLORE_COUNTS)
+    if max_depth is not None:
+        depth = min(depth, max_depth)
+    unique_counts = count_unique(Position.START_POSITION, depth)
+    explore_counts = AllPositions.explore_packed(depth, vectorized=False, verbose=False)
+    passed = unique_counts == EXPLORE_COUNTS[:depth] == explore_counts
+    results.append(
+        {"name": "unique positions", "counts": unique_counts, "passed": passed}
+    )
+
+    if verbose:
+        print(
+            "unique positions from start: {} {}".format(
+                unique_counts, "ok" if passed else "FAIL ({})".format(explore_counts)
+            )
+        )
+        for generator in generators:
+            timed = [r for r in results if r.get("generator") == generator]
+            nodes = sum(r["nodes"] for r in timed)
+            seconds = sum(r["seconds"] for r in timed)
+            print(
+                "{}: {} nodes in {:.2f}s ({:,.0f} nodes/s)".format(
+                    generator, nodes, seconds, nodes / seconds if seconds else 0
+                )
+            )
+        failed = [r for r in results if not r["passed"]]
+        print("{} failed".format(len(failed)) if failed else "All passed.")
+    return results
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3:  # position and depth: print a divide.
+        position, depth = sys.argv[1], int(sys.argv[2])
+        start = timer()
+        counts = divide(position, depth)
+        seconds = timer() - start
+        for move, nodes in counts.items():
+            print("{}: {}".format(move, nodes))
+        total = sum(counts.values())
+        print(
+            "total: {} nodes in {:.3f}s ({:,.0f} nodes/s)".format(
+                total, seconds, total / seconds if seconds else 0
+            )
+        )
+    else:
+        run_suite(int(sys.argv[1]) if len(sys.argv) == 2 else None)
@@ -27,6 +27,9 @@
 # 0-indexed, so squares are 0 through 13 inclusive. There is no special notation for a
 # capture.
 
+import lookup_tables as LookupTables
+import random
+
 BOARD_SIZE = 16  # number of squares on the board.
 START_POSITION = "KQRBNP....pnbrqk w 0 1"
 
@@ -89,21 +92,30 @@ def check_position(position):
     Unlike the official rules of chess, the 50-move rule is automatically enforced as a
     draw. The game is also a draw at 150 fullmoves.
 
-    Threefold repetition cannot be tested within a single position."""
+    Threefold repetition cannot be tested within a single position.
+
+    The cheap tests come first, so that moves are only generated when needed. A draw by
+    the 50-move rule or insufficient material is only overridden by checkmate, so it is
+    returned straight away if the player isn't in check (including when it is also
+    stalemate). Otherwise the search for moves stops at the first legal one."""
     board, active, halfmove, fullmove = position.split(" ")
-    moves = get_moves(board, active)
     if int(fullmove) >= 150:
         return ("d", "150+ fullmove rule")
-    if len(moves) == 0:  # no valid moves.
-        if is_in_check(board, active):  # see whether this is checkmate or stalemate.
+    draw = None
+    if int(halfmove) >= 100:
+        draw = ("d", "50-move rule")
+    elif get_pieces(position) in INSUFFICIENT_MATERIAL_SETS:
+        draw = ("d", "insufficient material")
+    in_check = is_in_check(board, active)
+    if draw is not None and not in_check:
+        return draw
+    if not has_legal_move(board, active):  # no valid moves.
+        if in_check:  # see whether this is checkmate or stalemate.
             return (opposite_color(active), "checkmate")
         else:
             return ("d", "stalemate")
-    if int(halfmove) >= 100:
-        return ("d", "50-move rule")
-    pieces = get_pieces(position)
-    if pieces in INSUFFICIENT_MATERIAL_SETS:
-        return ("d", "insufficient material")
+    if draw is not None:
+        return draw
     return (None, None)
 
 
@@ -149,90 +161,246 @@ def get_attacked_squares(board, player):
     return attacked_squares
 
 
+def is_square_attacked(board, square, player):
+    """Return true if the given square is attacked by the given player. Rather than
+    generating every attack of the player, this looks outwards from the square for
+    pieces that could be attacking it."""
+    white = player == "w"
+    knight, king, pawn = ("N", "K", "P") if white else ("n", "k", "p")
+    for i in [square - 3, square - 2, square + 2, square + 3]:
+        if index_valid(i) and board[i] == knight:
+            return True
+    for i in [square - 1, square + 1]:
+        if index_valid(i) and board[i] == king:
+            return True
+    i = square - 1 if white else square + 1  # pawns attack towards the opponent.
+    if index_valid(i) and board[i] == pawn:
+        return True
+    for increment, sliders in [(-1, "RQ"), (1, "RQ"), (-2, "BQ"), (2, "BQ")]:
+        i = square + increment
+        while index_valid(i):
+            if board[i] != NOTATION_EMPTY:  # only the first piece can attack.
+                if board[i].upper() in sliders and board[i].isupper() == white:
+                    return True
+                break
+            i += increment
+    return False
+
+
 def is_in_check(board, player):
     """Return true if the given player is in check in the given board. Assumes that
     the position is valid."""
     king_position = board.find("K" if player == "w" else "k")
-    attacked_squares = get_attacked_squares(board, ("b" if player == "w" else "w"))
-    return king_position in attacked_squares
+    if king_position == -1:
+        return False
+    return is_square_attacked(board, king_position, opposite_color(player))
 
 
-def get_moves(board, player):
-    """Get a list of tuples representing all legal moves by the given player."""
-    opponent_attacked_squares = get_attacked_squares(
-        board, opposite_color(player)
-    )  # get squares the opponent is attacking.
-    player = player == "w"  # for boolean convenience, True if considering white.
+def get_piece_moves(board, i):
+    """Get a list of tuples representing all moves by the piece on square i, without
+    checking whether they leave its king in check (including king moves onto attacked
+    squares)."""
+    square = board[i]
+    player = square.isupper()  # for boolean convenience, True if a white piece.
     moves = []  # set of possible moves.
+
+    def is_not_same_color(test_i):
+        """Helper function that returns true if the piece at index test_i is a different
+        color than the piece moving, or if test_i is empty."""
+        return board[test_i].isupper() != player or board[test_i] == NOTATION_EMPTY
+
+    def traverse(increment):
+        """Helper function to traverse the board via some increment and add potential
+        moves."""
+        test_i = i
+        while True:
+            test_i += increment
+            if not index_valid(test_i):
+                break
+            elif (
+                board[test_i].upper() in NOTATION_PIECES
+            ):  # check whether we can capture piece, stop in any case.
+                if is_not_same_color(test_i):  # different color piece.
+                    moves.append((i, test_i))  # we can capture it.
+                break
+            else:  # otherwise this is a valid move.
+                moves.append((i, test_i))
+
+    if square.upper() == "K":
+        for test_i in [i - 1, i + 1]:
+            if index_valid(test_i) and is_not_same_color(test_i):
+                moves.append((i, test_i))
+    if square.upper() == "R" or square.upper() == "Q":
+        traverse(-1)
+        traverse(1)
+    if square.upper() == "B" or square.upper() == "Q":
+        traverse(-2)
+        traverse(2)
+    if square.upper() == "N":
+        for test_i in [i - 3, i - 2, i + 2, i + 3]:
+            if index_valid(test_i) and is_not_same_color(test_i):
+                moves.append((i, test_i))
+    if square.upper() == "P":
+        pawn_start = PAWN_START_WHITE if player else PAWN_START_BLACK
+        increment = 1 if player else -1
+        if index_valid(i + increment) and is_not_same_color(i + increment):
+            moves.append((i, i + increment))
+        if i == pawn_start:  # check if the pawn can move two spaces.
+            if (
+                board[i + increment] == NOTATION_EMPTY
+                and board[i + increment * 2] == NOTATION_EMPTY
+                and index_valid(i + increment * 2)
+            ):
+                moves.append((i, i + increment * 2))
+
+    if square.upper() == "Q":
+        moves = list(
+            dict.fromkeys(moves)
+        )  # queens can reach the same square along a rook and a bishop ray; keep one.
+    return moves
+
+
+def get_pseudo_legal_moves(board, player):
+    """Get a list of tuples representing all moves by the given player, without checking
+    whether they leave the player's king in check (including king moves onto attacked
+    squares)."""
+    player = player == "w"  # for boolean convenience, True if considering white.
+    moves = []
     for i, square in enumerate(board):
         if square.upper() in NOTATION_PIECES and (square.isupper() == player):
+            moves.extend(get_piece_moves(board, i))
+    return moves
 
-            def is_not_same_color(test_i):
-                """Helper function that returns true if the piece at index test_i is a
-                different color than the player to move, or if test_i is empty."""
-                return (
-                    board[test_i].isupper() != player or board[test_i] == NOTATION_EMPTY
-                )
-
-            def traverse(increment):
-                """Helper function to traverse the board via some increment and add
-                potential moves."""
-                test_i = i
-                while True:
-                    test_i += increment
-                    if not index_valid(test_i):
-                        break
-                    elif (
-                        board[test_i].upper() in NOTATION_PIECES
-                    ):  # check whether we can capture piece, stop in any case.
-                        if is_not_same_color(test_i):  # different color piece.
-                            moves.append((i, test_i))  # we can capture it.
-                        break
-                    else:  # otherwise this is a valid move.
-                        moves.append((i, test_i))
 
-            if square.upper() == "K":
-                for test_i in [i - 1, i + 1]:
-                    if (
-                        index_valid(test_i)
-                        and test_i not in opponent_attacked_squares
-                        and is_not_same_color(test_i)
-                    ):  # king can't move into check.
-                        moves.append((i, test_i))
-            if square.upper() == "R" or square.upper() == "Q":
-                traverse(-1)
-                traverse(1)
-            if square.upper() == "B" or square.upper() == "Q":
-                traverse(-2)
-                traverse(2)
-            if square.upper() == "N":
-                for test_i in [i - 3, i - 2, i + 2, i + 3]:
-                    if index_valid(test_i) and is_not_same_color(test_i):
-                        moves.append((i, test_i))
-            if square.upper() == "P":
-                pawn_start = PAWN_START_WHITE if player else PAWN_START_BLACK
-                increment = 1 if player else -1
-                if index_valid(i + increment) and is_not_same_color(i + increment):
-                    moves.append((i, i + increment))
-                if i == pawn_start:  # check if the pawn can move two spaces.
-                    if (
-                        board[i + increment] == NOTATION_EMPTY
-                        and board[i + increment * 2] == NOTATION_EMPTY
-                        and index_valid(i + increment * 2)
-                    ):
-                        moves.append((i, i + increment * 2))
-
-    moves = [
-        move for move in moves if index_valid(move[1])
-    ]  # trim moves outside board bounds.
-    moves = [
-        move
-        for move in moves
-        if not is_in_check(apply_move_board(board, move), "w" if player else "b")
-    ]  # eliminate moves that result in check.
+def get_checks_and_pins(board, player):
+    """Find the pieces checking the given player's king, and the player's pieces pinned
+    to it. Returns a tuple of (checks, pins), where checks is a list with a set for each
+    checking piece of the squares that a move other than a king move must end on to
+    answer it (the checker's square, plus the squares in between for a sliding piece),
+    and pins is a dict of each pinned piece's square to the set of squares it can move
+    to without exposing the king.
+
+    Only pieces on the king's rays can be pinned: the rook rays (every square to either
+    side) and the bishop rays (every other square to either side). A piece is pinned if
+    it is the only piece between the king and an opponent piece that slides along that
+    ray, and it has to stay between them or capture the pinning piece. A queen can check
+    or pin along a rook ray and a bishop ray at once, so the squares for each ray are
+    intersected."""
+    king = board.find("K" if player == "w" else "k")
+    white = player == "w"
+    checks = {}  # square of each checking piece to the squares that answer it.
+    pins = {}
+    if king == -1:  # no king to put in check.
+        return [], pins
+
+    # Walk outwards from the king along each ray, until running into an opponent piece.
+    for increment, sliders in [(-1, "RQ"), (1, "RQ"), (-2, "BQ"), (2, "BQ")]:
+        between = set()  # squares between the king and the current square.
+        blocker = None  # the player's own piece on the ray, if any.
+        i = king + increment
+        while index_valid(i):
+            square = board[i]
+            if square != NOTATION_EMPTY and square.isupper() != white:
+                if square.upper() in sliders:  # opponent piece attacking along the ray.
+                    rays = checks if blocker is None else pins
+                    key = i if blocker is None else blocker
+                    rays[key] = rays.get(key, between | {i}) & (between | {i})
+                break
+            elif square != NOTATION_EMPTY:
+                if blocker is not None:  # two of the player's pieces; no pin.
+                    break
+                blocker = i
+            between.add(i)
+            i += increment
+
+    # Pieces that attack the king directly.
+    opponent_pieces = ["n", "p", "k"] if white else ["N", "P", "K"]
+    pawn = king + 1 if white else king - 1  # pawns attack towards the opponent.
+    for i in [king - 3, king - 2, king + 2, king + 3]:
+        if index_valid(i) and board[i] == opponent_pieces[0]:
+            checks[i] = {i}
+    if index_valid(pawn) and board[pawn] == opponent_pieces[1]:
+        checks[pawn] = {pawn}
+    for i in [king - 1, king + 1]:
+        if index_valid(i) and board[i] == opponent_pieces[2]:
+            checks[i] = {i}
+    return list(checks.values()), pins
+
+
+def get_moves(board, player, verify=False):
+    """Get a list of tuples representing all legal moves by the given player.
+
+    Checks and pins are found once up front (see get_checks_and_pins), so that each
+    move can be tested against them directly. King moves are tested against the squares
+    the opponent attacks with the king taken off the board, so that the king can't step
+    away from a sliding piece along its ray. If verify is true, each move is instead
+    applied and tested for check, which is much slower; this is for testing."""
+    moves = get_pseudo_legal_moves(board, player)
+    if verify:
+        return [
+            move
+            for move in moves
+            if not is_in_check(apply_move_board(board, move), player)
+        ]  # eliminate moves that result in check.
+
+    king = board.find("K" if player == "w" else "k")
+    if king == -1:  # no king to put in check.
+        return moves
+    checks, pins = get_checks_and_pins(board, player)
+    if checks or pins:
+        # Unlike in regular chess, a double check can be answered without moving the
+        # king, by blocking both rays on a single square.
+        answers = set.intersection(*checks) if checks else None
+        moves = [
+            move
+            for move in moves
+            if move[0] == king
+            or (
+                (answers is None or move[1] in answers)
+                and (move[0] not in pins or move[1] in pins[move[0]])
+            )
+        ]
+    if any(move[0] == king for move in moves):
+        opponent_attacked_squares = get_attacked_squares(
+            board[:king] + NOTATION_EMPTY + board[king + 1 :], opposite_color(player)
+        )  # the king can't move into check.
+        moves = [
+            move
+            for move in moves
+            if move[0] != king or move[1] not in opponent_attacked_squares
+        ]
     return moves
 
 
+def has_legal_move(board, player):
+    """Return true if the given player has a legal move. Returns as soon as one is found,
+    trying king moves first and then the other pieces from the cheapest to generate
+    moves for; there is at most one of each piece, since promotion is impossible."""
+    white = player == "w"
+    king = board.find("K" if white else "k")
+    if king != -1:
+        without_king = board[:king] + NOTATION_EMPTY + board[king + 1 :]
+        for end in [king - 1, king + 1]:
+            if (
+                index_valid(end)
+                and (board[end] == NOTATION_EMPTY or board[end].isupper() != white)
+                and not is_square_attacked(without_king, end, opposite_color(player))
+            ):  # the king can't move into check, including along a ray it's leaving.
+                return True
+    checks, pins = get_checks_and_pins(board, player)
+    answers = set.intersection(*checks) if checks else None
+    for piece in ["P", "N", "B", "R", "Q"]:
+        start = board.find(piece if white else piece.lower())
+        if start == -1:
+            continue
+        for _, end in get_piece_moves(board, start):
+            if (answers is None or end in answers) and (
+                start not in pins or end in pins[start]
+            ):
+                return True
+    return False
+
+
 def get_current_moves(position):
     """Get a list of tuples representing all legal moves by the current player."""
     board, active, halfmove, fullmove = position.split(" ")
@@ -284,3 +452,482 @@ def playback_moves(position, moves):
     for move in moves:
         position = apply_move(position, move)
         print(position, "after", move)
+
+
+# Mirrored positions.
+#
+# The board has an exact symmetry: reversing the squares and swapping the colors of the
+# pieces and of the player to move gives an equivalent position, with every move
+# mirrored and the result the same for the other player. The pawn start squares (5 and
+# 10) mirror into each other, so pawns can still move two squares in the same cases.
+# Anything that stores results by board can store only one of each pair: the
+# "canonical" one, which has white to move, and mirror lookups with black to move.
+#
+# The clocks are left as they are. The halfmove clock is unaffected, but the fullmove
+# number goes up after black's move, so a mirrored position can be one ply closer to
+# the fullmove limit; only results that don't depend on the clocks are exactly equal.
+
+
+def mirror_board(board):
+    """Return the mirror of a board: squares reversed, and piece colors swapped."""
+    return board[::-1].swapcase()
+
+
+def mirror_move(move):
+    """Return the mirror of a (start, end) move."""
+    return (BOARD_SIZE - 1 - move[0], BOARD_SIZE - 1 - move[1])
+
+
+def mirror_position(position):
+    """Return the mirror of a position, with the other player to move and the same
+    clocks."""
+    board, active, halfmove, fullmove = position.split(" ")
+    return " ".join((mirror_board(board), opposite_color(active), halfmove, fullmove))
+
+
+def canonicalize(board, active):
+    """Return a tuple of (board, active, mirrored), where board and active are the
+    canonical one of a board and its mirror (the one with white to move), and mirrored
+    is true if that is the mirror."""
+    if active == "b":
+        return mirror_board(board), "w", True
+    return board, active, False
+
+
+# Integer-packed boards.
+#
+# For speed, a board can also be represented as a single 64-bit integer where each
+# nibble is one square, with square 0 in the most significant nibble. This is the same
+# encoding that the C++ code uses (see position.h), so boards can be passed between the
+# two freely. Pieces are encoded as follows:
+#
+# C    color
+#  M   multiple moves (can move multiple squares at a time)
+#   R  rook moves (can move like rook)
+#    B bishop moves (can move like bishop)
+# ---- ----
+# 0000 empty
+# 0001 pawn (white)
+# 0010 knight (white)
+# 0011 king (white)
+# 0101 bishop (white)
+# 0110 rook (white)
+# 0111 queen (white)
+# 1xxx same as above, but black.
+#
+# Sets of squares (occupancy, attacked squares) are represented as 16-bit integers where
+# square i is bit BOARD_SIZE - 1 - i, again matching the C++ code. Moves are still
+# (start, end) tuples and the active color is still "w" or "b", so these functions can
+# be mixed freely with the string-based functions above. The four fields of a record
+# are called "vars" here (after fenceToVars in the C++ code): a tuple of (bits, active,
+# halfmove, fullmove).
+
+START_BOARD = 3991632928627678971  # START_POSITION's board as an integer.
+
+NIBBLE_BITMASK = 15  # bitmask to get the last nibble.
+NIBBLE_EMPTY = 0
+NIBBLE_PAWN = 1
+NIBBLE_KNIGHT = 2
+NIBBLE_KING = 3
+NIBBLE_BISHOP = 5
+NIBBLE_ROOK = 6
+NIBBLE_QUEEN = 7
+NIBBLE_BLACK = 8  # color flag; OR with a piece nibble to get the black piece.
+
+PIECE_TO_NIBBLE = {
+    ".": NIBBLE_EMPTY,
+    "P": NIBBLE_PAWN,
+    "N": NIBBLE_KNIGHT,
+    "K": NIBBLE_KING,
+    "B": NIBBLE_BISHOP,
+    "R": NIBBLE_ROOK,
+    "Q": NIBBLE_QUEEN,
+    "p": NIBBLE_PAWN | NIBBLE_BLACK,
+    "n": NIBBLE_KNIGHT | NIBBLE_BLACK,
+    "k": NIBBLE_KING | NIBBLE_BLACK,
+    "b": NIBBLE_BISHOP | NIBBLE_BLACK,
+    "r": NIBBLE_ROOK | NIBBLE_BLACK,
+    "q": NIBBLE_QUEEN | NIBBLE_BLACK,
+}
+NIBBLE_TO_PIECE = {nibble: piece for piece, nibble in PIECE_TO_NIBBLE.items()}
+
+FULL_SQUARES = (1 << BOARD_SIZE) - 1  # square set containing every square.
+SQUARE_MASKS = [1 << (BOARD_SIZE - 1 - i) for i in range(BOARD_SIZE)]
+NIBBLE_SHIFTS = [4 * (BOARD_SIZE - 1 - i) for i in range(BOARD_SIZE)]
+NIBBLE_CLEARS = [
+    ~(NIBBLE_BITMASK << shift) & ((1 << (4 * BOARD_SIZE)) - 1)
+    for shift in NIBBLE_SHIFTS
+]  # bitmasks to blank a single square.
+LOW_NIBBLE_BITS = int("1" * BOARD_SIZE, 16)  # lowest bit of every nibble set.
+
+
+def _build_nibble_flag_lookup():
+    """Build a lookup to compress four nibble flags (bits 0, 4, 8, 12) into four
+    adjacent bits."""
+    lookup = [0] * 0x1112
+    for i in range(16):
+        lookup[(i & 1) | (i & 2) << 3 | (i & 4) << 6 | (i & 8) << 9] = i
+    return lookup
+
+
+_NIBBLE_FLAGS_TO_SQUARES = _build_nibble_flag_lookup()
+
+
+def _compress_nibble_flags(flags):
+    """Compress an integer with flags only in the lowest bit of each nibble into a
+    square set."""
+    return (
+        _NIBBLE_FLAGS_TO_SQUARES[flags & 0xFFFF]
+        | _NIBBLE_FLAGS_TO_SQUARES[(flags >> 16) & 0xFFFF] << 4
+        | _NIBBLE_FLAGS_TO_SQUARES[(flags >> 32) & 0xFFFF] << 8
+        | _NIBBLE_FLAGS_TO_SQUARES[flags >> 48] << 12
+    )
+
+
+def squares_from_mask(mask):
+    """Return a list of squares (in ascending order) contained in a square set."""
+    squares = []
+    while mask:
+        top = mask.bit_length()
+        squares.append(BOARD_SIZE - top)
+        mask ^= 1 << (top - 1)
+    return squares
+
+
+def mask_from_squares(squares):
+    """Return a square set containing the given squares."""
+    mask = 0
+    for square in squares:
+        mask |= SQUARE_MASKS[square]
+    return mask
+
+
+# Attack tables; see lookup_tables.py.
+KING_MASKS = LookupTables.KING_MASKS
+KNIGHT_MASKS = LookupTables.KNIGHT_MASKS
+PAWN_WHITE_MASKS = LookupTables.PAWN_WHITE_MASKS
+PAWN_BLACK_MASKS = LookupTables.PAWN_BLACK_MASKS
+ROOK_ATTACKS = LookupTables.ROOK_ATTACKS
+BISHOP_ATTACKS = LookupTables.BISHOP_ATTACKS
+KING_SQUARES = [squares_from_mask(mask) for mask in KING_MASKS]
+KNIGHT_SQUARES = [squares_from_mask(mask) for mask in KNIGHT_MASKS]
+
+
+def board_to_bits(board):
+    """Convert a board string into its integer representation."""
+    bits = 0
+    for square in board:
+        bits = (bits << 4) | PIECE_TO_NIBBLE[square]
+    return bits
+
+
+def bits_to_board(bits):
+    """Convert an integer board into its string representation."""
+    return "".join(
+        NIBBLE_TO_PIECE[(bits >> shift) & NIBBLE_BITMASK] for shift in NIBBLE_SHIFTS
+    )
+
+
+def position_to_vars(position):
+    """Unpack a position into a tuple of (bits, active, halfmove, fullmove)."""
+    board, active, halfmove, fullmove = position.split(" ")
+    return board_to_bits(board), active, int(halfmove), int(fullmove)
+
+
+def vars_to_position(bits, active, halfmove, fullmove):
+    """Pack (bits, active, halfmove, fullmove) back into a position. The inverse of
+    position_to_vars."""
+    return " ".join((bits_to_board(bits), active, str(halfmove), str(fullmove)))
+
+
+def get_nibble(bits, square):
+    """Return the nibble at the given square of an integer board."""
+    return (bits >> NIBBLE_SHIFTS[square]) & NIBBLE_BITMASK
+
+
+def get_occupancy_bits(bits):
+    """Return the square set of all occupied squares."""
+    flags = bits | (bits >> 1) | (bits >> 2) | (bits >> 3)
+    return _compress_nibble_flags(flags & LOW_NIBBLE_BITS)
+
+
+def get_player_occupancy_bits(bits, player):
+    """Return the square set of all squares occupied by the given player."""
+    black = _compress_nibble_flags((bits >> 3) & LOW_NIBBLE_BITS)
+    if player == "b":
+        return black
+    return get_occupancy_bits(bits) & ~black
+
+
+def find_nibble_bits(bits, nibble):
+    """Return the square set of all squares containing the given nibble."""
+    bits ^= nibble * LOW_NIBBLE_BITS  # matching squares become zero.
+    flags = bits | (bits >> 1) | (bits >> 2) | (bits >> 3)
+    return _compress_nibble_flags(~flags & LOW_NIBBLE_BITS)
+
+
+def get_piece_attacks_bits(nibble, square, occupancy):
+    """Return the square set attacked by the piece with the given nibble on the given
+    square. Includes squares occupied by pieces belonging to both players."""
+    piece = nibble & 7
+    if piece == NIBBLE_PAWN:
+        return (PAWN_BLACK_MASKS if nibble & NIBBLE_BLACK else PAWN_WHITE_MASKS)[square]
+    elif piece == NIBBLE_KNIGHT:
+        return KNIGHT_MASKS[square]
+    elif piece == NIBBLE_KING:
+        return KING_MASKS[square]
+    key = (square << BOARD_SIZE) | occupancy
+    if piece == NIBBLE_ROOK:
+        return ROOK_ATTACKS[key]
+    elif piece == NIBBLE_BISHOP:
+        return BISHOP_ATTACKS[key]
+    return ROOK_ATTACKS[key] | BISHOP_ATTACKS[key]  # queen.
+
+
+def get_attacked_squares_bits(bits, player):
+    """Return the square set attacked by the given player. Includes squares occupied by
+    pieces belonging to both players. No piece attacks its own square."""
+    occupancy = get_occupancy_bits(bits)
+    pieces = get_player_occupancy_bits(bits, player)
+    attacked = 0
+    while pieces:
+        top = pieces.bit_length()
+        pieces ^= 1 << (top - 1)
+        square = BOARD_SIZE - top
+        attacked |= get_piece_attacks_bits(
+            (bits >> NIBBLE_SHIFTS[square]) & NIBBLE_BITMASK, square, occupancy
+        )
+    return attacked
+
+
+def is_square_attacked_bits(bits, square, player, occupancy=None):
+    """Return true if the given square is attacked by the given player. Rather than
+    generating every attack of the player, this looks outwards from the square for
+    pieces that could be attacking it. The occupancy can be passed in if already known.
+    """
+    color = NIBBLE_BLACK if player == "b" else 0
+    for i in KNIGHT_SQUARES[square]:
+        if (bits >> NIBBLE_SHIFTS[i]) & NIBBLE_BITMASK == NIBBLE_KNIGHT | color:
+            return True
+    for i in KING_SQUARES[square]:
+        if (bits >> NIBBLE_SHIFTS[i]) & NIBBLE_BITMASK == NIBBLE_KING | color:
+            return True
+    i = square + 1 if color else square - 1  # pawns attack towards the opponent.
+    if index_valid(i) and (bits >> NIBBLE_SHIFTS[i]) & NIBBLE_BITMASK == (
+        NIBBLE_PAWN | color
+    ):
+        return True
+    if occupancy is None:
+        occupancy = get_occupancy_bits(bits)
+    key = (square << BOARD_SIZE) | occupancy
+    rook_blockers = ROOK_ATTACKS[key] & occupancy
+    bishop_blockers = BISHOP_ATTACKS[key] & occupancy
+    while rook_blockers:  # only the first piece along each ray can attack.
+        top = rook_blockers.bit_length()
+        rook_blockers ^= 1 << (top - 1)
+        nibble = (bits >> (4 * (top - 1))) & NIBBLE_BITMASK
+        if nibble == NIBBLE_ROOK | color or nibble == NIBBLE_QUEEN | color:
+            return True
+    while bishop_blockers:
+        top = bishop_blockers.bit_length()
+        bishop_blockers ^= 1 << (top - 1)
+        nibble = (bits >> (4 * (top - 1))) & NIBBLE_BITMASK
+        if nibble == NIBBLE_BISHOP | color or nibble == NIBBLE_QUEEN | color:
+            return True
+    return False
+
+
+def is_in_check_bits(bits, player):
+    """Return true if the given player is in check in the given board. Assumes that the
+    position is valid."""
+    king = NIBBLE_KING if player == "w" else NIBBLE_KING | NIBBLE_BLACK
+    king_mask = find_nibble_bits(bits, king)
+    if not king_mask:
+        return False
+    return is_square_attacked_bits(
+        bits, BOARD_SIZE - king_mask.bit_length(), opposite_color(player)
+    )
+
+
+def apply_move_bits(bits, move):
+    """Naively apply a move to an integer board; i.e., assume the position and move are
+    both valid and legal."""
+    start, end = move
+    nibble = (bits >> NIBBLE_SHIFTS[start]) & NIBBLE_BITMASK
+    bits &= NIBBLE_CLEARS[start] & NIBBLE_CLEARS[end]
+    return bits | (nibble << NIBBLE_SHIFTS[end])
+
+
+def apply_move_vars(bits, active, halfmove, fullmove, move):
+    """Naively apply a move to the unpacked position; i.e., assume the position and move
+    are both valid and legal. Returns the new (bits, active, halfmove, fullmove)."""
+    start, end = move
+    if (bits >> NIBBLE_SHIFTS[start]) & 7 == NIBBLE_PAWN or (
+        bits >> NIBBLE_SHIFTS[end]
+    ) & NIBBLE_BITMASK:
+        halfmove = 0  # capture or pawn advance.
+    else:
+        halfmove += 1
+    if active == "b":
+        fullmove += 1
+    return apply_move_bits(bits, move), opposite_color(active), halfmove, fullmove
+
+
+def generate_moves_bits(bits, player):
+    """Generate tuples representing all legal moves by the given player on an integer
+    board, one at a time, so that callers can stop early."""
+    occupancy = get_occupancy_bits(bits)
+    own = get_player_occupancy_bits(bits, player)
+    opponent = opposite_color(player)
+    king_mask = find_nibble_bits(
+        bits, NIBBLE_KING | (NIBBLE_BLACK if player == "b" else 0)
+    )
+    king_square = BOARD_SIZE - king_mask.bit_length()
+    pieces = own
+    while pieces:
+        top = pieces.bit_length()
+        pieces ^= 1 << (top - 1)
+        start = BOARD_SIZE - top
+        nibble = (bits >> NIBBLE_SHIFTS[start]) & NIBBLE_BITMASK
+        targets = get_piece_attacks_bits(nibble, start, occupancy) & ~own
+        if nibble == NIBBLE_PAWN and start == PAWN_START_WHITE:
+            if not occupancy & (SQUARE_MASKS[start + 1] | SQUARE_MASKS[start + 2]):
+                targets |= SQUARE_MASKS[start + 2]  # pawn can move two spaces.
+        elif nibble == NIBBLE_PAWN | NIBBLE_BLACK and start == PAWN_START_BLACK:
+            if not occupancy & (SQUARE_MASKS[start - 1] | SQUARE_MASKS[start - 2]):
+                targets |= SQUARE_MASKS[start - 2]
+        for end in squares_from_mask(targets):
+            if not king_mask:  # no king to put in check.
+                yield (start, end)
+            elif not is_square_attacked_bits(
+                apply_move_bits(bits, (start, end)),
+                end if start == king_square else king_square,
+                opponent,
+                (occupancy & ~SQUARE_MASKS[start]) | SQUARE_MASKS[end],
+            ):
+                yield (start, end)  # eliminate moves that result in check.
+
+
+def get_moves_bits(bits, player):
+    """Get a list of tuples representing all legal moves by the given player on an
+    integer board."""
+    return list(generate_moves_bits(bits, player))
+
+
+def has_legal_move_bits(bits, player):
+    """Return true if the given player has a legal move on an integer board, stopping
+    at the first one found."""
+    return next(generate_moves_bits(bits, player), None) is not None
+
+
+def get_current_moves_vars(bits, active, halfmove, fullmove):
+    """Get a list of tuples representing all legal moves by the current player."""
+    return get_moves_bits(bits, active)
+
+
+def get_pieces_bits(bits):
+    """Return a set of all pieces present in an integer board."""
+    return {
+        NIBBLE_TO_PIECE[(bits >> NIBBLE_SHIFTS[square]) & NIBBLE_BITMASK]
+        for square in squares_from_mask(get_occupancy_bits(bits))
+    }
+
+
+def check_position_vars(bits, active, halfmove, fullmove):
+    """Check if an unpacked position is an ended game. Identical to check_position, but
+    operates on (bits, active, halfmove, fullmove)."""
+    if fullmove >= 150:
+        return ("d", "150+ fullmove rule")
+    draw = None
+    if halfmove >= 100:
+        draw = ("d", "50-move rule")
+    elif get_pieces_bits(bits) in INSUFFICIENT_MATERIAL_SETS:
+        draw = ("d", "insufficient material")
+    in_check = is_in_check_bits(bits, active)
+    if draw is not None and not in_check:
+        return draw
+    if not has_legal_move_bits(bits, active):  # no valid moves.
+        if in_check:
+            return (opposite_color(active), "checkmate")
+        else:
+            return ("d", "stalemate")
+    if draw is not None:
+        return draw
+    return (None, None)
+
+
+def mirror_bits(bits):
+    """Return the mirror of an integer board, as in mirror_board."""
+    mirrored = 0
+    for _ in range(BOARD_SIZE):  # from the last square to the first.
+        nibble = bits & NIBBLE_BITMASK
+        mirrored = (mirrored << 4) | (nibble ^ NIBBLE_BLACK if nibble else 0)
+        bits >>= 4
+    return mirrored
+
+
+def canonicalize_bits(bits, active):
+    """Return a tuple of (bits, active, mirrored) for an integer board, as in
+    canonicalize."""
+    if active == "b":
+        return mirror_bits(bits), "w", True
+    return bits, active, False
+
+
+# Zobrist hashing.
+#
+# Every (square, piece) pair gets a random 64-bit key, and a board's hash is the XOR of
+# the keys of its pieces, XORed with another key if black is to move. This makes hashes
+# cheap to update after a move. Keys come from a seeded generator so that hashes are the
+# same in every process (and every run).
+
+ZOBRIST_SEED = 1
+
+
+def _build_zobrist_keys():
+    """Build the random keys for every (square, nibble) pair, with empty squares getting
+    a key of 0, as well as the key for black to move."""
+    generator = random.Random(ZOBRIST_SEED)
+    pieces = [
+        [generator.getrandbits(64) if nibble else 0 for nibble in range(16)]
+        for _ in range(BOARD_SIZE)
+    ]
+    return pieces, generator.getrandbits(64)
+
+
+ZOBRIST_PIECES, ZOBRIST_BLACK = _build_zobrist_keys()
+ZOBRIST_PIECE_CHARS = [
+    {piece: keys[nibble] for piece, nibble in PIECE_TO_NIBBLE.items()}
+    for keys in ZOBRIST_PIECES
+]  # the same keys, but indexed by square and then by piece letter.
+
+
+def zobrist_hash(board, active):
+    """Return the Zobrist hash of a board string and the player to move."""
+    key = ZOBRIST_BLACK if active == "b" else 0
+    for i, square in enumerate(board):
+        key ^= ZOBRIST_PIECE_CHARS[i][square]
+    return key
+
+
+def zobrist_hash_bits(bits, active):
+    """Return the Zobrist hash of an integer board and the player to move."""
+    key = ZOBRIST_BLACK if active == "b" else 0
+    for square in range(BOARD_SIZE):
+        key ^= ZOBRIST_PIECES[square][(bits >> NIBBLE_SHIFTS[square]) & NIBBLE_BITMASK]
+    return key
+
+
+def zobrist_update_bits(key, bits, move):
+    """Given the hash of an integer board (before the move), return the hash of the board
+    after applying the move, including the change of player to move."""
+    start, end = move
+    piece = (bits >> NIBBLE_SHIFTS[start]) & NIBBLE_BITMASK
+    captured = (bits >> NIBBLE_SHIFTS[end]) & NIBBLE_BITMASK
+    return (
+        key
+        ^ ZOBRIST_PIECES[start][piece]
+        ^ ZOBRIST_PIECES[end][captured]
+        ^ ZOBRIST_PIECES[end][piece]
+        ^ ZOBRIST_BLACK
+    )
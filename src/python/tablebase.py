@@ -0,0 +1,542 @@
+# Endgame tablebases, built by retrograde analysis.
+#
+# A tablebase holds the exact result, with perfect play, of every position with a given
+# set of pieces. The set of pieces is its "signature", written as the two kings, a plus,
+# and then the additional pieces; e.g. "Kk+bp" is both kings, a black bishop, and a black
+# pawn. Additional pieces are always written in the order QRBNPqrbnp.
+#
+# Tables are solved backwards: every legal position is enumerated, positions where the
+# game is over (found as in check_position) are scored, and results are propagated to
+# the positions that lead to them until nothing changes. Captures lead to positions with
+# fewer pieces, which are solved first. Like most tablebases, the 50-move rule, the
+# 150-fullmove rule, and threefold repetition are ignored.
+#
+# Only positions that can arise in a game are included: the white king is left of the
+# black king (kings can't pass each other), and pawns are between the kings and haven't
+# moved backwards from their starting squares (as in endgame_finder.py).
+#
+# Each position has a one-byte value, from the perspective of the player to move:
+#   0       not a legal position
+#   1       draw
+#   2 + n   game ends in checkmate after n more ply with perfect play; a win for the
+#           player to move if n is odd, and a loss if n is even
+# and positions are indexed by the squares of the pieces (in signature order) as base-16
+# digits, followed by a bit that is set if black is to move.
+#
+# A table file is a 32-byte header followed by the values:
+#   bytes 0-3   magic, b"1DTB"
+#   bytes 4-5   format version, uint16
+#   bytes 6-7   size of each value in bytes, uint16 (always 1)
+#   bytes 8-23  signature, ASCII, padded with null bytes
+#   bytes 24-27 number of values, uint32
+#   bytes 28-31 CRC-32 checksum of the values, uint32
+# with everything little-endian.
+#
+# Tables are probed through Tablebases, which loads table files the first time they're
+# needed and keeps the most recently used ones in memory.
+#
+# A table and the table of its mirrored signature (e.g. "Kk+Np" and "Kk+Pn") hold the
+# same results, for the mirrored positions (see position.py). With mirror set, only the
+# canonical one of each pair (the first in sort order) is solved and written, and
+# positions are probed through whichever of the two has a table; this roughly halves
+# the time and space taken by sets of tables that contain both.
+#
+# Run this file with signatures as arguments to generate their tables (and the tables of
+# every signature they capture down to).
+
+from array import array
+from collections import OrderedDict
+from itertools import permutations
+import os
+import position as Position
+import struct
+import sys
+import threading
+import zlib
+
+TABLEBASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tablebases")
+TABLE_MAGIC = b"1DTB"
+TABLE_VERSION = 1
+# Header fields: magic, version, value size, signature, number of values, CRC-32.
+TABLE_HEADER = struct.Struct("<4sHH16sII")
+
+ADDITIONAL_PIECES = "QRBNPqrbnp"  # order of additional pieces in a signature.
+MAX_ADDITIONAL_PIECES = 3
+
+VALUE_ILLEGAL = 0
+VALUE_DRAW = 1
+VALUE_MATE = 2  # value of a position that is checkmate; add the number of ply to mate.
+MAX_DTM = 255 - VALUE_MATE  # longest distance to mate that fits in a value.
+
+DEFAULT_MAX_TABLES = 32  # tables kept in memory by default (at most 2 MB each).
+
+
+def parse_signature(signature):
+    """Turn a signature into a tuple of its pieces, with the kings first and additional
+    pieces in the canonical order."""
+    kings, _, additional = signature.partition("+")
+    if kings != "Kk":
+        raise ValueError("signature {} must start with Kk".format(signature))
+    if len(additional) > MAX_ADDITIONAL_PIECES or any(
+        additional.count(piece) != 1 for piece in additional
+    ):
+        raise ValueError(
+            "signature {} must have at most {} unique additional pieces".format(
+                signature, MAX_ADDITIONAL_PIECES
+            )
+        )
+    if any(piece not in ADDITIONAL_PIECES for piece in additional):
+        raise ValueError("signature {} has an unknown piece".format(signature))
+    return ("K", "k") + tuple(sorted(additional, key=ADDITIONAL_PIECES.index))
+
+
+def format_signature(pieces):
+    """Turn an iterable of pieces (including both kings) into a canonical signature."""
+    additional = sorted(
+        (piece for piece in pieces if piece.upper() != "K"),
+        key=ADDITIONAL_PIECES.index,
+    )
+    return "Kk+" + "".join(additional) if additional else "Kk"
+
+
+def mirror_signature(signature):
+    """Return the signature of the mirrors of a signature's positions."""
+    return format_signature(piece.swapcase() for piece in parse_signature(signature))
+
+
+def get_canonical_signature(signature):
+    """Return the canonical one of a signature and its mirror."""
+    signature = format_signature(parse_signature(signature))
+    return min(signature, mirror_signature(signature))
+
+
+def get_signature_bits(bits):
+    """Return the signature of an integer board, or None if it has too many pieces to be
+    in a tablebase."""
+    pieces = Position.get_pieces_bits(bits)
+    if len(pieces) > 2 + MAX_ADDITIONAL_PIECES or not {"K", "k"} <= pieces:
+        return None
+    return format_signature(pieces)
+
+
+def get_table_file(signature, directory=TABLEBASE_DIR):
+    """Return the path of the table file for a signature. Files are named by the white
+    and black pieces in uppercase, so that names don't clash on case-insensitive file
+    systems; e.g. "Kk+bp" is stored in "K_KBP.tb"."""
+    pieces = parse_signature(signature)
+    white = "".join(piece for piece in pieces if piece.isupper())
+    black = "".join(piece.upper() for piece in pieces if piece.islower())
+    return os.path.join(directory, "{}_{}.tb".format(white, black))
+
+
+def get_table_size(pieces):
+    """Return the number of values in the table for a tuple of pieces."""
+    return 2 * Position.BOARD_SIZE ** len(pieces)
+
+
+def get_index(pieces, bits, active):
+    """Return the index of a position in the table for its pieces."""
+    index = 0
+    for piece in pieces:
+        mask = Position.find_nibble_bits(bits, Position.PIECE_TO_NIBBLE[piece])
+        index = index * Position.BOARD_SIZE + Position.BOARD_SIZE - mask.bit_length()
+    return 2 * index + (active == "b")
+
+
+def decode_value(value):
+    """Decode a value into a tuple of (result, distance to mate in ply) for the player
+    to move, where result is 1 for a win, -1 for a loss, and 0 for a draw. Returns None
+    for illegal positions."""
+    if value == VALUE_ILLEGAL:
+        return None
+    elif value == VALUE_DRAW:
+        return (0, None)
+    dtm = value - VALUE_MATE
+    return (1 if dtm % 2 else -1, dtm)
+
+
+def _is_reachable(pieces, squares):
+    """Return whether pieces on the given squares can arise in a game."""
+    white_king, black_king = squares[0], squares[1]
+    if black_king - white_king < 2:  # kings can't pass or touch each other.
+        return False
+    for piece, square in zip(pieces[2:], squares[2:]):
+        if piece == "P" and not (
+            Position.PAWN_START_WHITE <= square < black_king and square > white_king
+        ):
+            return False
+        if piece == "p" and not (
+            white_king < square <= Position.PAWN_START_BLACK and square < black_king
+        ):
+            return False
+    return True
+
+
+def enumerate_positions(pieces):
+    """Yield (index, bits, active) for every legal, reachable position with the pieces."""
+    nibbles = [Position.PIECE_TO_NIBBLE[piece] for piece in pieces]
+    for squares in permutations(range(Position.BOARD_SIZE), len(pieces)):
+        if not _is_reachable(pieces, squares):
+            continue
+        bits = 0
+        index = 0
+        for nibble, square in zip(nibbles, squares):
+            bits |= nibble << Position.NIBBLE_SHIFTS[square]
+            index = index * Position.BOARD_SIZE + square
+        for active in ["w", "b"]:
+            # The player who just moved can't have left their king in check.
+            if not Position.is_in_check_bits(bits, Position.opposite_color(active)):
+                yield 2 * index + (active == "b"), bits, active
+
+
+def solve(signature, solved=None, directory=TABLEBASE_DIR, mirror=False):
+    """Solve the tablebase for a signature and return its values as an array. Tables
+    for positions after a capture are loaded from the directory if they exist, and are
+    otherwise solved too. Solved tables are kept in the solved dict by signature. If
+    mirror is true, positions after a capture are looked up in the table of their
+    mirror if it exists instead, and only canonical signatures are solved for them."""
+    if solved is None:
+        solved = {}
+    pieces = parse_signature(signature)
+    signature = format_signature(pieces)
+    if signature in solved:
+        return solved[signature]
+
+    def load_table(capture_signature):
+        """Load the values of a table into solved if it isn't solved yet, returning
+        whether there are values for it."""
+        if capture_signature not in solved:
+            path = get_table_file(capture_signature, directory)
+            if not os.path.exists(path):
+                return False
+            solved[capture_signature] = read_table(path)[1]
+        return True
+
+    def get_capture_table(captured):
+        """Return a tuple of (pieces, values, mirrored) of the table after a piece is
+        captured, where mirrored is true if it is the table of the mirror."""
+        remaining = list(pieces)
+        remaining.remove(captured)
+        capture_signature = format_signature(remaining)
+        if load_table(capture_signature):
+            mirrored = False
+        elif mirror and load_table(mirror_signature(capture_signature)):
+            capture_signature, mirrored = mirror_signature(capture_signature), True
+        else:
+            if mirror:
+                canonical = get_canonical_signature(capture_signature)
+                mirrored = canonical != capture_signature
+                capture_signature = canonical
+            else:
+                mirrored = False
+            solve(capture_signature, solved, directory, mirror)
+        return (
+            tuple(parse_signature(capture_signature)),
+            solved[capture_signature],
+            mirrored,
+        )
+
+    values = array("B", bytes(get_table_size(pieces)))
+    insufficient = set(pieces) in Position.INSUFFICIENT_MATERIAL_SETS
+
+    # Build the graph of moves between positions in the table, with positions numbered
+    # in order of enumeration. Every position starts with a count of the moves that
+    # haven't been shown to lose (i.e., lead to a win for the opponent) and the longest
+    # distance of those that have; when the count reaches zero the position is lost.
+    # Results after captures are already known, so they're applied immediately.
+    indices = array("l")  # table index of each position.
+    numbers = {}  # position number of each table index.
+    successors = []  # successor table indices of each position.
+    remaining = array("l")  # moves not yet shown to lose.
+    longest_loss = array("l")  # longest distance to mate of moves shown to lose.
+    buckets = [[] for _ in range(MAX_DTM + 1)]  # positions to resolve, by distance.
+    for index, bits, active in enumerate_positions(pieces):
+        number = len(indices)
+        numbers[index] = number
+        indices.append(index)
+        moves = Position.get_moves_bits(bits, active)
+        own_successors = []
+        count, longest = 0, 0
+        if not moves or insufficient:
+            state = Position.check_position_vars(bits, active, 0, 1)
+            if state[1] == "checkmate":
+                buckets[0].append((number, VALUE_MATE))
+            else:
+                values[index] = VALUE_DRAW
+        else:
+            opponent = Position.opposite_color(active)
+            for move in moves:
+                captured = Position.get_nibble(bits, move[1])
+                next_bits = Position.apply_move_bits(bits, move)
+                if not captured:
+                    own_successors.append(get_index(pieces, next_bits, opponent))
+                    count += 1
+                    continue
+                capture_pieces, capture_values, mirrored = get_capture_table(
+                    Position.NIBBLE_TO_PIECE[captured]
+                )
+                if mirrored:
+                    capture_index = get_index(
+                        capture_pieces, Position.mirror_bits(next_bits), active
+                    )
+                else:
+                    capture_index = get_index(capture_pieces, next_bits, opponent)
+                result = decode_value(capture_values[capture_index])
+                if result[0] == -1:  # opponent loses, so we win.
+                    count += 1  # a winning move never loses.
+                    buckets[result[1] + 1].append((number, VALUE_MATE + result[1] + 1))
+                elif result[0] == 1:  # opponent wins, so this move loses.
+                    longest = max(longest, result[1] + 1)
+                else:  # a draw is never a loss.
+                    count += 1
+            if count == 0:  # every move is a capture that loses.
+                buckets[longest].append((number, VALUE_MATE + longest))
+        successors.append(own_successors)
+        remaining.append(count)
+        longest_loss.append(longest)
+
+    # Invert the graph, so that we can find the positions that lead to each position.
+    predecessors = [[] for _ in indices]
+    for number, own_successors in enumerate(successors):
+        for index in own_successors:
+            predecessors[numbers[index]].append(number)
+    del successors
+
+    # Resolve positions in order of distance to mate, so that the first time a position
+    # is found to be won it is with the shortest distance, and it is found to be lost
+    # only after its longest move is resolved.
+    for dtm in range(MAX_DTM + 1):
+        for number, value in buckets[dtm]:
+            index = indices[number]
+            if values[index] != VALUE_ILLEGAL:
+                continue  # already resolved via a shorter win.
+            values[index] = value
+            for predecessor in predecessors[number]:
+                if values[indices[predecessor]] != VALUE_ILLEGAL:
+                    continue
+                if dtm % 2 == 0:  # this position is lost, so the predecessor wins.
+                    if dtm + 1 > MAX_DTM:
+                        raise ValueError("distance to mate too long to store")
+                    buckets[dtm + 1].append((predecessor, VALUE_MATE + dtm + 1))
+                else:  # this position is won, so this move loses for the predecessor.
+                    remaining[predecessor] -= 1
+                    longest_loss[predecessor] = max(longest_loss[predecessor], dtm + 1)
+                    if remaining[predecessor] == 0:
+                        if longest_loss[predecessor] > MAX_DTM:
+                            raise ValueError("distance to mate too long to store")
+                        buckets[longest_loss[predecessor]].append(
+                            (predecessor, VALUE_MATE + longest_loss[predecessor])
+                        )
+        buckets[dtm] = None  # free memory as we go.
+
+    # Anything left unresolved can't be forced either way, so it's a draw.
+    for index in indices:
+        if values[index] == VALUE_ILLEGAL:
+            values[index] = VALUE_DRAW
+
+    solved[signature] = values
+    return values
+
+
+def write_table(signature, values, path):
+    """Write the values of a solved table to a table file."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    header = TABLE_HEADER.pack(
+        TABLE_MAGIC,
+        TABLE_VERSION,
+        values.itemsize,
+        signature.encode("ascii"),
+        len(values),
+        zlib.crc32(values),
+    )
+    with open(path, "wb") as f:
+        f.write(header)
+        values.tofile(f)
+
+
+def read_table(path):
+    """Read a table file and return a tuple of (signature, values). Raises ValueError if
+    the file is not a valid table file."""
+    with open(path, "rb") as f:
+        data = f.read()
+    magic, version, size, signature, num_values, checksum = TABLE_HEADER.unpack_from(
+        data
+    )
+    values = data[TABLE_HEADER.size :]
+    if (magic, version, size) != (TABLE_MAGIC, TABLE_VERSION, 1) or (
+        len(values) != num_values or zlib.crc32(values) != checksum
+    ):
+        raise ValueError("{} is not a valid table file; regenerate it".format(path))
+    return signature.rstrip(b"\0").decode("ascii"), values
+
+
+def generate(signatures, directory=TABLEBASE_DIR, verbose=True, mirror=False):
+    """Solve the given signatures (and everything they capture down to), and write a
+    table file for each one that doesn't exist yet. If mirror is true, only the
+    canonical one of each signature and its mirror is solved, unless the other already
+    has a table file."""
+    solved = {}
+    for signature in signatures:
+        if mirror:
+            signature = format_signature(parse_signature(signature))
+            if os.path.exists(get_table_file(mirror_signature(signature), directory)):
+                continue
+            signature = get_canonical_signature(signature)
+        solve(signature, solved, directory, mirror)
+    for signature, values in solved.items():
+        path = get_table_file(signature, directory)
+        if not os.path.exists(path):
+            write_table(signature, values, path)
+            if verbose:
+                counts = [0, 0, 0]  # losses, draws, wins for the player to move.
+                for value in values:
+                    if value != VALUE_ILLEGAL:
+                        counts[decode_value(value)[0] + 1] += 1
+                print(
+                    "{}: {} wins, {} draws, {} losses -> {}".format(
+                        signature, counts[2], counts[1], counts[0], path
+                    )
+                )
+
+
+class Tablebases:
+    """Probes the table files in a directory. Tables are loaded the first time they're
+    probed, and at most max_tables of them are kept in memory, evicting the least
+    recently used. Signatures without a table file are remembered, so that probing them
+    again is cheap; call clear() after generating new tables. If mirror is true,
+    positions without a table are probed in the table of their mirror. Tablebases can
+    be shared between threads (e.g. the workers of the analysis server)."""
+
+    def __init__(
+        self, directory=TABLEBASE_DIR, max_tables=DEFAULT_MAX_TABLES, mirror=False
+    ):
+        self.directory = directory
+        self.max_tables = max_tables
+        self.mirror = mirror
+        self.lock = threading.Lock()  # held while finding or loading a table.
+        self.clear()
+
+    def clear(self):
+        """Forget loaded and missing tables, and reset statistics."""
+        self.tables = OrderedDict()  # signature -> values, least recently used first.
+        self.missing = set()  # signatures without a table file.
+        self.probes = 0
+        self.hits = 0
+        self.loads = 0
+        self.evictions = 0
+
+    def get_table(self, signature):
+        """Return the values of the table for a signature, loading it if necessary, or
+        None if there is no table file for it."""
+        with self.lock:
+            if signature in self.tables:
+                self.tables.move_to_end(signature)
+                return self.tables[signature]
+            if signature in self.missing:
+                return None
+            path = get_table_file(signature, self.directory)
+            if not os.path.exists(path):
+                self.missing.add(signature)
+                return None
+            values = read_table(path)[1]
+            self.loads += 1
+            self.tables[signature] = values
+            if len(self.tables) > self.max_tables:
+                self.tables.popitem(last=False)
+                self.evictions += 1
+            return values
+
+    def _lookup(self, bits, active):
+        """Return the decoded value of a position, or None if it isn't in a table."""
+        signature = get_signature_bits(bits)
+        if signature is None:
+            return None
+        values = self.get_table(signature)
+        if values is None:
+            if not self.mirror:
+                return None
+            signature = mirror_signature(signature)
+            values = self.get_table(signature)
+            if values is None:
+                return None
+            bits, active = Position.mirror_bits(bits), Position.opposite_color(active)
+        return decode_value(values[get_index(parse_signature(signature), bits, active)])
+
+    def probe_bits(self, bits, active):
+        """Probe an integer board. Returns a tuple of (result, distance to mate in ply)
+        for the player to move as in decode_value, or None if there is no table for the
+        position."""
+        self.probes += 1
+        result = self._lookup(bits, active)
+        if result is not None:
+            self.hits += 1
+        return result
+
+    def probe(self, position):
+        """Probe a position string, as in probe_bits."""
+        bits, active, _, _ = Position.position_to_vars(position)
+        return self.probe_bits(bits, active)
+
+    def best_move_bits(self, bits, active):
+        """Return the best move in an integer board: the fastest win, otherwise a move
+        that keeps a draw, otherwise the slowest loss. Returns None if the position has
+        no moves or any move leads to a position without a table."""
+        best_move, best_key = None, None
+        opponent = Position.opposite_color(active)
+        for move in Position.get_moves_bits(bits, active):
+            result = self._lookup(Position.apply_move_bits(bits, move), opponent)
+            if result is None:
+                return None
+            if result[0] == -1:  # opponent loses; prefer the shortest.
+                key = (0, result[1])
+            elif result[0] == 0:
+                key = (1, 0)
+            else:  # opponent wins; prefer the longest.
+                key = (2, -result[1])
+            if best_key is None or key < best_key:
+                best_move, best_key = move, key
+        return best_move
+
+    def best_move(self, position):
+        """Return the best move in a position string, as in best_move_bits."""
+        bits, active, _, _ = Position.position_to_vars(position)
+        return self.best_move_bits(bits, active)
+
+    def probe_line(self, bits, active):
+        """Return the line to mate from an integer board with perfect play, or an empty
+        list if the position is drawn or has no table."""
+        result = self._lookup(bits, active)
+        if result is None or result[0] == 0:
+            return []
+        line = []
+        for _ in range(result[1]):
+            move = self.best_move_bits(bits, active)
+            line.append(move)
+            bits = Position.apply_move_bits(bits, move)
+            active = Position.opposite_color(active)
+        return line
+
+    def hit_rate(self):
+        """Return the fraction of probes that found their position."""
+        return self.hits / self.probes if self.probes else 0.0
+
+    def stats(self):
+        """Return a dict of statistics about table usage."""
+        return {
+            "loaded": len(self.tables),
+            "missing": len(self.missing),
+            "probes": self.probes,
+            "hits": self.hits,
+            "hit_rate": self.hit_rate(),
+            "loads": self.loads,
+            "evictions": self.evictions,
+        }
+
+
+TABLEBASES = Tablebases()  # shared by the players; loads nothing until probed.
+
+
+if __name__ == "__main__":
+    generate(sys.argv[1:])
@@ -0,0 +1,80 @@
+import ai_dfs
+import ai_greedy
+import main
+import position as Position
+
+
+def _player(**kwargs):
+    """Helper to make a player with a node budget, so that its moves are repeatable."""
+    return ai_dfs.Player(time_limit=None, node_limit=2000, tablebases=None, **kwargs)
+
+
+def test_player_move():
+    player = _player()
+    move = player.move(Position.START_POSITION)
+    assert move in Position.get_current_moves(Position.START_POSITION)
+    assert player.last_search["movelist"][0] == move
+    assert player.last_search["depth"] > 1
+    assert _player().move(Position.START_POSITION) == move
+
+    # A time budget bounds how long a move takes.
+    player = ai_dfs.Player(time_limit=0.2, tablebases=None)
+    player.move(Position.START_POSITION)
+    assert player.last_search["seconds"] < 0.5
+
+
+def test_player_game():
+    # The player follows the game, and starts a new one when the position doesn't follow
+    # from its last move.
+    player = _player()
+    position = Position.START_POSITION
+    for _ in range(4):  # playing both sides.
+        position = Position.apply_move(position, player.move(position))
+    assert sum(player.seen_boards.values()) == 4
+    player.move("K.......n......k w 0 1")
+    assert sum(player.seen_boards.values()) == 1
+
+    state, _ = main.run_game(
+        verbose=False,
+        check_valid=True,
+        ai_white=_player().move,
+        ai_black=ai_greedy.move,
+    )
+    assert state == ("w", "checkmate")
+
+
+def test_player_ponder():
+    player = _player(ponder=True)
+    player.move(Position.START_POSITION)
+    assert player.is_pondering()
+    position = player.ponder_position
+    assert Position.apply_move(
+        player.last_position, player.last_search["movelist"][1]
+    ) == (position)
+    player.move(position)
+    assert player.ponder_hits == 1
+    player.stop_pondering()
+    assert not player.is_pondering()
+
+
+def test_player_ponder_game_over():
+    # A pondering player stops when the game ends, even on its opponent's move, and
+    # pondering on its own runs out of budget.
+    player = _player(ponder=True)
+    state, _ = main.run_game(
+        verbose=False,
+        check_valid=True,
+        ai_white=ai_greedy.move,
+        ai_black=player.move,
+        position="K.......n......k w 0 1",
+    )
+    assert state[0] is not None
+    assert player._ponder_thread is None and not player.is_pondering()
+
+    with _player(ponder=True, ponder_time_limit=0.1) as player:
+        player.move(Position.START_POSITION)
+        player._ponder_thread.join(timeout=5)
+        assert not player.is_pondering()
+    player.move(Position.START_POSITION)
+    player.close()
+    assert player._ponder_thread is None
@@ -0,0 +1,88 @@
+import all_positions as AllPositions
+import os
+import position as Position
+import pytest
+
+# Number of positions reachable after each halfmove, as printed by explore.
+EXPLORE_COUNTS = [4, 16, 51, 158, 667, 2613, 10420]
+
+
+def test_explore_packed():
+    counts = AllPositions.explore_packed(7, vectorized=False, verbose=False)
+    assert counts == EXPLORE_COUNTS
+
+
+def test_explore_packed_vectorized():
+    pytest.importorskip("numpy")
+    for batch_size in [AllPositions.BATCH_SIZE, 100]:
+        counts = AllPositions.explore_packed(
+            7, vectorized=True, batch_size=batch_size, verbose=False
+        )
+        assert counts == EXPLORE_COUNTS
+
+
+def test_explore_on_disk(tmp_path):
+    counts = AllPositions.explore_on_disk(
+        7, str(tmp_path), chunk_size=1000, vectorized=False, verbose=False
+    )
+    assert counts == EXPLORE_COUNTS
+
+    # Chunks are merged a few files at a time, in several passes.
+    for vectorized in [False, True] if AllPositions.np is not None else [False]:
+        directory = str(tmp_path / "fan_in_{}".format(vectorized))
+        counts = AllPositions.explore_on_disk(
+            7,
+            directory,
+            chunk_size=20,
+            vectorized=vectorized,
+            verbose=False,
+            merge_fan_in=3,
+        )
+        assert counts == EXPLORE_COUNTS
+        assert sorted(os.listdir(directory)) == [
+            AllPositions.CHECKPOINT_FILE,
+            "level_007.bin",
+        ]
+
+
+def test_explore_on_disk_resume(tmp_path):
+    # Count only new positions, building the expected counts with sets in memory.
+    seen = {"w": {Position.START_BOARD}, "b": set()}
+    boards = {Position.START_BOARD}
+    expected = []
+    for level in range(6):
+        active = "w" if level % 2 == 0 else "b"
+        next_active = Position.opposite_color(active)
+        boards = AllPositions._next_boards(boards, active) - seen[next_active]
+        seen[next_active] |= boards
+        expected.append(len(boards))
+
+    directory = str(tmp_path)
+    counts = AllPositions.explore_on_disk(
+        3, directory, chunk_size=50, exclude_seen=True, verbose=False
+    )
+    assert counts == expected[:3]
+    # Files left by a run interrupted during level 4 are removed, not merged.
+    with open(os.path.join(directory, "level_004_chunk_00099.bin"), "wb") as f:
+        f.write(bytes(8))
+    counts = AllPositions.explore_on_disk(  # resumes after level 3.
+        6, directory, chunk_size=50, exclude_seen=True, verbose=False
+    )
+    assert counts == expected
+    assert sorted(os.listdir(directory)) == [
+        AllPositions.CHECKPOINT_FILE,
+        "level_006.bin",
+        "seen_b_005.bin",
+        "seen_w_006.bin",
+    ]
+    with pytest.raises(ValueError):  # can't resume a different kind of run.
+        AllPositions.explore_on_disk(7, directory, verbose=False)
+
+
+def test_explore_parallel():
+    for vectorized in [False, True] if AllPositions.np is not None else [False]:
+        for workers in [1, 3]:
+            counts = AllPositions.explore_parallel(
+                7, workers=workers, vectorized=vectorized, verbose=False
+            )
+            assert counts == EXPLORE_COUNTS
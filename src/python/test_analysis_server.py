@@ -0,0 +1,218 @@
+import analysis_server as AnalysisServer
+import asyncio
+import evaluate
+import json
+import position as Position
+import pytest
+import socket
+import struct
+
+
+def _serve(lines, workers=1, read_line=None):
+    """Helper to serve lines on one connection of a new server, returning the
+    responses."""
+    responses = []
+
+    async def run():
+        server = AnalysisServer.AnalysisServer(
+            workers=workers, transposition_megabytes=1
+        )
+        await server.start()
+        remaining = [json.dumps(line) for line in lines]
+
+        async def read_next_line():
+            return remaining.pop(0) if remaining else ""
+
+        try:
+            await asyncio.wait_for(
+                server.serve_lines(read_line or read_next_line, responses.append), 60
+            )
+        finally:
+            await server.close()
+
+    asyncio.run(run())
+    return responses
+
+
+def test_parse_position():
+    assert AnalysisServer.parse_position(Position.START_POSITION)
+    for position in [
+        None,
+        "KQRBNP....pnbrqk w 0",
+        "KQRBNP....pnbrq w 0 1",
+        "KQRBNP....pnbrqx w 0 1",
+        "KQRBNP....pnbrqq w 0 1",
+        "KQRBNP....pnbrqk x 0 1",
+        "KQRBNP....pnbrqk w a 1",
+    ]:
+        with pytest.raises(ValueError):
+            AnalysisServer.parse_position(position)
+
+
+def test_analyze():
+    position = "KQRB..NP.p.nbrqk b 0 1"
+    responses = _serve(
+        [
+            {"command": "analyze", "position": position, "max_depth": 6},
+            {"command": "analyze", "id": "bad", "position": "K w 0 1"},
+            {"command": "analyze", "position": Position.START_POSITION, "max_depth": 3},
+            {"command": "stats", "id": "stats"},
+            {"command": "dance"},
+        ]
+    )
+    by_id = {}
+    for response in responses:
+        by_id.setdefault(response.get("id"), []).append(response)
+
+    # Each depth is streamed, and the result is a forced win (whose line may stop short
+    # of mate, as the mate can be found past the depth by the quiescence search).
+    depths = by_id[1][:-1]
+    assert [response["type"] for response in depths] == ["depth"] * len(depths)
+    assert [response["depth"] for response in depths] == list(range(1, len(depths) + 1))
+    result = by_id[1][-1]
+    assert result["type"] == "result" and not result["cancelled"]
+    assert result["score"] == evaluate.SCORE_WIN
+    for move in result["movelist"]:
+        assert tuple(move) in Position.get_current_moves(position)
+        position = Position.apply_move(position, tuple(move))
+    assert by_id[2][-1]["type"] == "result" and by_id[2][-1]["depth"] == 3
+    assert by_id["bad"] == [
+        {"id": "bad", "type": "error", "error": "board must have 16 squares"}
+    ]
+    assert by_id["stats"][0]["type"] == "stats"
+    assert by_id["stats"][0]["received"] == 2
+    assert by_id[None][0]["type"] == "error"
+
+
+def test_cancel():
+    started = None
+
+    def read_lines():
+        """Send a long request and a queued one, and cancel both once the first is
+        running."""
+        lines = [
+            {"command": "analyze", "id": 1, "position": Position.START_POSITION},
+            {"command": "analyze", "id": 2, "position": Position.START_POSITION},
+            "wait",
+            {"command": "cancel", "id": 2},
+            {"command": "cancel", "id": 1},
+            {"command": "cancel", "id": 3},
+        ]
+
+        async def read_line():
+            if not lines:
+                return ""
+            line = lines.pop(0)
+            if line == "wait":
+                await started.wait()
+                line = lines.pop(0)
+            return json.dumps(line)
+
+        return read_line
+
+    responses = []
+
+    async def run():
+        nonlocal started
+        started = asyncio.Event()
+        server = AnalysisServer.AnalysisServer(workers=1, transposition_megabytes=1)
+        await server.start()
+
+        def send(response):
+            responses.append(response)
+            if response["type"] == "depth":
+                started.set()
+
+        try:
+            await asyncio.wait_for(server.serve_lines(read_lines(), send), 30)
+        finally:
+            await server.close()
+
+    asyncio.run(run())
+    assert {"id": 2, "type": "cancelled"} in responses
+    assert {"id": 3, "type": "error", "error": "no such request"} in responses
+    result = [response for response in responses if response["type"] == "result"]
+    assert len(result) == 1 and result[0]["id"] == 1 and result[0]["cancelled"]
+    assert result[0]["seconds"] < AnalysisServer.DEFAULT_TIME_LIMIT
+
+
+def test_tcp_client():
+    # The same search is much cheaper the second time, as the table is kept warm.
+    lines = [
+        json.dumps(
+            {
+                "command": "analyze",
+                "id": i,
+                "position": Position.START_POSITION,
+                "max_depth": 6,
+            }
+        )
+        for i in range(2)
+    ]
+
+    async def run():
+        server = AnalysisServer.AnalysisServer(transposition_megabytes=1)
+        await server.start()
+        tcp_server = await server.serve_tcp()
+        port = tcp_server.sockets[0].getsockname()[1]
+        try:
+            return await asyncio.wait_for(AnalysisServer.run_client(lines, port), 60)
+        finally:
+            tcp_server.close()
+            await tcp_server.wait_closed()
+            await server.close()
+
+    responses = asyncio.run(run())
+    results = [response for response in responses if response["type"] == "result"]
+    assert [result["id"] for result in results] == [0, 1]
+    assert results[0]["score"] == results[1]["score"]
+    assert results[1]["nodes"] < results[0]["nodes"] / 2
+
+
+def test_disconnect():
+    # A client that goes away has its requests cancelled, rather than left to run until
+    # their deadlines: when its connection is reset, and when responses can't be sent.
+    lines = [
+        {"command": "analyze", "id": 1, "position": Position.START_POSITION},
+        {"command": "analyze", "id": 2, "position": Position.START_POSITION},
+    ]
+
+    async def run():
+        server = AnalysisServer.AnalysisServer(workers=1, transposition_megabytes=1)
+        await server.start()
+        tcp_server = await server.serve_tcp()
+        port = tcp_server.sockets[0].getsockname()[1]
+        try:
+            reader, writer = await asyncio.open_connection(AnalysisServer.HOST, port)
+            for line in lines:
+                writer.write((json.dumps(line) + "\n").encode())
+            await writer.drain()
+            await asyncio.wait_for(reader.readline(), 30)  # the first depth.
+            sock = writer.get_extra_info("socket")
+            sock.setsockopt(
+                socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0)
+            )
+            writer.transport.abort()  # reset the connection.
+            for _ in range(100):
+                if server.completed + server.cancelled == 2:
+                    break
+                await asyncio.sleep(0.1)
+            assert server.cancelled == 1 and server.completed == 1
+
+            def send(response):
+                if response["type"] == "depth":
+                    raise BrokenPipeError()
+
+            remaining = [json.dumps(line) for line in lines]
+
+            async def read_line():
+                return remaining.pop(0) if remaining else ""
+
+            await asyncio.wait_for(server.serve_lines(read_line, send), 30)
+            assert server.cancelled == 2 and server.completed == 2
+        finally:
+            tcp_server.close()
+            await tcp_server.wait_closed()
+            await server.close()
+
+    asyncio.run(asyncio.wait_for(run(), 60))
@@ -0,0 +1,127 @@
+import cache as Cache
+import evaluate
+import position as Position
+import threading
+
+
+def test_board_cache():
+    board_cache = Cache.BoardCache(megabytes=1)
+    calls = []
+
+    def compute(board, active):
+        calls.append((board, active))
+        return len(board)
+
+    assert board_cache.get("length", "K..k", "w", compute) == 4
+    assert board_cache.get("length", "K..k", "w", compute) == 4
+    assert board_cache.get("length", "K..k", "b", compute) == 4
+    assert len(calls) == 2
+    stats = board_cache.stats()
+    assert stats["entries"] == 2 and stats["hits"] == 1 and stats["misses"] == 2
+    assert stats["kinds"]["length"]["hit_rate"] == 1 / 3
+
+    # Entries are evicted in least recently used order once the cache is full.
+    board_cache.get("length", "K..k", "w", compute)  # most recently used.
+    board_cache.resize(board_cache.bytes / (1024 * 1024) - 0.000001)
+    assert board_cache.evictions == 1 and len(board_cache.entries) == 1
+    assert board_cache.get("length", "K..k", "w", compute) == 4
+    assert len(calls) == 2
+    board_cache.clear()
+    assert board_cache.stats()["entries"] == 0 and board_cache.bytes == 0
+
+
+def test_board_cache_threads():
+    # Threads sharing a small cache, so that they evict each other's entries, keep its
+    # accounting consistent.
+    board_cache = Cache.BoardCache(megabytes=0.005)
+    boards = ["K" + "." * i + "k" for i in range(100)]
+    errors = []
+
+    def compute(board, active):
+        return len(board)
+
+    def lookup(offset):
+        try:
+            for i in range(2000):
+                board = boards[(i * 7 + offset) % len(boards)]
+                assert board_cache.get("length", board, "w", compute) == len(board)
+                board_cache.stats()
+        except Exception as error:
+            errors.append(error)
+
+    threads = [threading.Thread(target=lookup, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    stats = board_cache.stats()
+    assert stats["hits"] + stats["misses"] == 8 * 2000
+    assert stats["evictions"] > 0
+    assert board_cache.bytes == sum(size for _, size in board_cache.entries.values())
+    assert board_cache.bytes <= board_cache.max_bytes
+
+
+def test_cached_functions():
+    for position in [
+        Position.START_POSITION,
+        "K.kn............ w 39 20",
+        "K.k............q w 39 20",
+    ]:
+        board, active, _, _ = position.split(" ")
+        assert Cache.get_current_moves(position) == Position.get_current_moves(position)
+        assert Cache.get_moves(board, active) == tuple(
+            Position.get_moves(board, active)
+        )
+        assert Cache.is_in_check(board, active) == Position.is_in_check(board, active)
+        assert Cache.get_attacked_squares(board, active) == (
+            Position.get_attacked_squares(board, active)
+        )
+        assert Cache.get_state(board, active) == Position.check_position(
+            board + " " + active + " 0 1"
+        )
+
+
+def test_score_position_definite():
+    # The same board at different move numbers shares a cache entry, but the clocks
+    # still end the game.
+    Cache.CACHE.clear()
+    assert evaluate.score_position_definite("K.kn............ w 0 1", "b") == 100
+    assert evaluate.score_position_definite("K.kn............ w 100 9", "b") == 100
+    assert Cache.CACHE.hits["state"] == 1
+    board = "KQRBNP....pnbrqk"
+    assert evaluate.score_position_definite(board + " w 0 1", "w") is None
+    assert evaluate.score_position_definite(board + " w 100 51", "w") == 0
+    assert evaluate.score_position_definite(board + " w 0 150", "w") == 0
+
+
+def test_mirror():
+    # A board and its mirror share an entry, and give the same values once mirrored
+    # back.
+    board_cache = Cache.CACHE
+    board_cache.clear()
+    board_cache.mirror = True
+    try:
+        for board in ["KQRBNP....pnbrqk", "K.kn............", "QK.k.....b.....r"]:
+            for active in ["w", "b"]:
+                assert sorted(Cache.get_moves(board, active)) == sorted(
+                    Position.get_moves(board, active)
+                )
+                assert Cache.is_in_check(board, active) == Position.is_in_check(
+                    board, active
+                )
+                assert Cache.get_attacked_squares(board, active) == (
+                    Position.get_attacked_squares(board, active)
+                )
+                assert Cache.get_state(board, active) == Position.check_position(
+                    board + " " + active + " 0 1"
+                )
+                assert evaluate.score_position_estimate(
+                    board + " " + active + " 0 1", active
+                ) == evaluate.score_board_estimate(board, active)
+        stats = board_cache.stats()
+        assert stats["kinds"]["moves"]["misses"] == 5  # the start is its own mirror.
+        assert all(key[2] == "w" for key in board_cache.entries)
+    finally:
+        board_cache.mirror = False
+        board_cache.clear()
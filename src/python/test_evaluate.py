@@ -0,0 +1,376 @@
+import evaluate
+import json
+import position as Position
+import tablebase as Tablebase
+import threading
+import transposition as Transposition
+from collections import Counter
+
+# Positions to search, with the depth to search them to.
+SEARCH_TESTS = [
+    ("K....n.........k b 0 1", 6),
+    ("K.....nbP......k w 0 1", 5),
+    ("KQRB..NP.p.nbrqk b 0 1", 4),
+    ("KQRBNP....pnbrqk w 0 1", 5),
+    ("KQRBN.P.pn..brqk w 0 1", 4),
+]
+
+
+def test_transposition_table():
+    table = Transposition.TranspositionTable(entries=1000)
+    assert table.size == 512
+    assert table.probe(12345) is None
+    table.store(12345, 4, -7, Transposition.BOUND_LOWER, (3, 5))
+    assert table.probe(12345) == (4, -7, Transposition.BOUND_LOWER, (3, 5))
+    table.store(12345 + 512, 2, 1, Transposition.BOUND_EXACT)  # same slot, shallower.
+    assert table.probe(12345 + 512) is None
+    table.new_search()
+    table.store(12345 + 512, 2, 1, Transposition.BOUND_EXACT)  # older entry replaced.
+    assert table.probe(12345 + 512) == (2, 1, Transposition.BOUND_EXACT, None)
+    assert table.probe(12345) is None
+    assert Transposition.TranspositionTable(megabytes=1).size == 65536
+
+
+def test_score_position_transposition_table():
+    table = Transposition.TranspositionTable(entries=4096)
+    for position, max_depth in SEARCH_TESTS:
+        score, _ = evaluate.score_position(
+            position, max_depth=max_depth, find_shortest_line=False
+        )
+        assert (
+            evaluate.score_position(
+                position,
+                max_depth=max_depth,
+                find_shortest_line=False,
+                transposition_table=table,
+            )[0]
+            == score
+        )
+    assert table.hits > 0
+
+    # Moves aren't generated at nodes cut off by the table.
+    position, max_depth = SEARCH_TESTS[3]
+    generated = []
+
+    def next_move_heuristic(position, starting_player):
+        generated.append(position)
+        return evaluate.next_move_heuristic_default(position, starting_player)
+
+    for _ in range(2):  # the second search is mostly cut off by the first.
+        generated.clear()
+        stats = evaluate.SearchStats()
+        evaluate.score_position(
+            position,
+            max_depth=max_depth,
+            next_move_heuristic=next_move_heuristic,
+            find_shortest_line=False,
+            transposition_table=table,
+            stats=stats,
+        )
+    assert stats.tt_cutoffs > 0
+    assert len(generated) == (
+        stats.nodes - stats.terminal - stats.horizon - stats.tt_cutoffs
+    )
+
+
+def test_score_position_mirror():
+    # A position and its mirror have the same score for the player to move (though the
+    # line may differ between moves that tie, as moves are generated in mirrored order).
+    # Scores are the same when the table stores positions by their mirror.
+    table = Transposition.TranspositionTable(entries=4096, mirror=True)
+    for position, max_depth in SEARCH_TESTS:
+        score, line = evaluate.score_position(position, max_depth=max_depth)
+        mirrored = Position.mirror_position(position)
+        mirrored_score, mirrored_line = evaluate.score_position(
+            mirrored, max_depth=max_depth
+        )
+        assert mirrored_score == score and len(mirrored_line) == len(line)
+        for position in [position, mirrored]:
+            assert (
+                evaluate.score_position(
+                    position,
+                    max_depth=max_depth,
+                    find_shortest_line=False,
+                    transposition_table=table,
+                )[0]
+                == score
+            )
+    assert table.hits > 0
+
+
+def test_move_ordering():
+    ordering = evaluate.MoveOrdering()
+    board = "nkr...R.B....Kb."
+    moves = Position.get_moves(board, "w")
+    assert ordering.order_moves(board, "w", moves, 0) == [
+        (6, 2),  # captures, by most valuable victim and then least valuable attacker.
+        (8, 14),
+        (13, 14),
+        (6, 5),  # then quiet moves, in the order they were generated.
+        (6, 4),
+        (6, 3),
+        (6, 7),
+        (8, 10),
+        (8, 12),
+    ]
+    ordering.record_cutoff(board, "w", (8, 12), 0, 3)
+    ordering.record_cutoff(board, "w", (6, 7), 1, 2)
+    ordering.record_cutoff(board, "w", (6, 2), 0, 2)  # captures aren't recorded.
+    assert ordering.order_moves(board, "w", moves, 0, hash_move=(6, 3))[:5] == [
+        (6, 3),  # hash move.
+        (6, 2),
+        (8, 14),
+        (13, 14),
+        (8, 12),  # killer move.
+    ]
+    assert ordering.order_moves(board, "w", moves, 2)[3:5] == [(8, 12), (6, 7)]
+    assert ordering.history == {("w", 8, 12): 9, ("w", 6, 7): 4}
+    ordering.new_search()
+    assert ordering.history == {("w", 8, 12): 4, ("w", 6, 7): 2}
+
+    # Ordering doesn't change scores, but searches fewer nodes overall.
+    stats, ordered_stats = evaluate.SearchStats(), evaluate.SearchStats()
+    for position, max_depth in SEARCH_TESTS:
+        score, _ = evaluate.score_position(
+            position, max_depth=max_depth, find_shortest_line=False, stats=stats
+        )
+        assert (
+            evaluate.score_position(
+                position,
+                max_depth=max_depth,
+                find_shortest_line=False,
+                stats=ordered_stats,
+                move_ordering=evaluate.MoveOrdering(),
+            )[0]
+            == score
+        )
+    assert ordered_stats.nodes < stats.nodes / 2
+
+
+def test_score_position_quiescence():
+    # Taking the rook loses the queen to the pawn, which only quiescence sees.
+    position = "K...Q.rp.......k w 0 1"
+    assert evaluate.score_position(position, max_depth=1) == (8, [(4, 6)])
+    stats = evaluate.SearchStats()
+    score, moves = evaluate.score_position(
+        position, max_depth=1, quiescence=True, stats=stats
+    )
+    assert score == -1 and moves != [(4, 6)] and len(moves) == 1
+    assert stats.quiescence_nodes > 0
+    # Checks are followed past the horizon, so forced wins are found sooner.
+    position = "KQRB..NP.p.nbrqk b 0 1"
+    assert evaluate.score_position(position, max_depth=4)[0] < evaluate.SCORE_WIN
+    assert (
+        evaluate.score_position(position, max_depth=4, quiescence=True)[0]
+        == evaluate.score_position(position, max_depth=7)[0]
+        == evaluate.SCORE_WIN
+    )
+
+
+def test_score_position_pvs():
+    for position, max_depth in SEARCH_TESTS:
+        score, _ = evaluate.score_position(
+            position, max_depth=max_depth, find_shortest_line=False
+        )
+        assert (
+            evaluate.score_position(
+                position,
+                max_depth=max_depth,
+                find_shortest_line=False,
+                transposition_table=Transposition.TranspositionTable(entries=4096),
+                move_ordering=evaluate.MoveOrdering(),
+                pvs=True,
+            )[0]
+            == score
+        )
+
+
+def test_score_position_iterative_aspiration():
+    position = "KQR.BN.Ppnb..rqk w 0 3"
+    score, _, _ = evaluate.score_position_iterative(position, max_depth=7)
+    _, _, iterations = evaluate.score_position_iterative(
+        position,
+        max_depth=7,
+        pvs=True,
+        aspiration_window=1,
+        transposition_table=Transposition.TranspositionTable(entries=1 << 14),
+    )
+    assert iterations[-1]["score"] == score
+    assert sum(iteration["researches"] for iteration in iterations) > 0
+
+    # A forced win found without finding the shortest line can be refined afterwards.
+    for position in ["KQRB..NP.p.nbrqk b 0 1", "KQRBN.P.pn..brqk w 0 1"]:
+        expected = evaluate.score_position_iterative(position, find_shortest_line=True)
+        score, movelist, iterations = evaluate.score_position_iterative(
+            position, move_ordering=evaluate.MoveOrdering(), refine_shortest_line=True
+        )
+        assert score == expected[0] == evaluate.SCORE_WIN
+        assert movelist == expected[1] == iterations[-1]["movelist"]
+        assert len(movelist) < iterations[-1]["depth"]
+
+
+def test_score_position_line():
+    for position, max_depth in SEARCH_TESTS:
+        for find_shortest_line in [False, True]:
+            score, moves = evaluate.score_position(
+                position, max_depth=max_depth, find_shortest_line=find_shortest_line
+            )
+            assert len(moves) <= max_depth
+            for move in moves:  # the line must be playable.
+                assert move in Position.get_current_moves(position)
+                position = Position.apply_move(position, move)
+            if len(moves) < max_depth:  # lines only end early if the game is over.
+                assert Position.check_position(position)[0] is not None
+
+
+def test_score_position_repetition():
+    position = "K.......n......k w 0 1"
+    assert evaluate.score_position(
+        position,
+        max_depth=4,
+        movelist=[(1, 0)],
+        seen_boards=Counter({position[:16]: 3}),
+    ) == (evaluate.SCORE_DRAW, [(1, 0)])
+    # White's only move repeats a board for the third time.
+    assert evaluate.score_position(
+        position,
+        max_depth=4,
+        max_depth_heuristic=lambda position, player: 1,
+        seen_boards=Counter({".K......n......k": 3}),
+    ) == (evaluate.SCORE_DRAW, [(0, 1)])
+
+
+def test_score_position_iterative_game():
+    # Boards seen earlier in the game count towards repetition.
+    score, moves, _ = evaluate.score_position_iterative(
+        "K.......n......k w 0 1",
+        max_depth=4,
+        max_depth_heuristic=lambda position, player: 1,
+        seen_boards=Counter({".K......n......k": 3}),
+    )
+    assert (score, moves[:1]) == (evaluate.SCORE_DRAW, [(0, 1)])
+
+    # A stopped search only completes the first depth.
+    stop_event = threading.Event()
+    stop_event.set()
+    _, moves, iterations = evaluate.score_position_iterative(
+        Position.START_POSITION, stop_event=stop_event
+    )
+    assert len(iterations) == 1 and moves
+
+    # The root is searched even if the table already has its result, so that there is
+    # always a line.
+    table = Transposition.TranspositionTable(entries=1 << 14)
+    for _ in range(2):
+        _, moves, _ = evaluate.score_position_iterative(
+            Position.START_POSITION, max_depth=4, transposition_table=table
+        )
+        assert moves
+
+
+def test_score_position_iterative():
+    position = "KQRB..NP.p.nbrqk b 0 1"
+    score, moves, iterations = evaluate.score_position_iterative(position, max_depth=4)
+    assert [iteration["depth"] for iteration in iterations] == [1, 2, 3, 4]
+    assert score == evaluate.score_position(position, max_depth=4)[0]
+    # A forced win ends the search early.
+    score, moves, iterations = evaluate.score_position_iterative(
+        "K....n.........k b 0 1"
+    )
+    assert score == evaluate.SCORE_WIN and len(iterations) == 1
+    # The node budget stops the search, and the first depth is always completed.
+    score, moves, iterations = evaluate.score_position_iterative(
+        Position.START_POSITION, node_limit=500
+    )
+    assert sum(iteration["nodes"] for iteration in iterations) <= 500
+    score, moves, iterations = evaluate.score_position_iterative(
+        Position.START_POSITION, node_limit=1
+    )
+    assert len(iterations) == 1 and len(moves) == 1
+
+
+def test_search_stats(tmp_path):
+    position = "KQRB..NP.p.nbrqk b 0 1"
+    stats = evaluate.SearchStats()
+    result = evaluate.score_position(
+        position, max_depth=4, find_shortest_line=False, stats=stats
+    )
+    assert result == evaluate.score_position(
+        position, max_depth=4, find_shortest_line=False
+    )  # counting doesn't change the search.
+    assert stats.searches == 1 and stats.nodes == sum(stats.nodes_by_ply)
+    assert stats.nodes_by_ply[0] == 1 and len(stats.nodes_by_ply) == 5
+    assert 0 < stats.first_move_cutoffs <= stats.cutoffs
+    assert stats.horizon > 0 and stats.tt_probes == 0
+    assert stats.summary().startswith("Time taken: ")
+    stats.to_json(str(tmp_path / "stats.json"))
+    with open(tmp_path / "stats.json") as f:
+        data = json.load(f)
+    assert data["nodes"] == stats.nodes
+    assert data["caches"]["state"]["hits"] > 0
+
+    # Iterative deepening records each depth, and the records add up to the totals.
+    stats = evaluate.SearchStats()
+    _, _, iterations = evaluate.score_position_iterative(
+        position,
+        max_depth=4,
+        transposition_table=Transposition.TranspositionTable(entries=1 << 12),
+        stats=stats,
+    )
+    assert [depth["depth"] for depth in stats.depths] == [1, 2, 3, 4]
+    assert [depth["nodes"] for depth in stats.depths] == [
+        iteration["nodes"] for iteration in iterations
+    ]
+    assert sum(depth["tt_hits"] for depth in stats.depths) == stats.tt_hits > 0
+    assert json.loads(stats.to_json())["depths"][3]["depth"] == 4
+
+
+def test_score_position_tablebases(tmp_path):
+    Tablebase.generate(["Kk+Np"], str(tmp_path), verbose=False)
+    tablebases = Tablebase.Tablebases(str(tmp_path))
+    position = "Kp.k.....N...... w 0 1"  # white mates in 7 ply.
+    expected = evaluate.score_position(position, max_depth=9)
+    score, movelist = evaluate.score_position(position, tablebases=tablebases)
+    assert score == expected[0] == evaluate.SCORE_WIN
+    assert len(movelist) == len(expected[1]) == 7
+    assert tablebases.hits == 1  # found at the root, so nothing was searched.
+    late = "Kp.k.....N...... w 0 148"  # mate would come after 150 fullmoves.
+    assert evaluate.score_position(late, tablebases=tablebases)[0] == 0
+
+
+def test_score_position_tablebases_draw(tmp_path):
+    # A drawn probe below the root has no line, which shouldn't shorten the line that
+    # siblings at the same ply write into.
+    Tablebase.generate(["Kk+Nn"], str(tmp_path), verbose=False)
+    tablebases = Tablebase.Tablebases(str(tmp_path))
+    position = "K..N.p....n....k w 0 1"
+    score, movelist = evaluate.score_position(
+        position, max_depth=3, tablebases=tablebases, find_shortest_line=False
+    )
+    assert tablebases.hits > 0
+    assert (
+        score
+        == evaluate.score_position(position, max_depth=3, find_shortest_line=False)[0]
+    )
+    assert movelist and movelist[0] in Position.get_current_moves(position)
+
+
+def test_score_position_parallel():
+    for position, max_depth in SEARCH_TESTS[:3]:
+        for find_shortest_line in [False, True]:
+            expected = evaluate.score_position(
+                position, max_depth=max_depth, find_shortest_line=find_shortest_line
+            )
+            results = [
+                evaluate.score_position_parallel(
+                    position,
+                    workers=workers,
+                    split_depth=split_depth,
+                    max_depth=max_depth,
+                    find_shortest_line=find_shortest_line,
+                )
+                for workers in [1, 2]
+                for split_depth in [1, 2]
+            ]
+            assert results[0][0] == expected[0]
+            assert all(result == results[0] for result in results)
@@ -0,0 +1,66 @@
+import lookup_tables as LookupTables
+
+
+def test_slider_tables_example():
+    # The example from test.ipynb: a queen on square 5 of "K..N.Q....rn...k".
+    occupancy = 0b1001010000110001
+    key = (5 << LookupTables.BOARD_SIZE) | occupancy
+    assert LookupTables.ROOK_ATTACKS[key] == 7136
+    assert LookupTables.BISHOP_ATTACKS[key] == 4432
+
+
+def test_slider_tables():
+    for square in range(LookupTables.BOARD_SIZE):
+        for occupancy in range(0, LookupTables.NUM_OCCUPANCIES, 257):
+            key = (square << LookupTables.BOARD_SIZE) | occupancy
+            for table, increments in [
+                (LookupTables.ROOK_ATTACKS, LookupTables.ROOK_INCREMENTS),
+                (LookupTables.BISHOP_ATTACKS, LookupTables.BISHOP_INCREMENTS),
+            ]:
+                assert table[key] == sum(
+                    LookupTables.get_ray_attacks(square, increment, occupancy)
+                    for increment in increments
+                )
+
+
+def test_step_masks():
+    assert LookupTables.KING_MASKS[0] == 0b0100000000000000
+    assert LookupTables.KING_MASKS[15] == 0b0000000000000010
+    assert LookupTables.KNIGHT_MASKS[3] == 0b1100011000000000
+    assert LookupTables.PAWN_WHITE_MASKS[15] == 0
+    assert LookupTables.PAWN_BLACK_MASKS[0] == 0
+
+
+def test_table_file(tmp_path):
+    path = str(tmp_path / "attacks.bin")
+    LookupTables.write_table_file(path)
+    lookup = LookupTables.load_table_file(path)
+    block = LookupTables.TABLE_BLOCK
+    for square in range(LookupTables.BOARD_SIZE):
+        for occupancy in range(0, LookupTables.NUM_OCCUPANCIES, 4099):
+            key = (square << LookupTables.BOARD_SIZE) | occupancy
+            rook = LookupTables.ROOK_ATTACKS[key]
+            bishop = LookupTables.BISHOP_ATTACKS[key]
+            assert lookup[LookupTables.NIBBLE_ROOK * block + key] == rook
+            assert lookup[LookupTables.NIBBLE_BISHOP * block + key] == bishop
+            assert lookup[LookupTables.NIBBLE_QUEEN * block + key] == rook | bishop
+            assert lookup[LookupTables.NIBBLE_KNIGHT * block + key] == (
+                LookupTables.KNIGHT_MASKS[square]
+            )
+            assert lookup[
+                (LookupTables.NIBBLE_PAWN | LookupTables.NIBBLE_BLACK) * block + key
+            ] == (LookupTables.PAWN_BLACK_MASKS[square])
+
+
+def test_table_file_checksum(tmp_path):
+    path = str(tmp_path / "attacks.bin")
+    LookupTables.write_table_file(path)
+    with open(path, "r+b") as f:
+        f.seek(LookupTables.TABLE_HEADER.size + 12345)
+        f.write(b"\xff\xff")
+    try:
+        LookupTables.load_table_file(path)
+        assert False
+    except ValueError:
+        pass
+    LookupTables.load_table_file(path, verify=False)  # still loads unverified.
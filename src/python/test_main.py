@@ -0,0 +1,43 @@
+import main
+import pytest
+import random
+
+
+def ai_illegal(position):
+    """A player that always makes an illegal move, and so always loses."""
+    return (0, 0)
+
+
+def test_run_game_seed():
+    assert main.run_game(verbose=False, seed=3) == main.run_game(verbose=False, seed=3)
+
+
+def test_run_games():
+    serial = main.run_games(6, workers=1, base_seed=10)
+    parallel = main.run_games(6, workers=2, base_seed=10)
+    assert serial[0] == parallel[0]
+    assert sorted(serial[1]) == sorted(parallel[1])
+    assert sum(serial[0].values()) == 6 and serial[2] == {}
+
+    # The AIs are passed to the worker processes, whichever way they are started.
+    for workers in [1, 2]:
+        record, _, errors = main.run_games(
+            4, workers=workers, check_valid=True, ai_white=ai_illegal
+        )
+        assert record["b"] == 4 and errors == {}
+
+
+def test_run_games_errors(monkeypatch):
+    def ai_failing(position):
+        if random.random() < 0.02:
+            raise ValueError("failed")
+        return main.ai_greedy(position)
+
+    monkeypatch.setattr(main, "AI_WHITE", ai_failing)
+    record, game_lengths, errors = main.run_games(8, workers=1)
+    assert errors  # at least one game failed, but the rest were still run.
+    assert len(game_lengths) + len(errors) == 8
+    for seed, error in errors.items():
+        assert "ValueError: failed" in error
+        with pytest.raises(ValueError):  # the failure can be replayed with the seed.
+            main.run_game(verbose=False, seed=seed)
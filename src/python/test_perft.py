@@ -0,0 +1,20 @@
+import perft as Perft
+import position as Position
+
+
+def test_perft_suite():
+    results = Perft.run_suite(max_depth=4, verbose=False)
+    assert all(result["passed"] for result in results)
+
+
+def test_divide():
+    for name, position, expected in Perft.PERFT_TESTS:
+        for generator in Perft.GENERATORS:
+            counts = Perft.divide(position, 3, generator)
+            assert sum(counts.values()) == expected[2]
+
+
+def test_get_moves_unique():
+    # A queen can reach some squares along both a rook and a bishop ray.
+    moves = Position.get_moves("K.RQ...b.pn.r.qk", "w")
+    assert len(moves) == len(set(moves)) == 7
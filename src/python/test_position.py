@@ -76,6 +76,9 @@ def test_check_position():
         "K..........N..Pk b 39 20": ("w", "checkmate"),
         "K.qr........RQ.k w 40 20": ("b", "checkmate"),  # (???)
         "K.qr........RQ.k b 40 20": ("w", "checkmate"),  # (???)
+        "K.kn............ w 100 20": ("b", "checkmate"),  # checkmate ends it first.
+        "K.k............q w 100 20": ("d", "50-move rule"),  # drawn either way.
+        "K..k..........b. w 0 20": ("d", "insufficient material"),
     }
     for test in tests:
         assert Position.check_position(test) == tests[test]
@@ -123,8 +126,54 @@ def test_is_in_check():
 # TODO: write more test cases.
 
 
+def test_get_checks_and_pins():
+    tests = {
+        ("KQRBNP....pnbrqk", "w"): ([], {}),
+        ("KN.r...........k", "w"): ([], {1: {1, 2, 3}}),
+        ("K.R..r....q....k", "w"): ([], {2: {2, 4}}),  # pinned along both rays.
+        ("K.kn............", "w"): ([{3}], {}),
+        ("BK...q..R.p.rnk.", "w"): ([{3, 5}], {}),  # queen checks along both rays.
+        ("..nk..R...K.Q.bB", "b"): ([{4, 5, 6}, {5, 7, 9, 11, 13, 15}], {}),
+        ("................", "w"): ([], {}),
+    }
+    for test in tests:
+        assert Position.get_checks_and_pins(*test) == tests[test]
+
+
 def test_get_moves():
-    assert True
+    tests = {
+        ("KQRBNP....pnbrqk", "w"): [(4, 6), (4, 7), (5, 6), (5, 7)],
+        ("K.R..r....q....k", "w"): [(0, 1), (2, 4)],
+        ("KN.r...........k", "w"): [(1, 3)],
+        ("K.kn............", "w"): [],
+        ("..nk..R...K.Q.bB", "b"): [(2, 5)],  # one move blocks a double check.
+        (".....r.K.......k", "w"): [],  # the king can't step back along the ray.
+    }
+    for test in tests:
+        assert Position.get_moves(*test) == tests[test]
+    for board, active in _reachable_boards(5):
+        assert Position.get_moves(board, active) == Position.get_moves(
+            board, active, verify=True
+        )
+
+
+def test_has_legal_move():
+    tests = {
+        ("KQRBNP....pnbrqk", "w"): True,
+        ("K.k............q", "w"): False,
+        ("K.kn............", "w"): False,
+        ("..nk..R...K.Q.bB", "b"): True,
+        ("..nk..R...K.Q.bB", "w"): True,
+    }
+    for test in tests:
+        assert Position.has_legal_move(*test) == tests[test]
+    for board, active in _reachable_boards(5):
+        has_moves = len(Position.get_moves(board, active)) > 0
+        assert Position.has_legal_move(board, active) == has_moves
+        assert (
+            Position.has_legal_move_bits(Position.board_to_bits(board), active)
+            == has_moves
+        )
 
 
 def test_get_current_moves():
@@ -136,4 +185,139 @@ def test_apply_move_board():
 
 
 def test_apply_move():
-    assert True
\ No newline at end of file
+    assert True
+
+
+def _reachable_boards(max_depth):
+    """Helper to collect all (board, active) pairs reachable from the start position
+    within the given number of halfmoves."""
+    states = {(Position.START_POSITION.split(" ")[0], "w")}
+    level = set(states)
+    for _ in range(max_depth):
+        level = {
+            (Position.apply_move_board(board, move), Position.opposite_color(active))
+            for (board, active) in level
+            for move in Position.get_moves(board, active)
+        }
+        states.update(level)
+    return states
+
+
+def test_mirror():
+    assert Position.mirror_position(Position.START_POSITION) == (
+        "KQRBNP....pnbrqk b 0 1"
+    )
+    assert Position.mirror_board("K..N....p....r.k") == "K.R....P....n..k"
+    assert Position.mirror_move((5, 7)) == (10, 8)
+    assert Position.canonicalize("K..N....p....r.k", "b") == (
+        "K.R....P....n..k",
+        "w",
+        True,
+    )
+    assert Position.canonicalize("K..N....p....r.k", "w") == (
+        "K..N....p....r.k",
+        "w",
+        False,
+    )
+
+    # Moves and results should map onto the mirror.
+    winners = {"w": "b", "b": "w", "d": "d", None: None}
+    for board, active in list(_reachable_boards(4)) + [("K.kn............", "w")]:
+        mirrored = Position.mirror_board(board)
+        opponent = Position.opposite_color(active)
+        assert Position.mirror_board(mirrored) == board
+        assert sorted(map(Position.mirror_move, Position.get_moves(board, active))) == (
+            sorted(Position.get_moves(mirrored, opponent))
+        )
+        winner, reason = Position.check_position(board + " " + active + " 0 1")
+        assert Position.check_position(mirrored + " " + opponent + " 0 1") == (
+            winners[winner],
+            reason,
+        )
+        bits = Position.board_to_bits(board)
+        assert Position.mirror_bits(bits) == Position.board_to_bits(mirrored)
+        assert Position.canonicalize_bits(bits, active) == (
+            (Position.board_to_bits(mirrored), "w", True)
+            if active == "b"
+            else (bits, "w", False)
+        )
+
+
+def test_board_to_bits():
+    assert Position.board_to_bits("KQRBNP....pnbrqk") == Position.START_BOARD
+    assert Position.bits_to_board(Position.START_BOARD) == "KQRBNP....pnbrqk"
+    for board, _ in _reachable_boards(3):
+        assert Position.bits_to_board(Position.board_to_bits(board)) == board
+
+
+def test_position_to_vars():
+    tests = [
+        "KQRBNP....pnbrqk w 0 1",
+        "K.qr........RQ.k b 40 20",
+        "................ w 99 150",
+    ]
+    for test in tests:
+        assert Position.vars_to_position(*Position.position_to_vars(test)) == test
+
+
+def test_get_occupancy_bits():
+    bits = Position.START_BOARD
+    assert Position.get_occupancy_bits(bits) == 0b1111110000111111
+    assert Position.get_player_occupancy_bits(bits, "w") == 0b1111110000000000
+    assert Position.get_player_occupancy_bits(bits, "b") == 0b0000000000111111
+
+
+def test_get_attacked_squares_bits():
+    for board, _ in _reachable_boards(4):
+        bits = Position.board_to_bits(board)
+        for player in ["w", "b"]:
+            attacked = Position.get_attacked_squares_bits(bits, player)
+            assert set(Position.squares_from_mask(attacked)) == (
+                Position.get_attacked_squares(board, player)
+            )
+            assert Position.is_in_check_bits(bits, player) == (
+                Position.is_in_check(board, player)
+            )
+
+
+def test_get_moves_bits():
+    for board, active in _reachable_boards(5):
+        assert sorted(
+            Position.get_moves_bits(Position.board_to_bits(board), active)
+        ) == sorted(Position.get_moves(board, active))
+
+
+def test_check_position_vars():
+    tests = [
+        "KQRBNP....pnbrqk w 100 51",
+        "K.k............q w 39 20",
+        "K.kn............ w 39 20",
+        "K..........N..Pk b 39 20",
+        "K.qr........RQ.k w 40 20",
+        "K.kn............ w 100 20",
+        "K.k............q w 100 20",
+        "K..k..........b. w 0 20",
+        "K.b............k b 0 150",
+        "K.b............k b 0 1",
+    ]
+    for test in tests:
+        assert Position.check_position_vars(
+            *Position.position_to_vars(test)
+        ) == Position.check_position(test)
+
+
+def test_zobrist_hash():
+    hashes = set()
+    for board, active in _reachable_boards(4):
+        bits = Position.board_to_bits(board)
+        key = Position.zobrist_hash(board, active)
+        assert key == Position.zobrist_hash_bits(bits, active)
+        for move in Position.get_moves(board, active):
+            assert Position.zobrist_update_bits(key, bits, move) == (
+                Position.zobrist_hash(
+                    Position.apply_move_board(board, move),
+                    Position.opposite_color(active),
+                )
+            )
+        hashes.add(key)
+    assert len(hashes) == len(_reachable_boards(4))
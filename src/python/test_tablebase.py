@@ -0,0 +1,128 @@
+import os
+import position as Position
+import pytest
+import tablebase as Tablebase
+
+
+def _probe(solved, position):
+    """Look up a position string in a dict of solved tables."""
+    bits, active, _, _ = Position.position_to_vars(position)
+    signature = Tablebase.get_signature_bits(bits)
+    pieces = Tablebase.parse_signature(signature)
+    index = Tablebase.get_index(pieces, bits, active)
+    return Tablebase.decode_value(solved[signature][index])
+
+
+def test_signatures():
+    assert Tablebase.parse_signature("Kk+pb") == ("K", "k", "b", "p")
+    assert Tablebase.format_signature(["p", "k", "K", "R"]) == "Kk+Rp"
+    assert Tablebase.format_signature(["K", "k"]) == "Kk"
+    assert Tablebase.get_table_file("Kk+bp", "dir").endswith("K_KBP.tb")
+    for signature in ["kK", "Kk+pp", "Kk+QRBN", "Kk+x"]:
+        with pytest.raises(ValueError):
+            Tablebase.parse_signature(signature)
+
+
+def test_solve_known_positions():
+    solved = {}
+    Tablebase.solve("Kk+Np", solved)
+    assert _probe(solved, "Kpk...N......... w 0 1") == (-1, 0)  # checkmate.
+    assert _probe(solved, "Kp.k.....N...... w 0 1") == (1, 7)
+    assert _probe(solved, "K.........k..... w 0 1") == (0, None)
+    assert all(  # insufficient material.
+        value in (Tablebase.VALUE_ILLEGAL, Tablebase.VALUE_DRAW)
+        for value in solved["Kk"]
+    )
+
+
+def test_solve_consistent():
+    # Every position's value should follow from the values after each of its moves.
+    solved = {}
+    for signature in ["Kk+n", "Kk+Np"]:
+        values = Tablebase.solve(signature, solved)
+        for index, bits, active in Tablebase.enumerate_positions(
+            Tablebase.parse_signature(signature)
+        ):
+            moves = Position.get_moves_bits(bits, active)
+            if not moves:
+                continue
+            results = []
+            for move in moves:
+                next_bits = Position.apply_move_bits(bits, move)
+                next_signature = Tablebase.get_signature_bits(next_bits)
+                next_index = Tablebase.get_index(
+                    Tablebase.parse_signature(next_signature),
+                    next_bits,
+                    Position.opposite_color(active),
+                )
+                results.append(
+                    Tablebase.decode_value(solved[next_signature][next_index])
+                )
+            losses = [dtm for result, dtm in results if result == -1]
+            if losses:
+                expected = (1, min(losses) + 1)
+            elif all(result == 1 for result, _ in results):
+                expected = (-1, max(dtm for _, dtm in results) + 1)
+            else:
+                expected = (0, None)
+            assert Tablebase.decode_value(values[index]) == expected
+
+
+def test_table_file(tmp_path):
+    Tablebase.generate(["Kk+n"], str(tmp_path), verbose=False)
+    path = Tablebase.get_table_file("Kk+n", str(tmp_path))
+    signature, values = Tablebase.read_table(path)
+    assert signature == "Kk+n"
+    assert values == Tablebase.solve("Kk+n", directory=str(tmp_path)).tobytes()
+    assert (tmp_path / "K_K.tb").exists()  # captured down to.
+    with open(path, "r+b") as f:
+        f.seek(Tablebase.TABLE_HEADER.size + 100)
+        f.write(b"\xff")
+    with pytest.raises(ValueError):
+        Tablebase.read_table(path)
+
+
+def test_tablebases_probe(tmp_path):
+    Tablebase.generate(["Kk+Np"], str(tmp_path), verbose=False)
+    tablebases = Tablebase.Tablebases(str(tmp_path), max_tables=1)
+    position = "Kp.k.....N...... w 0 1"
+    assert tablebases.probe(position) == (1, 7)
+    assert tablebases.probe("K.........k..... w 0 1") == (0, None)
+    assert tablebases.probe("K.......r.q....k w 0 1") is None  # no table.
+    assert tablebases.stats()["loads"] == 2
+    assert tablebases.stats()["evictions"] == 1
+    assert tablebases.stats()["missing"] == 1
+    assert tablebases.hits == 2 and tablebases.probes == 3
+
+    # The line should be the given length and end in checkmate.
+    bits, active, _, _ = Position.position_to_vars(position)
+    line = tablebases.probe_line(bits, active)
+    assert line[0] == tablebases.best_move(position)
+    assert len(line) == 7
+    for move in line:
+        position = Position.apply_move(position, move)
+    assert Position.check_position(position) == ("w", "checkmate")
+
+
+def test_mirror(tmp_path):
+    assert Tablebase.mirror_signature("Kk+Np") == "Kk+Pn"
+    assert Tablebase.mirror_signature("Kk+Bb") == "Kk+Bb"
+    assert Tablebase.get_canonical_signature("Kk+pN") == "Kk+Np"
+    assert Tablebase.get_canonical_signature("Kk+p") == "Kk+P"
+
+    # Only the canonical table of each pair is written, and the other is probed
+    # through it with the same results.
+    directory = str(tmp_path)
+    Tablebase.generate(["Kk+Pn"], directory, verbose=False, mirror=True)
+    assert sorted(os.listdir(directory)) == ["KN_K.tb", "KN_KP.tb", "KP_K.tb", "K_K.tb"]
+    tablebases = Tablebase.Tablebases(directory, mirror=True)
+    solved = {}
+    for signature in ["Kk+Pn", "Kk+Np", "Kk+p"]:
+        Tablebase.solve(signature, solved)
+        for index, bits, active in Tablebase.enumerate_positions(
+            Tablebase.parse_signature(signature)
+        ):
+            assert tablebases.probe_bits(bits, active) == (
+                Tablebase.decode_value(solved[signature][index])
+            )
+    assert Tablebase.Tablebases(directory).probe("K.P........n...k w 0 1") is None
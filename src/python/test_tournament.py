@@ -0,0 +1,78 @@
+import functools
+import ai_random
+import math
+import tournament as Tournament
+
+
+def ai_illegal(position):
+    """A player that always makes an illegal move, and so always loses."""
+    return (0, 0)
+
+
+def test_elo():
+    assert Tournament.score_to_elo(0.5) == 0
+    assert math.isclose(Tournament.score_to_elo(10 / 11), 400)
+    assert math.isclose(Tournament.elo_to_score(Tournament.score_to_elo(0.3)), 0.3)
+    elo, error = Tournament.get_elo(30, 40, 30)
+    assert elo == 0 and 0 < error < 100
+    assert Tournament.get_elo(60, 0, 40)[0] > 0
+    assert Tournament.get_elo(600, 0, 400)[1] < Tournament.get_elo(60, 0, 40)[1]
+
+
+def test_sprt():
+    lower, upper = Tournament.get_sprt_bounds(0.05, 0.05)
+    assert math.isclose(lower, -upper) and upper > 0
+    assert Tournament.get_llr(60, 20, 20, 0, 10) > 0
+    assert Tournament.get_llr(20, 20, 60, 0, 10) < 0
+    assert Tournament.get_llr(10, 0, 0, 0, 10) > 0  # no variance, but still counts.
+
+
+def test_play_match():
+    match = Tournament.play_match(
+        ai_random.move,
+        ai_illegal,
+        num_games=1000,
+        sprt=Tournament.DEFAULT_SPRT,
+        verbose=False,
+    )
+    assert match["hypothesis"] == "H1"
+    assert match["games"] < 1000  # stopped early.
+    assert match["wins"] == match["games"]
+    assert match["elo"] == math.inf
+
+
+def test_round_robin():
+    standings = Tournament.round_robin(
+        [ai_random.move, ai_illegal],
+        rounds=2,
+        openings=["KQRBNP....pnbrqk w 0 1", "KQRB.NP..pnbrq.k b 0 1"],
+        verbose=False,
+    )
+    assert standings["ai_random.move"] == {
+        "points": 8,
+        "games": 8,
+        "elo": math.inf,
+        "error": math.inf,
+    }
+    assert standings["test_tournament.ai_illegal"]["points"] == 0
+
+
+def test_round_robin_same_player():
+    # Two instances of the same player have the same name, but separate records.
+    class Player:
+        def __init__(self, legal):
+            self.legal = legal
+
+        def move(self, position):
+            return ai_random.move(position) if self.legal else ai_illegal(position)
+
+    standings = Tournament.round_robin(
+        [Player(True).move, Player(False).move, functools.partial(ai_illegal)],
+        verbose=False,
+    )
+    assert len(standings) == 3
+    assert standings["test_tournament.move #1"]["points"] == 4
+    # The illegal players only win as black against each other.
+    assert standings["test_tournament.move #2"]["points"] == 1
+    assert sum(standings[name]["games"] for name in standings) == 12
+    assert any(name.startswith("functools.partial") for name in standings)
@@ -0,0 +1,267 @@
+# Tournaments between AI players.
+#
+# A player is any function that takes a position and returns a move, like the move
+# functions of ai_random.py and ai_greedy.py. Games are played with main.run_game, with
+# illegal moves forfeiting the game, and every game is seeded (see main.run_games) so
+# that it can be replayed.
+#
+# Results are reported as Elo differences with 95% error bars, from the fraction of
+# points scored (a win is 1 point and a draw is half a point). A match between two
+# players can also be stopped early with a sequential probability ratio test (SPRT):
+# after every pair of games, the log-likelihood ratio (LLR) of "player A is elo1
+# stronger than player B" against "player A is elo0 stronger" is compared with bounds
+# set by the acceptable error rates, and the match stops as soon as it crosses one. The
+# LLR uses the normal approximation of the generalized SPRT, as chess engine testing
+# frameworks do.
+
+from collections import Counter
+import main
+import math
+import position as Position
+
+ELO_SCALE = 400  # Elo points for a 10:1 odds ratio.
+CONFIDENCE_Z = 1.959964  # z-score of a two-sided 95% confidence interval.
+DEFAULT_SPRT = (0, 10, 0.05, 0.05)  # elo0, elo1, alpha, beta.
+MIN_VARIANCE = 0.01  # floor on the per-game score variance used by the SPRT.
+
+
+def get_player_name(player):
+    """Return a readable name for a player function, or its repr if it has no name
+    (e.g. a functools.partial or a callable instance)."""
+    name = getattr(player, "__name__", None)
+    if name is None:
+        return repr(player)
+    return "{}.{}".format(getattr(player, "__module__", None) or "?", name)
+
+
+def get_player_names(players, names=None):
+    """Return distinct display names for players, from names if given. Players that
+    would share a name (e.g. the move methods of two instances of the same class) are
+    numbered by their position in the list."""
+    names = list(names) if names is not None else [get_player_name(p) for p in players]
+    counts = Counter(names)
+    return [
+        name if counts[name] == 1 else "{} #{}".format(name, i + 1)
+        for i, name in enumerate(names)
+    ]
+
+
+def score_to_elo(score):
+    """Convert a fraction of points scored into an Elo difference."""
+    if score <= 0:
+        return -math.inf
+    elif score >= 1:
+        return math.inf
+    return -ELO_SCALE * math.log10(1 / score - 1)
+
+
+def elo_to_score(elo):
+    """Convert an Elo difference into the expected fraction of points scored."""
+    return 1 / (1 + 10 ** (-elo / ELO_SCALE))
+
+
+def _get_score_stats(wins, draws, losses):
+    """Return the mean and variance of the points scored per game."""
+    games = wins + draws + losses
+    mean = (wins + draws / 2) / games
+    variance = (
+        wins * (1 - mean) ** 2 + draws * (0.5 - mean) ** 2 + losses * mean**2
+    ) / games
+    return mean, variance
+
+
+def get_elo(wins, draws, losses):
+    """Return a tuple of (Elo difference, error) from a record, where the 95% confidence
+    interval is roughly the difference plus or minus the error."""
+    games = wins + draws + losses
+    if games == 0:
+        return 0.0, math.inf
+    mean, variance = _get_score_stats(wins, draws, losses)
+    if not 0 < mean < 1:  # all wins or all losses; the difference is unbounded.
+        return score_to_elo(mean), math.inf
+    margin = CONFIDENCE_Z * math.sqrt(variance / games)
+    error = (score_to_elo(mean + margin) - score_to_elo(mean - margin)) / 2
+    return score_to_elo(mean), error
+
+
+def get_llr(wins, draws, losses, elo0, elo1):
+    """Return the log-likelihood ratio of the Elo difference being elo1 rather than
+    elo0, given a record."""
+    games = wins + draws + losses
+    if games == 0:
+        return 0.0
+    mean, variance = _get_score_stats(wins, draws, losses)
+    variance = max(variance, MIN_VARIANCE)  # so that identical results still count.
+    score0, score1 = elo_to_score(elo0), elo_to_score(elo1)
+    return (score1 - score0) * (2 * mean - score0 - score1) * games / (2 * variance)
+
+
+def get_sprt_bounds(alpha, beta):
+    """Return the (lower, upper) LLR bounds of an SPRT with the given false positive
+    (alpha) and false negative (beta) rates."""
+    return math.log(beta / (1 - alpha)), math.log((1 - beta) / alpha)
+
+
+def play_game(white, black, position=Position.START_POSITION, seed=None):
+    """Play a single game between two players, and return its result ("w", "b" or "d")
+    and length in fullmoves. A player that makes an illegal move loses."""
+    state, game_length = main.run_game(
+        verbose=False,
+        check_valid=True,
+        seed=seed,
+        ai_white=white,
+        ai_black=black,
+        position=position,
+    )
+    return state[0], game_length
+
+
+def play_match(
+    player_a,
+    player_b,
+    num_games=1000,  # maximum number of games to play.
+    openings=None,  # positions to start games from; defaults to the starting position.
+    sprt=None,  # optional (elo0, elo1, alpha, beta) to stop early with an SPRT.
+    base_seed=0,  # game n is seeded with base_seed + n.
+    verbose=True,
+    names=None,  # optional display names of the two players.
+):
+    """Play a match between two players, in pairs of games from each opening with each
+    player taking white once. If sprt is given, the match stops as soon as the SPRT
+    accepts a hypothesis. Returns a dict of the record from player A's perspective, the
+    Elo difference and its error, and the LLR and the accepted hypothesis ("H1" if
+    player A is at least elo1 stronger, "H0" if at most elo0, or None) if using SPRT."""
+    openings = openings or [Position.START_POSITION]
+    names = get_player_names([player_a, player_b], names)
+    record = Counter()
+    game_lengths = []
+    llr, hypothesis = None, None
+    if sprt is not None:
+        elo0, elo1, alpha, beta = sprt
+        lower, upper = get_sprt_bounds(alpha, beta)
+
+    num_played = 0
+    while num_played < num_games and hypothesis is None:
+        opening = openings[(num_played // 2) % len(openings)]
+        for a_is_white in [True, False]:
+            if num_played >= num_games:
+                break
+            white, black = (player_a, player_b) if a_is_white else (player_b, player_a)
+            result, game_length = play_game(
+                white, black, opening, seed=base_seed + num_played
+            )
+            num_played += 1
+            game_lengths.append(game_length)
+            if result == "d":
+                record["draws"] += 1
+            elif (result == "w") == a_is_white:
+                record["wins"] += 1
+            else:
+                record["losses"] += 1
+
+        if sprt is not None:
+            llr = get_llr(record["wins"], record["draws"], record["losses"], elo0, elo1)
+            if llr >= upper:
+                hypothesis = "H1"
+            elif llr <= lower:
+                hypothesis = "H0"
+
+    elo, error = get_elo(record["wins"], record["draws"], record["losses"])
+    match = {
+        "games": num_played,
+        "wins": record["wins"],
+        "draws": record["draws"],
+        "losses": record["losses"],
+        "elo": elo,
+        "error": error,
+        "llr": llr,
+        "hypothesis": hypothesis,
+        "game_lengths": game_lengths,
+    }
+    if verbose:
+        print(
+            "{} vs {}: {}-{}-{} in {} games, Elo {:+.1f} +/- {:.1f}".format(
+                names[0],
+                names[1],
+                match["wins"],
+                match["losses"],
+                match["draws"],
+                num_played,
+                elo,
+                error,
+            )
+        )
+        if sprt is not None:
+            print(
+                "SPRT ({}, {}): LLR {:.2f} ({:.2f}, {:.2f}) -> {}".format(
+                    elo0, elo1, llr, lower, upper, hypothesis or "undecided"
+                )
+            )
+    return match
+
+
+def round_robin(
+    players,
+    rounds=1,  # times each pair plays each opening as each color.
+    openings=None,  # positions to start games from; defaults to the starting position.
+    base_seed=0,  # games are seeded in order, starting from base_seed.
+    verbose=True,
+    names=None,  # optional display names of the players, in order.
+):
+    """Play every pair of players against each other, with each player taking white
+    once per opening per round. Returns a dict of player name to a dict of its points,
+    games, and Elo difference (and error) against the rest of the field, and also prints
+    standings if verbose. Players with the same name are told apart as in
+    get_player_names."""
+    openings = openings or [Position.START_POSITION]
+    names = get_player_names(players, names)
+    records = [Counter() for _ in players]  # by index, so equal players don't collide.
+    seed = base_seed
+    for i in range(len(players)):
+        for j in range(i + 1, len(players)):
+            match = play_match(
+                players[i],
+                players[j],
+                num_games=2 * rounds * len(openings),
+                openings=openings,
+                base_seed=seed,
+                verbose=verbose,
+                names=[names[i], names[j]],
+            )
+            seed += match["games"]
+            for index, sign in [(i, 1), (j, -1)]:
+                record = records[index]
+                record["wins"] += match["wins" if sign > 0 else "losses"]
+                record["losses"] += match["losses" if sign > 0 else "wins"]
+                record["draws"] += match["draws"]
+
+    standings = {}
+    for name, record in zip(names, records):
+        elo, error = get_elo(record["wins"], record["draws"], record["losses"])
+        standings[name] = {
+            "points": record["wins"] + record["draws"] / 2,
+            "games": record["wins"] + record["draws"] + record["losses"],
+            "elo": elo,
+            "error": error,
+        }
+    if verbose:
+        print("Standings:")
+        for name in sorted(names, key=lambda name: -standings[name]["points"]):
+            print(
+                "{}: {}/{} points, Elo {:+.1f} +/- {:.1f}".format(
+                    name,
+                    standings[name]["points"],
+                    standings[name]["games"],
+                    standings[name]["elo"],
+                    standings[name]["error"],
+                )
+            )
+    return standings
+
+
+if __name__ == "__main__":
+    from ai_greedy import move as ai_greedy
+    from ai_random import move as ai_random
+
+    round_robin([ai_greedy, ai_random], rounds=10)
+    play_match(ai_greedy, ai_random, sprt=DEFAULT_SPRT)
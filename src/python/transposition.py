@@ -0,0 +1,140 @@
+# Transposition table for the search in evaluate.py.
+#
+# The same position can be reached through different move orders, so the result of
+# searching it is stored under its Zobrist hash (see position.py) and reused. Each entry
+# stores the depth that the position was searched to (in ply remaining), the score, what
+# kind of bound the score is, and the best move found.
+#
+# The table has a fixed number of entries and is stored as two flat arrays of 64-bit
+# integers: one of hashes and one of packed data. Each entry therefore takes exactly
+# ENTRY_BYTES, so the size can be given in megabytes. Data is packed as follows:
+#
+#   bits 0-15   score, offset by SCORE_OFFSET so that it is never negative
+#   bits 16-23  depth searched, in ply remaining
+#   bits 24-25  bound type (BOUND_EXACT, BOUND_LOWER, or BOUND_UPPER)
+#   bits 32-39  best move as a byte of XXXXYYYY (start, end), like the C++ code; 0 if none
+#   bits 40-47  generation (search number) that stored the entry
+#
+# An empty slot has data of 0. Each hash maps to a single slot; a new entry replaces the
+# old one if the old one is from a previous search, or was not searched as deeply.
+#
+# If mirror is set, the search stores positions by their canonical mirror (see
+# position.py), so that a position and its mirror share an entry. The table itself
+# doesn't change; it is up to the search to hash the mirror, and to mirror the scores
+# and moves it stores and probes.
+
+from array import array
+
+ENTRY_BYTES = 16  # bytes per entry: one hash and one packed data integer.
+DEFAULT_ENTRIES = 1 << 20  # default number of entries (16 MB).
+
+BOUND_EXACT = 0  # score is exact.
+BOUND_LOWER = 1  # score is a lower bound (search failed high).
+BOUND_UPPER = 2  # score is an upper bound (search failed low).
+
+DEPTH_UNLIMITED = 255  # depth stored for searches without a depth limit.
+SCORE_OFFSET = 1 << 15
+
+
+def flip_bound(bound):
+    """Return the bound type of a score after negating it (i.e., switching players)."""
+    if bound == BOUND_LOWER:
+        return BOUND_UPPER
+    elif bound == BOUND_UPPER:
+        return BOUND_LOWER
+    return bound
+
+
+def encode_move(move):
+    """Encode a (start, end) move as a byte."""
+    return (move[0] << 4) | move[1]
+
+
+def decode_move(byte):
+    """Decode a byte into a (start, end) move, or None if there is no move."""
+    return (byte >> 4, byte & 15) if byte else None
+
+
+class TranspositionTable:
+    """Fixed-size table mapping position hashes to search results. The size is given in
+    entries or in megabytes, and is rounded down to a power of two entries."""
+
+    def __init__(self, entries=None, megabytes=None, mirror=False):
+        if entries is None:
+            entries = (
+                DEFAULT_ENTRIES
+                if megabytes is None
+                else int(megabytes * 1024 * 1024) // ENTRY_BYTES
+            )
+        self.size = 1 << (max(entries, 1).bit_length() - 1)  # round to power of two.
+        self.mask = self.size - 1
+        self.mirror = mirror  # whether positions are stored by their canonical mirror.
+        self.clear()
+
+    def clear(self):
+        """Empty the table and reset statistics."""
+        self.hashes = array("Q", bytes(8 * self.size))
+        self.data = array("Q", bytes(8 * self.size))
+        self.generation = 0
+        self.probes = 0
+        self.hits = 0
+        self.stores = 0
+        self.overwrites = 0
+
+    def new_search(self):
+        """Mark the start of a new search, so that entries from previous searches are
+        replaced first."""
+        self.generation = (self.generation + 1) & 255
+
+    def probe(self, key):
+        """Look up a hash. Returns a tuple of (depth, score, bound, move), or None if the
+        position is not in the table."""
+        self.probes += 1
+        slot = key & self.mask
+        data = self.data[slot]
+        if data == 0 or self.hashes[slot] != key:
+            return None
+        self.hits += 1
+        return (
+            (data >> 16) & 255,
+            (data & 0xFFFF) - SCORE_OFFSET,
+            (data >> 24) & 3,
+            decode_move((data >> 32) & 255),
+        )
+
+    def store(self, key, depth, score, bound, move=None):
+        """Store a search result for a hash, subject to the replacement policy."""
+        slot = key & self.mask
+        old = self.data[slot]
+        if old != 0 and self.hashes[slot] != key:
+            if (old >> 40) == self.generation and ((old >> 16) & 255) > depth:
+                return  # keep the deeper entry from the current search.
+            self.overwrites += 1
+        self.stores += 1
+        self.hashes[slot] = key
+        self.data[slot] = (
+            (self.generation << 40)
+            | ((encode_move(move) if move else 0) << 32)
+            | (bound << 24)
+            | (min(depth, DEPTH_UNLIMITED) << 16)
+            | (score + SCORE_OFFSET)
+        )
+
+    def hit_rate(self):
+        """Return the fraction of probes that found their position."""
+        return self.hits / self.probes if self.probes else 0.0
+
+    def stats(self):
+        """Return a dict of statistics about table usage."""
+        used = self.size - self.data.count(0)
+        return {
+            "entries": self.size,
+            "megabytes": self.size * ENTRY_BYTES / (1024 * 1024),
+            "used": used,
+            "fill": used / self.size,
+            "probes": self.probes,
+            "hits": self.hits,
+            "hit_rate": self.hit_rate(),
+            "stores": self.stores,
+            "overwrites": self.overwrites,
+        }